@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-from msodumper import globals, docstream
+from msodumper import globals, docstream, ole
 import sys
 sys = reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -17,9 +17,7 @@ class DOCDumper:
         self.params = params
 
     def dump(self):
-        file = open(self.filepath, 'rb')
-        strm = docstream.createDOCFile(file.read(), self.params)
-        file.close()
+        strm = docstream.createDOCFile(ole.mapFile(self.filepath), self.params)
         dirnames = strm.getDirectoryNames()
         print '<?xml version="1.0"?>\n<streams ole-type="%s">' % strm.getName()
         if strm.error:
@@ -34,7 +32,8 @@ class DOCDumper:
 def main(args):
     params = globals.Params()
     dumper = DOCDumper(args[1], params)
-    dumper.dump()
+    with globals.outputTo(globals.FileSink()):
+        dumper.dump()
 
 if __name__ == '__main__':
     main(sys.argv)
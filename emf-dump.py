@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-from msodumper import emfrecord
+from msodumper import emfrecord, globals
 import sys
 sys = reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -25,7 +25,8 @@ class EMFDumper:
 
 def main(args):
     dumper = EMFDumper(args[1])
-    dumper.dump()
+    with globals.outputTo(globals.FileSink()):
+        dumper.dump()
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""Compare the per-field cost of the BinaryStream readers of this checkout
+against those of another checkout, e.g. a git worktree of an older commit:
+
+    git worktree add /tmp/baseline <commit>
+    misc/bench-binarystream.py --baseline /tmp/baseline"""
+
+import sys, os.path, optparse, imp, time
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(top)
+
+from msodumper.binarystream import BinaryStream
+
+
+def loadBinaryStream(checkout):
+    """Import the BinaryStream class of another checkout, without mixing up
+    its modules with the ones of this checkout."""
+    package = imp.load_package("baseline_msodumper", os.path.join(checkout, "msodumper"))
+    __import__("baseline_msodumper.binarystream")
+    return package.binarystream.BinaryStream
+
+
+def timeReads(strm, read, calls, size):
+    """Time calls invocations of read, return the time per decoded field."""
+    strm.pos = 0
+    start = time.time()
+    for i in xrange(calls):
+        read()
+    return (time.time() - start) / (calls * size)
+
+
+def measure(baseClass, method, width, count, repeat, batch=1):
+    """Best time per field of the baseline and of this checkout.  Short runs
+    of the two alternate, so that both see the same machine load, and the
+    best of many of them is taken."""
+    bytes = "\x5A" * (width * count)
+    old = baseClass(bytes)
+    new = BinaryStream(bytes)
+    oldRead = getattr(old, method)
+    newRead = getattr(new, method)
+    if batch > 1:
+        newRead = lambda: new.readuInt32Array(batch)
+    before = after = None
+    for i in xrange(repeat):
+        t = timeReads(old, oldRead, count, 1)
+        before = min(before, t) if before is not None else t
+        t = timeReads(new, newRead, count // batch, batch)
+        after = min(after, t) if after is not None else t
+    return before, after
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--baseline", dest="baseline", default=None, metavar="DIR",
+                      help="Top directory of the checkout to compare against.")
+    parser.add_option("--count", dest="count", type="int", default=5000,
+                      help="Number of fields read per run.")
+    parser.add_option("--repeat", dest="repeat", type="int", default=400,
+                      help="Number of runs per measurement; the best one is reported.")
+    options, args = parser.parse_args()
+    if options.baseline is None:
+        parser.error("--baseline is required")
+
+    baseClass = loadBinaryStream(options.baseline)
+    print("%-24s %12s %12s" % ("field", "before (ns)", "after (ns)"))
+    for method, width in (("readuInt8", 1), ("readuInt16", 2), ("readuInt32", 4),
+                          ("readFloat32", 4), ("readuInt64", 8)):
+        before, after = measure(baseClass, method, width, options.count, options.repeat)
+        print("%-24s %12.1f %12.1f" % (method, before * 1e9, after * 1e9))
+    # the baseline may not have readuInt32Array(), compare with single reads.
+    before, after = measure(baseClass, "readuInt32", 4, options.count, options.repeat, batch=16)
+    print("%-24s %12.1f %12.1f" % ("readuInt32Array(16)", before * 1e9, after * 1e9))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,61 @@
+#!/usr/bin/env python2
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""Measure how long it takes to extract a large stream from a compound
+document.  The documents are generated in memory, with either 512 or 4096
+byte sectors, and with the stream stored either in consecutive sectors or in
+sectors chained in reverse order (no two neighbours adjacent)."""
+
+import sys, os.path, optparse, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from msodumper import ole, globals
+from docbuilder import buildCompoundFile
+
+
+def bench (streamSize, secShift, fragmented, repeat):
+    secSize = 2**secShift
+    data = "".join([chr(i % 256)*secSize for i in xrange(0, (streamSize + secSize - 1)//secSize)])
+    chars = buildCompoundFile(data[:streamSize], secShift, fragmented)
+    header = ole.Header(chars, globals.params)
+    header.parse()
+    directory = header.getDirectory()
+    directory.parseDirEntries()
+    entry = directory.getDirectoryEntries()[1]
+
+    best = None
+    for i in xrange(0, repeat):
+        start = time.time()
+        bytes = directory.getRawStream(entry)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    assert len(bytes) >= streamSize
+    return best
+
+
+def main ():
+    parser = optparse.OptionParser()
+    parser.add_option("--sizes", dest="sizes", default="1,8,32", metavar="MB",
+        help="Comma-separated list of stream sizes in MB.  The default is '1,8,32'.")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+        help="Number of runs per measurement; the best one is reported.")
+    options, args = parser.parse_args()
+
+    print("%8s %8s %12s %12s %12s"%("size", "sector", "layout", "total (s)", "per MB (ms)"))
+    for size in [int(s) for s in options.sizes.split(",") if s]:
+        for secShift in (9, 12):
+            for fragmented in (False, True):
+                elapsed = bench(size*1024*1024, secShift, fragmented, options.repeat)
+                layout = fragmented and "fragmented" or "contiguous"
+                print("%6dMB %8d %12s %12.4f %12.3f"%
+                      (size, 2**secShift, layout, elapsed, elapsed*1000.0/size))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
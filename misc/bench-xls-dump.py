@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""Measure end-to-end xls-dump run times on a generated workbook with a large
+shared string table.  Pass --dumper to time the xls-dump.py of another
+checkout against the same file."""
+
+import sys, os, os.path, optparse, subprocess, tempfile, time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from docbuilder import buildCompoundFile, buildWorkbook
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def bench (dumper, filePath, mode, repeat, extraArgs=[]):
+    args = [sys.executable, dumper, "--dump-mode=" + mode] + extraArgs + [filePath]
+    best = None
+    devnull = open(os.devnull, "w")
+    for i in xrange(0, repeat):
+        start = time.time()
+        subprocess.check_call(args, stdout=devnull)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    devnull.close()
+    return best
+
+
+def main ():
+    parser = optparse.OptionParser()
+    parser.add_option("--dumper", dest="dumper", default=os.path.join(top, "xls-dump.py"),
+        help="Path to the xls-dump.py to run.  The default is the one of this checkout.")
+    parser.add_option("--strings", dest="strings", type="int", default=50000,
+        help="Number of distinct shared strings.")
+    parser.add_option("--rows", dest="rows", type="int", default=2000,
+        help="Number of rows of LABELSST cells per sheet, 8 per row.")
+    parser.add_option("--sheets", dest="sheets", type="int", default=1,
+        help="Number of sheets.")
+    parser.add_option("--select", dest="select", default=None, metavar="SHEET",
+        help="Also time dumping only SHEET, see xls-dump --sheet.")
+    parser.add_option("--jobs", dest="jobs", type="int", default=None, metavar="N",
+        help="Also time the canonical-xml mode with N processes, see xls-dump --jobs.")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+        help="Number of runs per measurement; the best one is reported.")
+    options, args = parser.parse_args()
+
+    fd, filePath = tempfile.mkstemp(suffix=".xls")
+    try:
+        os.write(fd, buildCompoundFile(buildWorkbook(options.strings, options.rows,
+                                                     numSheets=options.sheets)))
+        os.close(fd)
+        print("%s: %d bytes"%(options.dumper, os.path.getsize(filePath)))
+        print("%22s %12s"%("mode", "best (s)"))
+        for mode in ("flat", "canonical-xml"):
+            print("%22s %12.3f"%(mode, bench(options.dumper, filePath, mode, options.repeat)))
+            if options.select != None:
+                print("%22s %12.3f"%(mode + " --sheet", bench(options.dumper, filePath, mode,
+                    options.repeat, ["--sheet", options.select])))
+        if options.jobs != None:
+            print("%22s %12.3f"%("canonical-xml -j%d"%options.jobs, bench(options.dumper, filePath,
+                "canonical-xml", options.repeat, ["--jobs", str(options.jobs)])))
+    finally:
+        os.remove(filePath)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""Measure how long it takes to read a sheet of numbers, 1M cells by default,
+stored either as MULRK records or as an RK record per cell: both building the
+model of the canonical-xml mode and parsing the records for the flat mode."""
+
+import sys, os.path, optparse, time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from msodumper import xlsstream, xlsmodel, globals
+from docbuilder import buildNumericWorkbook
+
+
+def fillModel (bytes):
+    strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+    model = xlsmodel.Workbook()
+    try:
+        while True:
+            strm.fillModel(model)
+    except xlsstream.EndOfStream:
+        pass
+
+def parseRecords (bytes):
+    strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+    try:
+        while True:
+            handler = strm.getNextRecordHandler()
+            if handler != None:
+                handler.parseBytes()
+    except xlsstream.EndOfStream:
+        pass
+
+def bench (func, bytes, repeat):
+    best = None
+    for i in xrange(0, repeat):
+        start = time.time()
+        func(bytes)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main ():
+    parser = optparse.OptionParser()
+    parser.add_option("--rows", dest="rows", type="int", default=4000,
+        help="Number of rows.")
+    parser.add_option("--cols", dest="cols", type="int", default=250,
+        help="Number of columns.")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+        help="Number of runs per measurement; the best one is reported.")
+    options, args = parser.parse_args()
+
+    print("%d x %d cells"%(options.rows, options.cols))
+    print("%8s %12s %12s"%("records", "model (s)", "parse (s)"))
+    for singleCells in (False, True):
+        bytes = buildNumericWorkbook(options.rows, options.cols, singleCells)
+        print("%8s %12.3f %12.3f"%(singleCells and "RK" or "MULRK",
+              bench(fillModel, bytes, options.repeat), bench(parseRecords, bytes, options.repeat)))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
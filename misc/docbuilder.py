@@ -0,0 +1,206 @@
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+"""Generate synthetic documents for the benchmarks in this directory: a
+compound document holding a single stream, and BIFF8 workbook streams with
+a large shared string table or many numbers."""
+
+import sys, os.path, struct
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from msodumper import globals
+
+
+def buildCompoundFile (data, secShift=9, fragmented=False, name=u"Workbook"):
+    """Build a compound document holding data as its only stream.  The stream
+    is always stored in the regular sectors, so data should not be smaller
+    than 4096 bytes.  With fragmented set, its sectors are chained in reverse
+    order (no two neighbours adjacent)."""
+
+    streamSize = len(data)
+    secSize = 2**secShift
+    idsPerSec = secSize//4
+    numData = (streamSize + secSize - 1)//secSize
+
+    # number of SAT and MSAT sectors needed depends on the total sector count,
+    # which in turn includes them.
+    numSAT, numMSAT = 0, 0
+    while True:
+        total = numSAT + numMSAT + 1 + numData
+        needSAT = (total + idsPerSec - 1)//idsPerSec
+        needMSAT = max(0, (needSAT - 109 + idsPerSec - 2)//(idsPerSec - 1))
+        if (needSAT, needMSAT) == (numSAT, numMSAT):
+            break
+        numSAT, numMSAT = needSAT, needMSAT
+
+    satIDs = range(0, numSAT)
+    msatIDs = range(numSAT, numSAT + numMSAT)
+    dirID = numSAT + numMSAT
+    dataIDs = range(dirID + 1, dirID + 1 + numData)
+    if fragmented:
+        dataIDs.reverse()
+
+    sat = [-1]*(numSAT*idsPerSec)
+    for secID in satIDs:
+        sat[secID] = -3
+    for secID in msatIDs:
+        sat[secID] = -4
+    sat[dirID] = -2
+    for i in xrange(0, numData - 1):
+        sat[dataIDs[i]] = dataIDs[i+1]
+    sat[dataIDs[-1]] = -2
+
+    buf = bytearray(secSize*(total + 1))
+    def putSector (secID, data):
+        pos = globals.getSectorPos(secID, secSize)
+        buf[pos:pos+len(data)] = data
+
+    # header
+    msatHead = satIDs[:109] + [-1]*(109 - min(109, numSAT))
+    header = "\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1" + "\x00"*16
+    header += struct.pack("<HH2sHH6xLLlLLlLlL", 0x3E, secShift == 12 and 4 or 3,
+        "\xFE\xFF", secShift, 6, 0, numSAT, dirID, 0, 4096, -2, 0,
+        numMSAT and msatIDs[0] or -2, numMSAT)
+    header += struct.pack("<109l", *msatHead)
+    buf[0:512] = header
+
+    # additional MSAT sectors
+    rest = satIDs[109:]
+    for i, secID in enumerate(msatIDs):
+        ids = rest[:idsPerSec-1]
+        rest = rest[idsPerSec-1:]
+        ids += [-1]*(idsPerSec - 1 - len(ids))
+        if i + 1 < numMSAT:
+            ids.append(msatIDs[i+1])
+        else:
+            ids.append(-2)
+        putSector(secID, struct.pack("<%dl"%idsPerSec, *ids))
+
+    # SAT
+    for i, secID in enumerate(satIDs):
+        putSector(secID, struct.pack("<%dl"%idsPerSec, *sat[i*idsPerSec:(i+1)*idsPerSec]))
+
+    # directory: root storage with a single child stream
+    def dirEntry (name, type, child, secID, size):
+        name = name.encode('UTF-16LE')
+        return struct.pack("<64sHBBlll16s4x16xlLL", name, len(name) + 2, type, 1,
+            -1, -1, child, "\x00"*16, secID, size, 0)
+    entries = dirEntry(u"Root Entry", 5, 1, -2, 0) + \
+        dirEntry(name, 2, -1, dataIDs[0], streamSize)
+    putSector(dirID, entries)
+
+    # stream data
+    for i, secID in enumerate(dataIDs):
+        putSector(secID, data[i*secSize:(i+1)*secSize])
+
+    return str(buf)
+
+
+# BIFF8 record payloads are at most this long, longer ones are split into
+# CONTINUE records.
+MaxRecordSize = 8224
+
+def record (type, data):
+    return struct.pack("<HH", type, len(data)) + data
+
+def bof (dt):
+    # BIFF8, build 0x0DBB, year 1996, no file history or version flags
+    return record(0x0809, struct.pack("<HHHHLL", 0x0600, dt, 0x0DBB, 0x07CC, 0, 0x06))
+
+def eof ():
+    return record(0x000A, "")
+
+def sst (strings, refCount):
+    """SST, followed by as many CONTINUE records as needed.  Strings that
+    don't fit into a record are split, the way Excel does it: the remainder
+    starts the next CONTINUE with a new option flags byte."""
+    records = []
+    cur = struct.pack("<LL", refCount, len(strings))
+    for s in strings:
+        # the character count and option flags may not be split
+        if len(cur) + 4 > MaxRecordSize:
+            records.append(cur)
+            cur = ""
+        cur += struct.pack("<HB", len(s), 0)
+        while len(cur) + len(s) > MaxRecordSize:
+            n = MaxRecordSize - len(cur)
+            cur += s[:n]
+            records.append(cur)
+            cur = "\x00"
+            s = s[n:]
+        cur += s
+    records.append(cur)
+    return record(0x00FC, records[0]) + "".join([record(0x003C, r) for r in records[1:]])
+
+def boundSheet (pos, name):
+    return record(0x0085, struct.pack("<LBBBB", pos, 0, 0, len(name), 0) + name)
+
+def labelSST (row, col, isst):
+    return record(0x00FD, struct.pack("<HHHL", row, col, 0x0F, isst))
+
+def rkValue (i):
+    """Return an RK value: an integer, an integer multiplied by 100 or a
+floating-point number, depending on i."""
+    if i % 3 == 0:
+        return (i << 2) | 0x2
+    if i % 3 == 1:
+        return (i << 2) | 0x3
+    return struct.unpack("<Q", struct.pack("<d", i + 0.5))[0] >> 32 & 0xFFFFFFFC
+
+def mulRK (row, col, rkvals):
+    data = "".join([struct.pack("<HL", 0x0F, rkval) for rkval in rkvals])
+    return record(0x00BD, struct.pack("<HH", row, col) + data + struct.pack("<H", col + len(rkvals) - 1))
+
+def rk (row, col, rkval):
+    return record(0x027E, struct.pack("<HHHL", row, col, 0x0F, rkval))
+
+def buildNumericWorkbook (numRows, numCols, singleCells=False):
+    """Return a BIFF8 Workbook stream with one sheet of numRows x numCols
+numbers, stored as a MULRK record per row, or as an RK record per cell if
+singleCells is True."""
+    sheet = [bof(0x0010)]
+    sheet.append(record(0x0200, struct.pack("<LLHHH", 0, numRows, 0, numCols, 0)))
+    for row in xrange(numRows):
+        rkvals = [rkValue(row*numCols + col) for col in xrange(numCols)]
+        if singleCells:
+            sheet.extend([rk(row, col, rkval) for col, rkval in enumerate(rkvals)])
+        else:
+            sheet.append(mulRK(row, 0, rkvals))
+    sheet.append(eof())
+
+    pos = len(bof(0x0005)) + len(boundSheet(0, "Sheet1")) + len(eof())
+    return bof(0x0005) + boundSheet(pos, "Sheet1") + eof() + "".join(sheet)
+
+def buildWorkbook (numStrings, numRows, numCols=8, strLen=24, numSheets=1):
+    """Return a BIFF8 Workbook stream with numStrings distinct shared strings
+and numSheets sheets named Sheet1, Sheet2 ..., each with numRows x numCols
+LABELSST cells referencing them."""
+    strings = ["string %d "%i + "x"*strLen for i in xrange(numStrings)]
+    strings = [s[:strLen] for s in strings]
+
+    sheets = []
+    isst = 0
+    for i in xrange(numSheets):
+        sheet = [bof(0x0010)]
+        sheet.append(record(0x0200, struct.pack("<LLHHH", 0, numRows, 0, numCols, 0)))
+        for row in xrange(numRows):
+            for col in xrange(numCols):
+                sheet.append(labelSST(row, col, isst % numStrings))
+                isst += 1
+        sheet.append(eof())
+        sheets.append("".join(sheet))
+
+    names = ["Sheet%d"%(i+1) for i in xrange(numSheets)]
+    sharedStrings = sst(strings, isst)
+    pos = len(bof(0x0005)) + sum([len(boundSheet(0, name)) for name in names]) + \
+        len(sharedStrings) + len(eof())
+    boundSheets = []
+    for name, sheet in zip(names, sheets):
+        boundSheets.append(boundSheet(pos, name))
+        pos += len(sheet)
+    return bof(0x0005) + "".join(boundSheets) + sharedStrings + eof() + "".join(sheets)
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
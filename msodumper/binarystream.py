@@ -7,16 +7,20 @@
 
 import globals
 import struct
+from globals import uInt8, uInt16, int16, uInt32, int32, float32, uInt64
 from xml.sax.saxutils import quoteattr
 
+uInt24 = struct.Struct("<HB")
+recordHeader = struct.Struct("<II")
 
-class BinaryStream:
-    """Represents a binary stream, e.g. 'WordDocument' in an [MS-DOC] file."""
+
+class BinaryStream(globals.ByteStream):
+    """Represents a binary stream, e.g. 'WordDocument' in an [MS-DOC] file.
+
+The fixed-width read*() methods are inherited from globals.ByteStream."""
 
     def __init__(self, bytes, params=None, name=None, mainStream=None, doc=None):
-        self.bytes = bytes
-        self.size = len(self.bytes)
-        self.pos = 0
+        globals.ByteStream.__init__(self, bytes)
         self.params = params
         self.name = name
         self.mainStream = mainStream
@@ -47,89 +51,66 @@ class BinaryStream:
         return ret[2:len(ret) - 2]
 
     def getuInt8(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<B", bytes[pos:pos + 1])[0]
-
-    def readuInt8(self):
-        ret = self.getuInt8()
-        self.pos += 1
-        return ret
+        return uInt8.unpack(bytes[pos:pos + 1])[0]
 
     def getuInt16(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<H", bytes[pos:pos + 2])[0]
-
-    def readuInt16(self):
-        ret = self.getuInt16()
-        self.pos += 2
-        return ret
+        return uInt16.unpack(bytes[pos:pos + 2])[0]
 
     def getInt16(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<h", bytes[pos:pos + 2])[0]
-
-    def readInt16(self):
-        ret = self.getInt16()
-        self.pos += 2
-        return ret
+        return int16.unpack(bytes[pos:pos + 2])[0]
 
     def getuInt24(self):
-        return struct.unpack("<I", self.bytes[self.pos:self.pos + 3] + "\x00")[0]
+        low, high = uInt24.unpack(self.bytes[self.pos:self.pos + 3])
+        return low | (high << 16)
 
     def getuInt32(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<I", bytes[pos:pos + 4])[0]
-
-    def readuInt32(self):
-        ret = self.getuInt32()
-        self.pos += 4
-        return ret
+        return uInt32.unpack(bytes[pos:pos + 4])[0]
 
     def getInt32(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<i", bytes[pos:pos + 4])[0]
-
-    def readInt32(self):
-        ret = self.getInt32()
-        self.pos += 4
-        return ret
+        return int32.unpack(bytes[pos:pos + 4])[0]
 
     def getFloat32(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<f", bytes[pos:pos + 4])[0]
-
-    def readFloat32(self):
-        ret = self.getFloat32()
-        self.pos += 4
-        return ret
+        return float32.unpack(bytes[pos:pos + 4])[0]
 
     def getuInt64(self, bytes=None, pos=None):
-        if not bytes:
+        if bytes is None:
             bytes = self.bytes
-        if not pos:
+        if pos is None:
+            pos = self.pos
+        return uInt64.unpack(bytes[pos:pos + 8])[0]
+
+    def getRecordHeader(self, pos=None):
+        """Returns the (type, size) pair that starts an EMF record."""
+        if pos is None:
             pos = self.pos
-        return struct.unpack("<Q", bytes[pos:pos + 8])[0]
+        return recordHeader.unpack(self.bytes[pos:pos + 8])
 
-    def readuInt64(self):
-        ret = self.getuInt64()
+    def readRecordHeader(self):
+        ret = recordHeader.unpack(self.bytes[self.pos:self.pos + 8])
         self.pos += 8
         return ret
 
@@ -166,21 +147,8 @@ class BinaryStream:
     def dump(self):
         print '<stream name="%s" size="%s"/>' % (self.quoteAttr(globals.encodeName(self.name)), self.size)
 
-    # compat methods to make msodraw happy
-    def readUnsignedInt(self, size):
-        if size == 1:
-            return self.readuInt8()
-        elif size == 2:
-            return self.readuInt16()
-        elif size == 4:
-            return self.readuInt32()
-        raise Exception
-
-    def readSignedInt(self, size):
-        if size == 4:
-            return self.readInt32()
-        raise Exception
-
+    # compat methods to make msodraw happy; unlike in the base class, these
+    # don't check or clamp the position
     def readBytes(self, length):
         r = self.bytes[self.pos:self.pos + length]
         self.pos += length
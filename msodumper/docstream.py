@@ -85,6 +85,8 @@ class GsfDOCFile(DOCFile):
     def initWW8(self):
         self.streams = {}
         self.gsf.gsf_init()
+        # gsf wants a real string, not a mapped file.
+        self.chars = self.chars[:]
         gsfInput = self.gsf.gsf_input_memory_new(self.chars, len(self.chars), False)
         self.disableStderr()
         gsfInfile = self.gsf.gsf_infile_msole_new(gsfInput, None)
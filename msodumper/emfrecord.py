@@ -64,10 +64,9 @@ class EMFStream(BinaryStream):
         emrHeader = EmrHeader(self)
         emrHeader.dump()
         for i in range(emrHeader.header.Records):
-            id = self.getuInt32()
+            id, size = self.getRecordHeader()
             record = RecordType[id]
             type = record[0]
-            size = self.getuInt32(pos=self.pos + 4)
             # EmrHeader is already dumped
             if i:
                 print '<record index="%s" type="%s">' % (i, type)
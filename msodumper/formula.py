@@ -11,13 +11,6 @@ import globals
 class InvalidCellAddress(Exception): pass
 class FormulaParserError(Exception): pass
 
-class ColRelU(object):
-    def __init__ (self, strm):
-        bits = strm.readUnsignedInt(2)
-        self.col = (bits & 0x3FFF)
-        self.colRelative = (bits & 0x4000) != 0
-        self.rowRelative = (bits & 0x8000) != 0
-
 def toColName (colID):
     if colID > 255:
         globals.error("Column ID greater than 255")
@@ -74,53 +67,21 @@ class CellRange(object):
         row2 = toAbsName(row2, self.isLastRowRelative)
         return col1 + row1 + ':' + col2 + row2
 
-def parseCellAddress (bytes):
-    if len(bytes) != 4:
-        globals.error("Byte size is %d but expected 4 bytes for cell address.\n"%len(bytes))
-        raise InvalidCellAddress
-
-    row = globals.getSignedInt(bytes[0:2])
-    col = globals.getSignedInt(bytes[2:4])
-    colRelative = ((col & 0x4000) != 0)
-    rowRelative = ((col & 0x8000) != 0)
-    col = (col & 0x00FF)
-    obj = CellAddress(col, row, colRelative, rowRelative)
-    return obj
-
-def parseCellRangeAddress (bytes):
-    if len(bytes) != 8:
-        raise InvalidCellAddress
-
+def toCellRange (firstRow, lastRow, firstCol, lastCol):
+    """Return the cell range of a formula token, the relative flags of its
+rows and columns being the top bits of the column fields."""
     obj = CellRange()
-    obj.firstRow = globals.getSignedInt(bytes[0:2])
-    obj.lastRow  = globals.getSignedInt(bytes[2:4])
-    obj.firstCol = globals.getSignedInt(bytes[4:6])
-    obj.lastCol  = globals.getSignedInt(bytes[6:8])
-
-    obj.isFirstColRelative = ((obj.firstCol & 0x4000) != 0)
-    obj.isFirstRowRelative = ((obj.firstCol & 0x8000) != 0)
-    obj.firstCol = (obj.firstCol & 0x00FF)
-
-    obj.isLastColRelative = ((obj.lastCol & 0x4000) != 0)
-    obj.isLastRowRelative = ((obj.lastCol & 0x8000) != 0)
-    obj.lastCol = (obj.lastCol & 0x00FF)
+    obj.firstRow = firstRow
+    obj.lastRow  = lastRow
+    obj.isFirstColRelative = ((firstCol & 0x4000) != 0)
+    obj.isFirstRowRelative = ((firstCol & 0x8000) != 0)
+    obj.firstCol = (firstCol & 0x00FF)
+    obj.isLastColRelative = ((lastCol & 0x4000) != 0)
+    obj.isLastRowRelative = ((lastCol & 0x8000) != 0)
+    obj.lastCol = (lastCol & 0x00FF)
     return obj
 
 
-class RgceLocRel(object):
-
-    def __init__ (self, strm):
-        self.row = strm.readSignedInt(2)
-        self.col = strm.readSignedInt(2)
-        self.colRelative = ((self.col & 0x4000) != 0)
-        self.rowRelative = ((self.col & 0x8000) != 0)
-        self.col = (self.col & 0x00FF)
-        self.loc = CellAddress(self.col, self.row, self.colRelative, self.rowRelative)
-
-    def getText (self):
-        return self.loc.toString()
-
-
 # ============================================================================
 
 class TokenType:
@@ -150,17 +111,20 @@ class PtgDataType(object):
         return 'unknown'
 
 class PtgBase(object):
-    def __init__ (self, strm, opcode, parseType):
+    """Formula token.  The fields of its fixed size part, after the opcode,
+are unpacked with layout and stored in the attributes named in fields; tokens
+with a variable size part set variableSize and read it in parseBytes()."""
+
+    layout = None
+    fields = ()
+    variableSize = False
+    tokenType = TokenType.Unknown
+
+    def __init__ (self, opcode, parseType):
         self.opcode = opcode
-        self.strm = strm
-        self.tokenType = TokenType.Unknown
         self.parseType = parseType
 
-    def parse (self):
-        self.parseBytes()
-        self.strm = None # no need to hold reference to the stream.
-
-    def parseBytes (self):
+    def parseBytes (self, strm):
         # derived class should overwrite this method.
         pass
 
@@ -168,172 +132,243 @@ class PtgBase(object):
         return ''
 
 class PtgExp(PtgBase):
-    def parseBytes (self):
-        self.row = self.strm.readUnsignedInt(2)
-        self.col = self.strm.readUnsignedInt(2)
+    layout = struct.Struct("<HH")
+    fields = ('row', 'col')
 
     def getText (self):
         return "(ptgexp: row=%d, col=%d)"%(self.row, self.col)
 
-class PtgAdd(PtgBase):
-    def parseBytes (self):
-        pass
+class PtgTbl(PtgBase):
+    layout = struct.Struct("<HH")
+    fields = ('row', 'col')
 
     def getText (self):
-        return "(add)"
-
-class PtgMul(PtgBase):
-    def parseBytes (self):
-        pass
-
-    def getText (self):
-        return "(multiply)"
-
-class PtgDiv(PtgBase):
-    def parseBytes (self):
-        pass
+        return "(ptgtbl: row=%d, col=%d)"%(self.row, self.col)
+
+class PtgOperator(PtgBase):
+    """Operator, or any other token without data."""
+
+    texts = {
+        0x03: "(add)",
+        0x04: "(sub)",
+        0x05: "(multiply)",
+        0x06: "(div)",
+        0x07: "(power)",
+        0x08: "(concat)",
+        0x09: "(lt)",
+        0x0A: "(le)",
+        0x0B: "(eq)",
+        0x0C: "(ge)",
+        0x0D: "(gt)",
+        0x0E: "(ne)",
+        0x0F: "(isect)",
+        0x10: "(union)",
+        0x11: "(range)",
+        0x12: "(unary plus)",
+        0x13: "(unary minux)",
+        0x14: "(percent)",
+        0x15: "(paren)",
+        0x16: "(arg missing)"
+    }
 
     def getText (self):
-        return "(div)"
-
-class PtgMissArg(PtgBase):
-    def parseBytes (self):
-        pass
+        return PtgOperator.texts[self.opcode]
+
+class PtgMem(PtgBase):
+    """Size of the tokens of a reference expression, and whether and how it
+was evaluated."""
+    layout = struct.Struct("<4xH")
+    fields = ('length',)
+
+    names = {
+        0x06: 'mem area',
+        0x07: 'mem err',
+        0x08: 'mem no mem'
+    }
 
     def getText (self):
-        return '(arg missing)'
+        return "(%s: type=%s size=%d)"%(PtgMem.names[self.opcode & 0x1F],
+            PtgDataType.getText(getPtgDataType(self.opcode)), self.length)
 
 class PtgMemFunc(PtgBase):
-    def parseBytes(self):
-        self.dataType = getPtgDataType(self.opcode)
-        self.length = self.strm.readUnsignedInt(2)
+    layout = struct.Struct("<H")
+    fields = ('length',)
 
     def getText (self):
-        return "(mem func: type=%s size=%d)"%(PtgDataType.getText(self.dataType), self.length)
+        return "(mem func: type=%s size=%d)"%(PtgDataType.getText(getPtgDataType(self.opcode)), self.length)
 
-class PtgAreaN(PtgBase):
-    def parseBytes(self):
-        self.dataType = getPtgDataType(self.opcode)
-        bytes = self.strm.readBytes(8)
-        self.cellRange = parseCellRangeAddress(bytes)
+class PtgStr(PtgBase):
+    layout = struct.Struct("<B")
+    fields = ('length',)
+    variableSize = True
+
+    def parseBytes (self, strm):
+        self.value = strm.readUnicodeString(self.length)
 
     def getText (self):
-        return "(cell range: " + self.cellRange.getName() + ")"
+        return "(str: '%s')"%self.value
 
-class PtgStr(PtgBase):
-    def parseBytes (self):
-        length = self.strm.readUnsignedInt(1)
-        self.value = self.strm.readUnicodeString(length)
+class PtgExtended(PtgBase):
+    """Token of the 0x18 family, identified by its second byte."""
+    layout = struct.Struct("<B")
+    fields = ('eptg',)
+    variableSize = True
+
+    def parseBytes (self, strm):
+        if self.eptg == 0x19:
+            # PtgList
+            strm.readBytes(12)
+        else:
+            # PtgElf* and PtgSxName
+            strm.readBytes(4)
 
     def getText (self):
-        return "(str: '%s')"%self.value
+        return "(extended: eptg=0x%2.2X)"%self.eptg
 
 class PtgAtt(PtgBase):
-    def parseBytes (self):
-        attType = self.strm.readUnsignedInt(1)
-        if attType == 0x01:
-            # PtgAttSemi: volatile
-            self.attName = 'volatile'
-            self.strm.readBytes(2) # ignore bytes
-        elif attType == 0x10:
-            self.attName = 'sum'
-            self.strm.readBytes(2) # ignore bytes
-        else:
-            raise FormulaParserError("unknown attribute token type (0x%2.2X)"%attType)
+    layout = struct.Struct("<B")
+    fields = ('attType',)
+    variableSize = True
+
+    attNames = {
+        0x01: 'volatile',
+        0x02: 'if',
+        0x04: 'choose',
+        0x08: 'goto',
+        0x10: 'sum',
+        0x20: 'baxcel',
+        0x21: 'baxcel',
+        0x40: 'space',
+        0x41: 'space'
+    }
+
+    def parseBytes (self, strm):
+        if not PtgAtt.attNames.has_key(self.attType):
+            raise FormulaParserError("unknown attribute token type (0x%2.2X)"%self.attType)
+        self.attName = PtgAtt.attNames[self.attType]
+        data = strm.readUnsignedInt(2)
+        if self.attType == 0x04:
+            # jump table of the CHOOSE function
+            strm.readBytes((data + 1)*2)
 
     def getText (self):
         return "(att: %s)"%self.attName
 
 class PtgErr(PtgBase):
-    def parseBytes (self):
-        self.errCode = self.strm.readUnsignedInt(1)
+    layout = struct.Struct("<B")
+    fields = ('errCode',)
 
     def getText (self):
         return "(err: " + str(self.errCode) + ")"
 
+class PtgBool(PtgBase):
+    layout = struct.Struct("<B")
+    fields = ('value',)
+
+    def getText (self):
+        if self.value:
+            return "(bool: TRUE)"
+        return "(bool: FALSE)"
+
 class PtgArray(PtgBase):
-    def parseBytes (self):
-        self.strm.readBytes(7)
+    layout = struct.Struct("<7x")
 
     def getText (self):
         return "(array)"
 
 class PtgName(PtgBase):
-    def parseBytes (self):
-        self.nameIdx = self.strm.readUnsignedInt(4)
+    layout = struct.Struct("<I")
+    fields = ('nameIdx',)
 
     def getText (self):
         return "(name: %d)"%self.nameIdx
 
 class PtgRef(PtgBase):
-    def parseBytes (self):
-        self.row = self.strm.readUnsignedInt(2)
-        self.col = ColRelU(self.strm)
+    layout = struct.Struct("<HH")
+    fields = ('row', 'col')
 
     def getText (self):
-        return "(ref: row=%d,col=%d,rowRelative=%d,colRelative=%d)"%(self.row, self.col.col, self.col.rowRelative, self.col.colRelative)
+        return "(ref: row=%d,col=%d,rowRelative=%d,colRelative=%d)"%(self.row, self.col & 0x3FFF,
+            (self.col & 0x8000) != 0, (self.col & 0x4000) != 0)
+
+class PtgRefErr(PtgBase):
+    layout = struct.Struct("<4x")
+
+    def getText (self):
+        return "(ref: #REF!)"
 
 class PtgArea(PtgBase):
-    def parseBytes (self):
-        bytes = self.strm.readBytes(8)
-        self.cellRange = parseCellRangeAddress(bytes)
+    layout = struct.Struct("<hhhh")
+    fields = ('firstRow', 'lastRow', 'firstCol', 'lastCol')
+
+    def getCellRange (self):
+        return toCellRange(self.firstRow, self.lastRow, self.firstCol, self.lastCol)
+
+    cellRange = property(getCellRange)
 
     def getText (self):
         return "(cell range: " + self.cellRange.getName() + ")"
 
+class PtgAreaN(PtgArea):
+    pass
+
+class PtgAreaErr(PtgBase):
+    layout = struct.Struct("<8x")
+
+    def getText (self):
+        return "(cell range: #REF!)"
+
 class PtgNameX(PtgBase):
-    def parseBytes (self):
-        self.xti = self.strm.readUnsignedInt(2)
-        self.nameID = self.strm.readUnsignedInt(4)
+    layout = struct.Struct("<HI")
+    fields = ('xti', 'nameID')
 
     def getText (self):
         return "(name: xti=%d, name=%d)"%(self.xti, self.nameID)
 
 class PtgNum(PtgBase):
-    def parseBytes (self):
-        self.value = self.strm.readDouble()
+    layout = struct.Struct("<d")
+    fields = ('value',)
 
     def getText (self):
         return "(value: " + str(self.value) + " )"
 
 class PtgInt(PtgBase):
-    def parseBytes (self):
-        self.value = self.strm.readUnsignedInt(2)
+    layout = struct.Struct("<H")
+    fields = ('value',)
 
     def getText (self):
         return "(int: %d)"%self.value
 
-class PtgParen(PtgBase):
-    def getText (self):
-        return '(paren)'
+class _Area3d(PtgArea):
+    layout = struct.Struct("<Hhhhh")
+    fields = ('xti', 'firstRow', 'lastRow', 'firstCol', 'lastCol')
+    tokenType = TokenType.Area3d
 
-class PtgUnion(PtgBase):
     def getText (self):
-        return '(union)'
+        return "(xti=%d,"%self.xti + self.cellRange.getName() + ")"
+
+class PtgRef3d(PtgBase):
+    layout = struct.Struct("<Hhh")
+    fields = ('ixti', 'row', 'col')
 
-class PtgUminus(PtgBase):
     def getText (self):
-        return "(unary minux)"
+        # TODO: parse differently for named range formulas.
+        cell = CellAddress(self.col & 0x00FF, self.row)
+        return "(xti=%d,%s)"%(self.ixti, cell.getName())
 
-class _Area3d(PtgBase):
-    def parseBytes (self):
-        self.xti = self.strm.readUnsignedInt(2)
-        self.cellRange = parseCellRangeAddress(self.strm.readBytes(8))
-        self.tokenType = TokenType.Area3d
+class PtgErr3d(PtgBase):
+    """Reference to a deleted cell or cell range of another sheet."""
+    layout = struct.Struct("<H")
+    fields = ('ixti',)
 
     def getText (self):
-        return "(xti=%d,"%self.xti + self.cellRange.getName() + ")"
+        return "(xti=%d,#REF!)"%self.ixti
 
-class PtgRef3d(PtgBase):
-    def parseBytes (self):
-        self.ixti = self.strm.readUnsignedInt(2)
-        # TODO: parse differently for named range formulas.
-        self.cell = parseCellAddress(self.strm.readBytes(4))
-        self.cell.isColRelative = False
-        self.cell.isRowRelative = False
+class PtgRefErr3d(PtgErr3d):
+    layout = struct.Struct("<H4x")
 
-    def getText (self):
-        return "(xti=%d,%s)"%(self.ixti, self.cell.getName())
+class PtgAreaErr3d(PtgErr3d):
+    layout = struct.Struct("<H8x")
 
 class PtgFuncVar(PtgBase):
 
@@ -713,75 +748,174 @@ class PtgFuncVar(PtgBase):
         0x017B: 'RTD'
     }
 
-    def parseBytes (self):
-        self.dataType = (self.opcode & 0x60)/32  # 0x1 = reference, 0x2 = value, 0x3 = array
-        self.argCount = self.strm.readUnsignedInt(1)
-        tab = self.strm.readUnsignedInt(2)
-        self.funcType = (tab & 0x7FFF)
-        self.isCeTab = (tab & 0x8000) != 0
+    layout = struct.Struct("<BH")
+    fields = ('argCount', 'tab')
 
     def getText (self):
-        if self.isCeTab:
+        if (self.tab & 0x8000) != 0:
             # I'll support this later.
             raise FormulaParserError("special built-in function not supported yet")
 
+        funcType = self.tab & 0x7FFF
+        if not PtgFuncVar.funcTab.has_key(funcType):
+            # unknown function name
+            return '#NAME!'
+
+        return "(func: %s; arg: %d)"%(PtgFuncVar.funcTab[funcType], self.argCount)
+
+class PtgFunc(PtgBase):
+    """Function with a fixed number of arguments."""
+    layout = struct.Struct("<H")
+    fields = ('funcType',)
+
+    def getText (self):
         if not PtgFuncVar.funcTab.has_key(self.funcType):
             # unknown function name
             return '#NAME!'
 
-        return "(func: %s; arg: %d)"%(PtgFuncVar.funcTab[self.funcType], self.argCount)
+        return "(func: %s)"%PtgFuncVar.funcTab[self.funcType]
 
 
 class PtgRefN(PtgBase):
     """Reference to a single cell"""
-
-    def parseBytes (self):
-        self.loc = RgceLocRel(self.strm)
+    layout = struct.Struct("<hh")
+    fields = ('row', 'col')
 
     def getText (self):
         colrel = "abs"
-        if self.loc.colRelative:
+        if (self.col & 0x4000) != 0:
             colrel = "rel"
 
         rowrel = "abs"
-        if self.loc.rowRelative:
+        if (self.col & 0x8000) != 0:
             rowrel = "rel"
 
-        return "(single-ref: col=%d[%s],row=%d[%s])"%(self.loc.col, colrel, self.loc.row, rowrel)
+        return "(single-ref: col=%d[%s],row=%d[%s])"%(self.col & 0x00FF, colrel, self.row, rowrel)
 
 
-_tokenMap = {
+# tokens without a class, by opcode.
+_baseTokens = {
     0x01: PtgExp,
-    0x03: PtgAdd,
-    0x05: PtgMul,
-    0x06: PtgDiv,
-    0x10: PtgUnion,
-    0x13: PtgUminus,
-    0x15: PtgParen,
-    0x16: PtgMissArg,
+    0x02: PtgTbl,
     0x17: PtgStr,
+    0x18: PtgExtended,
     0x19: PtgAtt,
     0x1C: PtgErr,
+    0x1D: PtgBool,
     0x1E: PtgInt,
-    0x1F: PtgNum,
-    0x22: PtgFuncVar,
-    0x24: PtgRef,
-    0x25: PtgArea,
-    0x29: PtgMemFunc,
-    0x2D: PtgAreaN,
-    0x3B: _Area3d,
-    0x40: PtgArray,
-    0x43: PtgName,
-    0x44: PtgRef,
-    0x59: PtgNameX,
-    0x5A: PtgRef3d,
-    0x5B: _Area3d,
-    0x7B: _Area3d,
-
-    0x3A: PtgRef3d,
-    0x42: PtgFuncVar,
-    0x4C: PtgRefN
+    0x1F: PtgNum
 }
+for opcode in PtgOperator.texts.keys():
+    _baseTokens[opcode] = PtgOperator
+
+# tokens whose opcode has the class of their result (reference 0x20, value
+# 0x40 or array 0x60) in bits 5 and 6, by the remaining bits.
+_classifiedTokens = {
+    0x00: PtgArray,
+    0x01: PtgFunc,
+    0x02: PtgFuncVar,
+    0x03: PtgName,
+    0x04: PtgRef,
+    0x05: PtgArea,
+    0x06: PtgMem,
+    0x07: PtgMem,
+    0x08: PtgMem,
+    0x09: PtgMemFunc,
+    0x0A: PtgRefErr,
+    0x0B: PtgAreaErr,
+    0x0C: PtgRefN,
+    0x0D: PtgAreaN,
+    0x19: PtgNameX,
+    0x1A: PtgRef3d,
+    0x1B: _Area3d,
+    0x1C: PtgRefErr3d,
+    0x1D: PtgAreaErr3d
+}
+
+_tokenMap = dict(_baseTokens)
+for ptg, tokenClass in _classifiedTokens.items():
+    for dataType in (0x20, 0x40, 0x60):
+        _tokenMap[dataType | ptg] = tokenClass
+
+# what the parser needs to decode a token, by opcode: its class, the size of
+# its fixed size part and the function unpacking it, the names of its fields,
+# and whether it has a variable size part.
+_tokenDecoders = {}
+for opcode, tokenClass in _tokenMap.items():
+    layout = tokenClass.layout
+    if layout == None:
+        _tokenDecoders[opcode] = (tokenClass, 0, None, (), tokenClass.variableSize)
+    else:
+        _tokenDecoders[opcode] = (tokenClass, layout.size, layout.unpack, tokenClass.fields, tokenClass.variableSize)
+
+class FormulaCache(object):
+    """Parsed formulas, keyed by their token bytes and parse type.  Formulas
+filled down a column have the same token bytes in every cell, so they only need
+to be parsed, and turned into text, twice.
+
+A formula is only cached the second time it's parsed; keeping the tokens of
+formulas that are never seen again would make parsing them slower.  The least
+recently used formulas are dropped, approximately: entries go to the current
+generation, and once it holds maxSize of them it becomes the old generation,
+whose entries are moved back to the current one when used."""
+
+    def __init__ (self, maxSize=4096):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        # key: (bytes, parse type), value: [tokens, text or None]
+        self.__entries = {}
+        self.__oldEntries = {}
+        self.__seenKeys = set() # keys of the formulas parsed once
+
+    def get (self, key):
+        entry = self.__entries.get(key)
+        if entry == None:
+            entry = self.__oldEntries.pop(key, None)
+            if entry == None:
+                self.misses += 1
+                return None
+            self.__add(key, entry)
+        self.hits += 1
+        return entry
+
+    def put (self, key, tokens):
+        """Cache the tokens of a formula that was just parsed, if it's not the
+first time.  Return the cache entry, or None."""
+        if key not in self.__seenKeys:
+            if len(self.__seenKeys) >= 4*self.maxSize:
+                self.__seenKeys.clear()
+            self.__seenKeys.add(key)
+            return None
+        self.__seenKeys.discard(key)
+        entry = [list(tokens), None]
+        self.__add(key, entry)
+        return entry
+
+    def __add (self, key, entry):
+        if len(self.__entries) >= self.maxSize:
+            self.__oldEntries = self.__entries
+            self.__entries = {}
+        self.__entries[key] = entry
+
+    def clear (self):
+        self.__entries = {}
+        self.__oldEntries = {}
+        self.__seenKeys.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def getStatsText (self):
+        lookups = self.hits + self.misses
+        ratio = 0.0
+        if lookups > 0:
+            ratio = 100.0*self.hits/lookups
+        return "formula cache: %d lookups, %d hits (%.1f%%), %d misses, %d entries"%(
+            lookups, self.hits, ratio, self.misses, len(self.__entries) + len(self.__oldEntries))
+
+# shared by all the formula parsers.
+formulaCache = FormulaCache()
+
 
 class FormulaParser(object):
     """This is a new formula parser that will eventually replace the old one.
@@ -793,6 +927,7 @@ associated token classes will be without the leading underscore (_)."""
     def __init__ (self, header, bytes):
         self.header = header
         self.tokens = []
+        self.cacheEntry = None
         try:
             # We are sometimes called with None bytes
             self.strm = globals.ByteStream(bytes)
@@ -803,21 +938,58 @@ associated token classes will be without the leading underscore (_)."""
             self.strm = globals.ByteStream("")
 
     def parse (self, parseType=ParsedFormulaType.Cell):
-        while not self.strm.isEndOfRecord():
-            b = self.strm.readUnsignedInt(1)
-            if not _tokenMap.has_key(b):
+        key = None
+        if self.strm.getCurrentPos() == 0 and type(self.strm.bytes) == str:
+            key = (self.strm.bytes, parseType)
+            self.cacheEntry = formulaCache.get(key)
+            if self.cacheEntry != None:
+                self.tokens = list(self.cacheEntry[0])
+                self.strm.setCurrentPos(self.strm.getSize())
+                return
+
+        strm = self.strm
+        bytes = strm.bytes
+        pos = strm.getCurrentPos()
+        size = strm.getSize()
+        appendToken = self.tokens.append
+        while pos < size:
+            opcode = ord(bytes[pos])
+            pos += 1
+            decoder = _tokenDecoders.get(opcode)
+            if decoder == None:
                 # Unknown token.  Stop parsing.
-                raise FormulaParserError("unknown token 0x%2.2X"%b)
-
-            token = _tokenMap[b](self.strm, b, parseType)
-            token.parse()
-            self.tokens.append(token)
+                strm.setCurrentPos(pos)
+                raise FormulaParserError("unknown token 0x%2.2X"%opcode)
+
+            tokenClass, fixedSize, unpack, fields, variableSize = decoder
+            token = tokenClass(opcode, parseType)
+            if unpack != None:
+                try:
+                    token.__dict__.update(zip(fields, unpack(bytes[pos:pos+fixedSize])))
+                except struct.error:
+                    # report the overrun the way the stream does.
+                    strm.setCurrentPos(pos)
+                    strm.readBytes(fixedSize)
+                pos += fixedSize
+            if variableSize:
+                strm.setCurrentPos(pos)
+                token.parseBytes(strm)
+                pos = strm.getCurrentPos()
+            appendToken(token)
+        strm.setCurrentPos(pos)
+
+        # formulas that fail to parse aren't cached, so that their errors are
+        # reported each time.
+        if key != None:
+            self.cacheEntry = formulaCache.put(key, self.tokens)
 
     def getText (self):
-        s = ''
-        for tk in self.tokens:
-            s += tk.getText()
-        return s
+        if self.cacheEntry != None and self.cacheEntry[1] != None:
+            return self.cacheEntry[1]
+        text = "".join([tk.getText() for tk in self.tokens])
+        if self.cacheEntry != None:
+            self.cacheEntry[1] = text
+        return text
 
     def getTokens (self):
         return self.tokens
@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys, struct, math, zipfile, xmlpp, StringIO
+import sys, os, struct, math, gzip, zipfile, xmlpp, StringIO, bisect, contextlib
 
 OutputWidth = 76
 
@@ -37,12 +37,42 @@ class Params(object):
         self.noRawDump = False
         self.catchExceptions = False
         self.utf8 = False
+        self.maxDumpBytes = None # hex dump at most this many bytes of a blob
         
 # Global parameters / run configuration, to be set up by the main
 # program during initialization
 params = Params()
 
+# Precompiled little endian codecs, shared by all the stream readers.  On
+# CPython 2, Struct.unpack() on a slice is faster than Struct.unpack_from(),
+# which pays for its keyword argument parsing on every call.
+uInt8   = struct.Struct('<B')
+int8    = struct.Struct('<b')
+uInt16  = struct.Struct('<H')
+int16   = struct.Struct('<h')
+uInt32  = struct.Struct('<I')
+int32   = struct.Struct('<i')
+uInt64  = struct.Struct('<Q')
+int64   = struct.Struct('<q')
+float32 = struct.Struct('<f')
+float64 = struct.Struct('<d')
+
+# integer codecs by width in bytes
+unsignedInts = {1: uInt8, 2: uInt16, 4: uInt32, 8: uInt64}
+signedInts = {1: int8, 2: int16, 4: int32, 8: int64}
+
+# codecs of ByteStream.readuInt16Array() and readuInt32Array(), by count
+uInt16Arrays = {}
+uInt32Arrays = {}
+
 class ByteStream(object):
+    """Little endian reader over a byte string.
+
+Every stream reader (the XLS record handlers, the formula parser, msodraw,
+vbadump and binarystream.BinaryStream) derives from this class, so the
+readers below check the bounds once and decode with a precompiled codec."""
+
+    __slots__ = ('bytes', 'pos', 'size')
 
     def __init__ (self, bytes):
         self.bytes = bytes
@@ -52,14 +82,39 @@ class ByteStream(object):
     def getSize (self):
         return self.size
 
+    def __overrun (self, length):
+        error("reading %d bytes from position %d would exceed the current size of %d\n"%
+            (length, self.pos, self.size))
+        raise ByteStreamError()
+
+    def __reader (codec):
+        """Return a reader method for one field of codec.
+
+The unpack method and the size of the codec are bound in the closure, which
+saves their lookups on every call.  A short slice makes unpack() fail, which
+is the bounds check.  Don't compare against self.size, derived classes
+(BinaryStream) reuse it for the size of the structure rather than of the
+buffer."""
+        unpack = codec.unpack
+        size = codec.size
+        def read (self):
+            pos = self.pos
+            end = pos + size
+            try:
+                value = unpack(self.bytes[pos:end])[0]
+            except struct.error:
+                self.__overrun(size)
+            self.pos = end
+            return value
+        return read
+
     def readBytes (self, length):
-        if self.pos + length > self.size:
-            error("reading %d bytes from position %d would exceed the current size of %d\n"%
-                (length, self.pos, self.size))
-            raise ByteStreamError()
-        r = self.bytes[self.pos:self.pos+length]
-        self.pos += length
-        return r
+        pos = self.pos
+        end = pos + length
+        if end > self.size:
+            self.__overrun(length)
+        self.pos = end
+        return self.bytes[pos:end]
 
     def readRemainingBytes (self):
         r = self.bytes[self.pos:]
@@ -75,18 +130,66 @@ class ByteStream(object):
     def isEndOfRecord (self):
         return (self.pos == self.size)
 
+    # readUnsignedInt() and readSignedInt() are the hottest readers, they
+    # inline __read().
+
     def readUnsignedInt (self, length):
-        bytes = self.readBytes(length)
-        return getUnsignedInt(bytes)
+        codec = unsignedInts.get(length)
+        if codec is None:
+            return getUnsignedInt(self.readBytes(length))
+        pos = self.pos
+        end = pos + length
+        try:
+            value = codec.unpack(self.bytes[pos:end])[0]
+        except struct.error:
+            self.__overrun(length)
+        self.pos = end
+        return value
 
     def readSignedInt (self, length):
-        bytes = self.readBytes(length)
-        return getSignedInt(bytes)
-
-    def readDouble (self):
-        # double is always 8 bytes.
-        bytes = self.readBytes(8)
-        return getDouble(bytes)
+        codec = signedInts.get(length)
+        if codec is None:
+            return getSignedInt(self.readBytes(length))
+        pos = self.pos
+        end = pos + length
+        try:
+            value = codec.unpack(self.bytes[pos:end])[0]
+        except struct.error:
+            self.__overrun(length)
+        self.pos = end
+        return value
+
+    readuInt8 = __reader(uInt8)
+    readuInt16 = __reader(uInt16)
+    readInt16 = __reader(int16)
+    readuInt32 = __reader(uInt32)
+    readInt32 = __reader(int32)
+    readuInt64 = __reader(uInt64)
+    readFloat32 = __reader(float32)
+    # double is always 8 bytes.
+    readDouble = __reader(float64)
+    del __reader
+
+    def __readArray (self, codecs, format, width, count):
+        codec = codecs.get(count)
+        if codec is None:
+            codec = codecs[count] = struct.Struct(format%count)
+        pos = self.pos
+        end = pos + width*count
+        try:
+            values = codec.unpack(self.bytes[pos:end])
+        except struct.error:
+            self.__overrun(width*count)
+        self.pos = end
+        return values
+
+    def readuInt16Array (self, count):
+        """Read count unsigned 16-bit integers at once, return a tuple."""
+        return self.__readArray(uInt16Arrays, "<%dH", 2, count)
+
+    def readuInt32Array (self, count):
+        """Read count unsigned 32-bit integers at once, return a tuple."""
+        return self.__readArray(uInt32Arrays, "<%dI", 4, count)
 
     def readUnicodeString (self, textLen=None):
         # First 2-bytes contains the text length, followed by a 1-byte flag.
@@ -131,6 +234,126 @@ def getValueOrUnknown (list, idx, errmsg='(unknown)'):
 
 textdump = b""
 
+
+class OutputSink(object):
+    """Destination of the dump.
+
+outputTo() installs the stream of the sink as sys.stdout for the duration of
+the dump, so it receives print statements as well as output().  The print
+statement only takes its fast path for real file objects, so sinks that can
+write to a file make that file their stream; the others are their own
+stream."""
+
+    softspace = 0 # used by the print statement
+
+    def __init__ (self):
+        self.stream = self
+
+    def write (self, data):
+        pass
+
+    def flush (self):
+        pass
+
+    def close (self):
+        self.flush()
+
+
+class NullSink(OutputSink):
+    """Discards everything, without a file behind it.  It doesn't save the
+formatting of the output, callers that don't want any output should check
+params.noStructOutput before they format it, as output() does."""
+    pass
+
+
+class MemorySink(OutputSink):
+    """Keeps the output in memory, see getvalue()."""
+
+    def __init__ (self):
+        OutputSink.__init__(self)
+        self.buffer = StringIO.StringIO()
+        self.write = self.buffer.write
+
+    def getvalue (self):
+        return self.buffer.getvalue()
+
+
+class FileSink(OutputSink):
+    """Writes to an open file, sys.stdout by default.  close() leaves the file
+open unless closeFile is set."""
+
+    def __init__ (self, file=None, closeFile=False):
+        if file is None:
+            file = sys.stdout
+        self.stream = file
+        self.closeFile = closeFile
+        self.write = file.write
+
+    def flush (self):
+        self.stream.flush()
+
+    def close (self):
+        if self.closeFile:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class GzipSink(OutputSink):
+    """Writes to a gzip compressed file.  Fragments are joined before they are
+passed to the compressor."""
+
+    def __init__ (self, filePath, bufferSize=1<<16):
+        OutputSink.__init__(self)
+        self.file = gzip.open(filePath, "wb")
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.size = 0
+
+    def write (self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.bufferSize:
+            self.flush()
+
+    def flush (self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def close (self):
+        self.flush()
+        self.file.close()
+
+
+def createOutputSink (filePath=None):
+    """Create the sink for the --output option of the dumpers: standard
+output for None or '-', a gzip compressed file if the path ends with '.gz', a
+plain file otherwise."""
+    if filePath is None or filePath == '-':
+        return FileSink()
+    if filePath.endswith(".gz"):
+        return GzipSink(filePath)
+    return FileSink(open(filePath, "wb"), closeFile=True)
+
+@contextlib.contextmanager
+def outputTo (sink):
+    """Route the output of the dumpers to sink for the duration of a with
+block.  The dumpers print to sys.stdout, so it is replaced for the block; on
+the way out, also when the dump raises, the sink is closed and the previous
+sys.stdout put back.  Nothing is left behind for library callers that dump
+more than one file from the same process."""
+    saved = sys.stdout
+    sys.stdout = sink.stream
+    try:
+        yield sink
+    finally:
+        try:
+            sink.close()
+        finally:
+            sys.stdout = saved
+
 def output (msg, recordType = -1):
     if params.noStructOutput:
         return
@@ -142,6 +365,8 @@ def outputln(msg, recordType = -1):
     output(msg + "\n", recordType)
 
 def error (msg):
+    # keep the error next to the output it's about
+    sys.stdout.flush()
     sys.stderr.write("Error: " + msg)
 
 def debug (msg):
@@ -273,6 +498,82 @@ def getUnicodeRichExtText (bytes, offset = 0, rofflist = []):
         return ret, len(bytes)
     return ret, strm.getCurrentPos() - offset
 
+# length and flags of an XLUnicodeRichExtendedString
+richExtTextHeader = struct.Struct("<HB")
+
+def iterUnicodeRichExtText (bytes, offset, count, rofflist = []):
+    """Decode count XLUnicodeRichExtendedString structures that follow each
+other from offset on, as in the SST record, and yield them one at a time as
+UnicodeRichExtText.
+
+The bytes are walked once, with the record boundaries in rofflist looked up
+by bisection from the last one passed.  A string that doesn't fit in the
+bytes is left to getUnicodeRichExtText(), to report the error."""
+    if len(rofflist) == 0:
+        rofflist = [len(bytes)]
+    size = len(bytes)
+    bounds = len(rofflist)
+    pos = offset
+    ibound = 0
+    for i in xrange(0, count):
+        start = pos
+        ret = None
+        try:
+            textLen, flags = richExtTextHeader.unpack(bytes[pos:pos+3])
+            pos += 3
+            numElem = 0
+            if flags & 0x08:
+                numElem = uInt16.unpack(bytes[pos:pos+2])[0]
+                pos += 2
+            phoneticBytes = 0
+            if flags & 0x04:
+                phoneticBytes = uInt32.unpack(bytes[pos:pos+4])[0]
+                pos += 4
+        except struct.error:
+            textLen = None
+        if textLen != None:
+            bytesPerChar = (flags & 0x01) + 1
+
+            # the string switches between compressed (Latin-1) and UTF-16LE at
+            # each CONTINUE record it spans, see getUnicodeRichExtText().
+            pieces = []
+            while textLen > 0:
+                ibound = bisect.bisect_right(rofflist, pos, ibound)
+                if ibound == bounds:
+                    break
+                length = min(textLen*bytesPerChar, rofflist[ibound] - pos)
+                if bytesPerChar == 1:
+                    pieces.append(bytes[pos:pos+length].decode('latin-1'))
+                else:
+                    pieces.append(unicode(bytes[pos:pos+length], 'UTF-16LE', errors='replace'))
+                textLen -= length // bytesPerChar
+                pos += length
+                if textLen > 0:
+                    if pos >= size:
+                        break
+                    bytesPerChar = (ord(bytes[pos]) & 0x01) + 1
+                    pos += 1
+
+            pos += numElem*4
+            if textLen == 0 and pos + phoneticBytes <= size:
+                ret = UnicodeRichExtText()
+                if len(pieces) == 1:
+                    ret.baseText = pieces[0]
+                else:
+                    ret.baseText = u"".join(pieces)
+                if flags & 0x04:
+                    ret.phoneticBytes = bytes[pos:pos+phoneticBytes]
+                pos += phoneticBytes
+
+        if ret == None:
+            ret, length = getUnicodeRichExtText(bytes, start, rofflist)
+            pos = start + length
+            if pos > size:
+                error("reading %d bytes from position %d would exceed the current size of %d\n"%
+                    (length, start, size))
+                raise ByteStreamError()
+        yield ret
+
 
 def getRichText (bytes, textLen=None):
     """parse a string of the rich-text format that Excel uses.
@@ -321,16 +622,52 @@ Note the following:
 
     return (text, totalByteLen)
 
+# hex dump cell and text column character of each byte value
+hexBytes = ["%2.2X "%i for i in xrange(0, 256)]
+printableChars = "".join([(32 < i and i < 127) and chr(i) or '.' for i in xrange(0, 256)])
+
 def toCharOrDot (char):
-    if 32 < ord(char) and ord(char) < 127:
-        return char
-    else:
-        return '.'
+    return printableChars[ord(char)]
+
+def formatHex (chars):
+    """Format chars as one "XX " cell per byte."""
+    return "".join(map(hexBytes.__getitem__, bytearray(chars)))
+
+def formatHexLines (chars, group=None):
+    """Split chars into lines of 16 bytes for a hex dump.
+
+Returns a list of (offset, hex, text) tuples.  hex has one "XX " cell per
+byte, plus an extra space after every group bytes if group is given; it's not
+padded for the last, short line.  text has the unprintable bytes replaced with
+dots."""
+    chars = chars[0:len(chars)] # flatten stream readers
+    cells = map(hexBytes.__getitem__, bytearray(chars))
+    text = chars.translate(printableChars)
+    lines = []
+    for pos in xrange(0, len(chars), 16):
+        line = cells[pos:pos+16]
+        if group:
+            hex = " ".join(["".join(line[i:i+group]) for i in xrange(0, len(line), group)])
+            if len(line) % group == 0:
+                hex += " "
+        else:
+            hex = "".join(line)
+        lines.append((pos, hex, text[pos:pos+16]))
+    return lines
+
+def getDumpSize (size):
+    """Return how many bytes of a size bytes long blob to hex dump, which is
+limited by params.maxDumpBytes."""
+    if params.maxDumpBytes is None:
+        return size
+    return min(size, params.maxDumpBytes)
+
+def getOmittedBytesText (size, dumpSize):
+    return "(%d more bytes not dumped)"%(size - dumpSize)
 
 def dumpBytes (chars, subDivide=None):
     if params.noStructOutput or params.noRawDump:
         return
-    line = 0
     subDivideLine = None
     if subDivide != None:
         subDivideLine = subDivide/16
@@ -341,48 +678,28 @@ def dumpBytes (chars, subDivide=None):
         return
 
     labelWidth = int(math.ceil(math.log(charLen, 10)))
-    lineBuf = '' # bytes interpreted as chars at the end of each line
-    i = 0
-    for i in xrange(0, charLen):
-        if (i+1)%16 == 1:
-            # print line header with seek position
-            fmt = "%%%d.%dd: "%(labelWidth, labelWidth)
-            output(fmt%i)
-
-        byte = ord(chars[i])
-        lineBuf += toCharOrDot(chars[i])
-        output("%2.2X "%byte)
-
-        if (i+1)%4 == 0:
-            # put extra space at every 4 bytes.
-            output(" ")
-
-        if (i+1)%16 == 0:
-            # end of line
-            output (lineBuf)
-            output("\n")
-            if subDivideLine != None and (line+1)%subDivideLine == 0:
-                output("\n")
-            lineBuf = ''
-            line += 1
-
-    if len(lineBuf) > 0:
-        # pad with white space so that the line string gets aligned.
-        i += 1
-        while True:
-            output ("   ")
-            if (i+1)%4 == 0:
-                # put extra space at every 4 bytes.
-                output(" ")
-            if (i+1) % 16 == 0:
-                # end of line
-                break
-            i += 1
-        output (lineBuf)
-        output("\n")
+    fmt = "%%%d.%dd: "%(labelWidth, labelWidth)
+    dumpSize = getDumpSize(charLen)
+    lineBuf = []
+    line = 0
+    for pos, hex, text in formatHexLines(chars[0:dumpSize], 4):
+        # line header with seek position, then the bytes padded to full width
+        # and interpreted as chars
+        lineBuf.append(fmt%pos + hex.ljust(52) + text + "\n")
+        if subDivideLine and len(text) == 16 and (line+1)%subDivideLine == 0:
+            lineBuf.append("\n")
+        line += 1
+        if len(lineBuf) >= 1024:
+            output("".join(lineBuf))
+            lineBuf = []
+    if dumpSize < charLen:
+        lineBuf.append(getOmittedBytesText(charLen, dumpSize) + "\n")
+    output("".join(lineBuf))
 
 def getSectorPos (secID, secSize):
-    return 512 + secID*secSize
+    # The header occupies the first sector, which is padded up to the sector
+    # size when it's larger than 512 bytes.
+    return (secID+1)*secSize
 
 
 def getRawBytes (bytes, spaced=True, reverse=True):
@@ -421,18 +738,10 @@ def getSignedInt (bytes):
     if n == 0:
         return 0
 
-    text = toTextBytes(bytes)
-    if n == 1:
-        # byte - 1 byte
-        return struct.unpack('b', text)[0]
-    elif n == 2:
-        # short - 2 bytes
-        return struct.unpack('<h', text)[0]
-    elif n == 4:
-        # int, long - 4 bytes
-        return struct.unpack('<l', text)[0]
-
-    raise ByteConvertError
+    codec = signedInts.get(n)
+    if codec is None:
+        raise ByteConvertError
+    return codec.unpack(toTextBytes(bytes))[0]
 
 
 def getUnsignedInt (bytes):
@@ -441,21 +750,10 @@ def getUnsignedInt (bytes):
     if n == 0:
         return 0
 
-    text = toTextBytes(bytes)
-    if n == 1:
-        # byte - 1 byte
-        return struct.unpack('B', text)[0]
-    elif n == 2:
-        # short - 2 bytes
-        return struct.unpack('<H', text)[0]
-    elif n == 4:
-        # int, long - 4 bytes
-        return struct.unpack('<L', text)[0]
-    elif n == 8:
-        # long long - 8 bytes
-        return struct.unpack('<Q', text)[0]
-
-    raise ByteConvertError
+    codec = unsignedInts.get(n)
+    if codec is None:
+        raise ByteConvertError
+    return codec.unpack(toTextBytes(bytes))[0]
 
 
 def getFloat (bytes):
@@ -463,8 +761,7 @@ def getFloat (bytes):
     if n == 0:
         return 0.0
 
-    text = toTextBytes(bytes)
-    return struct.unpack('<f', text)[0]
+    return float32.unpack(toTextBytes(bytes))[0]
 
 
 def getDouble (bytes):
@@ -472,8 +769,7 @@ def getDouble (bytes):
     if n == 0:
         return 0.0
 
-    text = toTextBytes(bytes)
-    return struct.unpack('<d', text)[0]
+    return float64.unpack(toTextBytes(bytes))[0]
 
 def getUTF8FromUTF16 (bytes):
     # little endian utf-16 strings
@@ -163,6 +163,21 @@ def convertAttrValue (val):
 
     return val
 
+def getTagText (node, utf8 = False):
+    """Return the name and attributes of an element, as they go between '<'
+and '>'."""
+    line = node.name
+    if len(node.attrs) > 0:
+        keys = node.attrs.keys()
+        keys.sort()
+        for key in keys:
+            val = node.attrs[key]
+            if val == None:
+                continue
+            val = convertAttrValue(val)
+            line += " " + key + '="' + encodeString(val, utf8 = utf8) + '"'
+    return line
+
 # If utf8 is set, the input is either utf-8 bytes or unicode
 def prettyPrint (fd, node, utf8 = False):
     printNode(fd, node, 0, True, utf8 = utf8)
@@ -183,16 +198,7 @@ def printNode (fd, node, level, breakLine, utf8 = False):
 
         # We add '<' and '>' (or '/>') after the element content gets
         # encoded.
-        line = node.name
-        if len(node.attrs) > 0:
-            keys = node.attrs.keys()
-            keys.sort()
-            for key in keys:
-                val = node.attrs[key]
-                if val == None:
-                    continue
-                val = convertAttrValue(val)
-                line += " " + key + '="' + encodeString(val, utf8 = utf8) + '"'
+        line = getTagText(node, utf8 = utf8)
 
         if hasChildren:
             breakChildren = breakLine and not node.hasContent()
@@ -216,4 +222,31 @@ def printNode (fd, node, level, breakLine, utf8 = False):
         if len(content) > 0:
             fd.write (indent + content + lf)
 
+class StreamPrinter(object):
+    """Print elements as they are started and ended, the way prettyPrint()
+prints the tree they make up, without keeping those that are done.  An
+element that is ended before any child is started in it is printed as an
+empty element.  The elements can't have content."""
+
+    def __init__ (self, fd, utf8 = False):
+        self.fd = fd
+        self.utf8 = utf8
+        self.__elements = [] # elements not ended yet: [element, start tag printed]
+
+    def startElement (self, name, attrs=None):
+        # the start tag of an element is only printed with its first child.
+        for level, item in enumerate(self.__elements):
+            if not item[1]:
+                self.fd.write(' '*4*level + "<%s>\n"%getTagText(item[0], utf8 = self.utf8))
+                item[1] = True
+        self.__elements.append([Element(name, attrs), False])
+
+    def endElement (self):
+        element, printed = self.__elements.pop()
+        level = len(self.__elements)
+        if printed:
+            self.fd.write(' '*4*level + "</%s>\n"%element.name)
+        else:
+            printNode(self.fd, element, level, True, utf8 = self.utf8)
+
 # vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys
+import sys, os, mmap, array, fnmatch, threading, Queue
 import globals
 from globals import getSignedInt
 # ----------------------------------------------------------------------------
@@ -18,6 +18,60 @@ from globals import output
 
 class NoRootStorage(Exception): pass
 
+
+def mapFile (filePath):
+    """Map a compound document file read-only into memory.
+
+The returned object can be passed to Header in place of the string returned by
+file.read().  Header, MSAT, SAT and Directory only ever slice out the sectors
+they need, so the pages of the file are loaded on demand instead of the whole
+file being copied into memory before parsing starts.  Files that can't be
+mapped (empty files, pipes) are read into a string as before.
+"""
+    file = open(filePath, 'rb')
+    try:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError, EnvironmentError):
+            return file.read()
+    finally:
+        file.close()
+
+
+def getSectorIDArray (bytes):
+    """Decode a string of little endian 4-byte sector IDs into an array."""
+    ids = array.array('i')
+    ids.fromstring(bytes[:len(bytes) - len(bytes)%4])
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def readSectors (bytes, chain, sectorSize, offset=None):
+    """Read all sectors of a chain and return them as one string.
+
+Sectors are positioned as in the file (the header taking up the first
+sector) unless an explicit offset is given, e.g. 0 for short sectors inside
+the short stream container.  Runs of consecutive sectors are sliced out at
+once, and all pieces are joined in a single pass.
+"""
+    if offset == None:
+        offset = globals.getSectorPos(0, sectorSize)
+    pieces = []
+    runStart = runEnd = None
+    for secID in chain:
+        pos = offset + secID*sectorSize
+        if pos == runEnd and secID > 0:
+            runEnd += sectorSize
+            continue
+        if runStart != None:
+            pieces.append(bytes[runStart:runEnd])
+        runStart, runEnd = pos, pos + sectorSize
+    if runStart != None:
+        pieces.append(bytes[runStart:runEnd])
+    return "".join(pieces)
+
+
 class ByteOrder:
     LittleEndian = 0
     BigEndian    = 1
@@ -49,6 +103,8 @@ class Header(object):
     def __init__ (self, bytes, params):
         self.bytes = bytes
         self.MSAT = None
+        self.__SSAT = None
+        self.__directory = None
 
         self.docId = None
         self.uId = None
@@ -191,9 +247,7 @@ class Header(object):
 
         # First part of MSAT consisting of an array of up to 109 sector IDs.
         # Each sector ID is 4 bytes in length.
-        for i in xrange(0, 109):
-            pos = 76 + i*4
-            id = getSignedInt(self.bytes[pos:pos+4])
+        for id in getSectorIDArray(self.bytes[76:512]):
             if id == -1:
                 break
 
@@ -207,12 +261,14 @@ class Header(object):
                 raise Exception("ole.Header::parse: got %d as sector size!" % size)
             inLoop = True
             while inLoop:
-                pos = 512 + secID*size
-                bytes = self.bytes[pos:pos+size]
+                pos = globals.getSectorPos(secID, size)
+                ids = getSectorIDArray(self.bytes[pos:pos+size])
                 n = int(size/4)
+                if len(ids) < n:
+                    # truncated file.
+                    break
                 for i in xrange(0, n):
-                    pos = i*4
-                    id = getSignedInt(bytes[pos:pos+4])
+                    id = ids[i]
                     if id < 0:
                         inLoop = False
                         break
@@ -235,6 +291,9 @@ class Header(object):
 
 
     def getSSAT (self):
+        if self.__SSAT != None:
+            return self.__SSAT
+
         ssatID = self.getFirstSectorID(BlockType.SSAT)
         if ssatID < 0:
             return None
@@ -245,10 +304,14 @@ class Header(object):
         for secID in chain:
             obj.addSector(secID)
         obj.buildArray()
-        return obj
+        self.__SSAT = obj
+        return self.__SSAT
 
 
     def getDirectory (self):
+        if self.__directory != None:
+            return self.__directory
+
         dirID = self.getFirstSectorID(BlockType.Directory)
         if dirID < 0:
             return None
@@ -258,7 +321,8 @@ class Header(object):
         obj = Directory(self, self.params)
         for secID in chain:
             obj.addSector(secID)
-        return obj
+        self.__directory = obj
+        return self.__directory
 
 
     def dummy ():
@@ -277,7 +341,7 @@ all the sectors pointed by the sector IDs in order of occurrence.
 """
     def __init__ (self, sectorSize, bytes, params):
         self.sectorSize = sectorSize
-        self.secIDs = []
+        self.secIDs = array.array('i')
         self.bytes = bytes
         self.__SAT = None
 
@@ -293,12 +357,12 @@ all the sectors pointed by the sector IDs in order of occurrence.
         globals.outputln("-"*globals.OutputWidth)
 
         for id in self.secIDs:
-            globals.outputln("sector ID: %5d   (pos: %7d)"%(id, 512+id*self.sectorSize))
+            globals.outputln("sector ID: %5d   (pos: %7d)"%(id, globals.getSectorPos(id, self.sectorSize)))
 
     def getSATSectorPosList (self):
         list = []
         for id in self.secIDs:
-            pos = 512 + id*self.sectorSize
+            pos = globals.getSectorPos(id, self.sectorSize)
             list.append([id, pos])
         return list
 
@@ -321,8 +385,12 @@ class SAT(object):
         self.sectorSize = sectorSize
         self.sectorIDs = []
         self.bytes = bytes
-        self.array = []
+        self.array = array.array('i')
         self.params = params
+        self.__chains = {}
+        self.__chainStats = {}
+        self.__visited = None
+        self.__visitStamp = 0
 
 
     def getSectorSize (self):
@@ -338,49 +406,32 @@ class SAT(object):
             # array already built.
             return
 
-        numItems = int(self.sectorSize/4)
-        self.array = []
-        for secID in self.sectorIDs:
-            pos = 512 + secID*self.sectorSize
-            for i in xrange(0, numItems):
-                beginPos = pos + i*4
-                id = getSignedInt(self.bytes[beginPos:beginPos+4])
-                self.array.append(id)
+        # Decode all sectors in one go.  Sectors cut short by the end of the
+        # file are padded with 0's.
+        size = self.sectorSize*len(self.sectorIDs)
+        bytes = readSectors(self.bytes, self.sectorIDs, self.sectorSize)
+        bytes += "\x00"*(size - len(bytes))
+        self.array = getSectorIDArray(bytes)
 
 
     def outputRawBytes (self):
-        bytes = ""
-        for secID in self.sectorIDs:
-            pos = 512 + secID*self.sectorSize
-            bytes += self.bytes[pos:pos+self.sectorSize]
+        bytes = readSectors(self.bytes, self.sectorIDs, self.sectorSize)
         globals.dumpBytes(bytes, 512)
 
 
     def outputArrayStats (self):
         sectorTotal = len(self.array)
-        sectorP  = 0       # >= 0
-        sectorM1 = 0       # -1
-        sectorM2 = 0       # -2
-        sectorM3 = 0       # -3
-        sectorM4 = 0       # -4
-        sectorMElse = 0    # < -4
-        sectorLiveTotal = 0
-        for i in xrange(0, len(self.array)):
-            item = self.array[i]
-            if item >= 0:
+        sectorM1 = self.array.count(-1)  # free
+        sectorM2 = self.array.count(-2)  # end of chain
+        sectorM3 = self.array.count(-3)  # SAT
+        sectorM4 = self.array.count(-4)  # MSAT
+        sectorP = 0      # >= 0
+        sectorMElse = 0  # < -4
+        for id in self.array:
+            if id >= 0:
                 sectorP += 1
-            elif item == -1:
-                sectorM1 += 1
-            elif item == -2:
-                sectorM2 += 1
-            elif item == -3:
-                sectorM3 += 1
-            elif item == -4:
-                sectorM4 += 1
-            elif item < -4:
+            elif id < -4:
                 sectorMElse += 1
-            else:
-                sectorLiveTotal += 1
         globals.outputln("total sector count:          %4d"%sectorTotal)
         globals.outputln("* live sector count:         %4d"%sectorP)
         globals.outputln("* end-of-chain sector count: %4d"%sectorM2)  # end-of-chain is also live
@@ -399,8 +450,8 @@ class SAT(object):
         if self.params.debug:
             self.outputRawBytes()
             globals.outputln("-"*globals.OutputWidth)
-            for i in xrange(0, len(self.array)):
-                globals.outputln("%5d: %5d"%(i, self.array[i]))
+            for i, item in enumerate(self.array):
+                globals.outputln("%5d: %5d"%(i, item))
             globals.outputln("-"*globals.OutputWidth)
 
         self.outputArrayStats()
@@ -408,16 +459,72 @@ class SAT(object):
 
     def getSectorIDChain (self, initID):
         if initID < 0:
-            return []
-        chain = [initID]
-        nextID = self.array[initID]
+            return array.array('i')
+        if initID in self.__chains:
+            # a copy, so that callers can't corrupt the cached chain.
+            return self.__chains[initID][:]
+
+        # Sectors visited while following this chain are stamped with a
+        # number unique to it, so that the table never needs clearing.
+        n = len(self.array)
+        if self.__visited == None:
+            self.__visited = array.array('i', [0])*n
+        self.__visitStamp += 1
+        stamp = self.__visitStamp
+        visited = self.__visited
+
+        chain = array.array('i')
+        nextID = initID
         while nextID != -2:
-            chain.append(nextID)
-            if nextID == self.array[nextID]:
+            if nextID < 0 or nextID >= n:
+                globals.error("%s: sector chain starting at %d runs into invalid sector ID %d\n"%
+                    (self.__class__.__name__, initID, nextID))
+                break
+            if visited[nextID] == stamp:
                 # Beware of infinite loop: happens on bad files.
+                globals.error("%s: sector chain starting at %d loops back to sector %d\n"%
+                    (self.__class__.__name__, initID, nextID))
                 break
+            visited[nextID] = stamp
+            chain.append(nextID)
             nextID = self.array[nextID]
-        return chain
+
+        self.__chains[initID] = chain
+        return chain[:]
+
+
+    def getSectorIDChainStats (self, initID):
+        if initID not in self.__chainStats:
+            chain = self.getSectorIDChain(initID)
+            self.__chainStats[initID] = SectorChainStats(chain)
+        return self.__chainStats[initID]
+
+
+class SectorChainStats(object):
+    """Layout statistics of a sector ID chain.
+
+A run is a sequence of sectors that are adjacent in the file.  Fragmentation
+is the fraction of steps in the chain that jump to a non-adjacent sector.
+"""
+    def __init__ (self, chain):
+        self.length = len(chain)
+        self.runs = 0
+        self.longestRun = 0
+
+        runLength = 0
+        prevID = None
+        for secID in chain:
+            if prevID != None and secID == prevID + 1:
+                runLength += 1
+            else:
+                self.runs += 1
+                runLength = 1
+            self.longestRun = max(self.longestRun, runLength)
+            prevID = secID
+
+        self.fragmentation = 0.0
+        if self.length > 1:
+            self.fragmentation = float(self.runs - 1)/(self.length - 1)
 
 
 class SSAT(SAT):
@@ -440,8 +547,7 @@ sectors are contained in the SAT as a sector ID chain.
         if self.params.debug:
             self.outputRawBytes()
             globals.outputln("-"*globals.OutputWidth)
-            for i in xrange(0, len(self.array)):
-                item = self.array[i]
+            for i, item in enumerate(self.array):
                 output("%3d : %3d\n"%(i, item))
 
         self.outputArrayStats()
@@ -494,67 +600,67 @@ entire file stream.
         self.minStreamSize = header.minStreamSize
         self.sectorIDs = []
         self.entries = []
-        self.SAT = header.getSAT()
-        self.SSAT = header.getSSAT()
+        self.entriesByName = {}
         self.header = header
         self.RootStorage = None
-        self.RootStorageBytes = ""
+        self.RootStorageBytes = None
         self.params = params
 
 
-    def __buildRootStorageBytes (self):
-        if self.RootStorage == None:
-            # no root storage exists.
-            return
-
-        firstSecID = self.RootStorage.StreamSectorID
-        chain = self.header.getSAT().getSectorIDChain(firstSecID)
-        for secID in chain:
-            pos = 512 + secID*self.sectorSize
-            self.RootStorageBytes += self.header.bytes[pos:pos+self.sectorSize]
+    def __getRootStorageBytes (self):
+        # The short stream container is shared by all short streams, so
+        # assemble it only once.
+        if self.RootStorageBytes == None:
+            chain = self.header.getSAT().getSectorIDChain(self.RootStorage.StreamSectorID)
+            self.RootStorageBytes = readSectors(self.bytes, chain, self.sectorSize)
+        return self.RootStorageBytes
 
 
     def __getRawStream (self, entry):
-        chain = []
-        if entry.StreamLocation == StreamLocation.SAT:
-            chain = self.header.getSAT().getSectorIDChain(entry.StreamSectorID)
-        elif entry.StreamLocation == StreamLocation.SSAT:
-            chain = self.header.getSSAT().getSectorIDChain(entry.StreamSectorID)
-
         if entry.StreamLocation == StreamLocation.SSAT:
             # Get the root storage stream.
             if self.RootStorage == None:
                 raise NoRootStorage
 
-            bytes = ""
-            self.__buildRootStorageBytes()
+            chain = self.header.getSSAT().getSectorIDChain(entry.StreamSectorID)
             size = self.header.getShortSectorSize()
-            for id in chain:
-                pos = id*size
-                bytes += self.RootStorageBytes[pos:pos+size]
-            return bytes
-
-        offset = 512
-        size = self.header.getSectorSize()
-        bytes = ""
-        for id in chain:
-            pos = offset + id*size
-            bytes += self.header.bytes[pos:pos+size]
+            return readSectors(self.__getRootStorageBytes(), chain, size, 0)
 
-        return bytes
+        chain = self.header.getSAT().getSectorIDChain(entry.StreamSectorID)
+        return readSectors(self.bytes, chain, self.header.getSectorSize())
 
     def getRawStream (self, entry):
         bytes = self.__getRawStream(entry)
         return bytes
 
+    def getStreamReader (self, entry):
+        """Return a file-like reader over the raw stream of an entry.
+
+The reader covers the same bytes as getRawStream() would return, but only
+reads the sectors that are actually accessed."""
+        if entry.StreamLocation == StreamLocation.SSAT:
+            if self.RootStorage == None:
+                raise NoRootStorage
+
+            chain = self.header.getSSAT().getSectorIDChain(entry.StreamSectorID)
+            size = self.header.getShortSectorSize()
+            return OleStreamReader(self.__getRootStorageBytes(), chain, size, 0)
+
+        chain = self.header.getSAT().getSectorIDChain(entry.StreamSectorID)
+        return OleStreamReader(self.bytes, chain, self.header.getSectorSize())
+
     def getRawStreamByName (self, name):
         bytes = []
-        for entry in self.entries:
-            if entry.Name == name:
-                bytes = self.__getRawStream(entry)
-                break
+        entry = self.getEntryByName(name)
+        if entry != None:
+            bytes = self.__getRawStream(entry)
         return bytes
 
+    def getEntryByName (self, name):
+        """Return the first directory entry with the given name, or None."""
+        self.parseDirEntries()
+        return self.entriesByName.get(name)
+
 
     def addSector (self, id):
         self.sectorIDs.append(id)
@@ -642,16 +748,19 @@ entire file stream.
             satObj = None
             secSize = 0
             if entry.StreamLocation == StreamLocation.SAT:
-                satObj = self.SAT
+                satObj = self.header.getSAT()
                 secSize = self.header.getSectorSize()
             elif entry.StreamLocation == StreamLocation.SSAT:
-                satObj = self.SSAT
+                satObj = self.header.getSSAT()
                 secSize = self.header.getShortSectorSize()
             if satObj != None:
                 chain = satObj.getSectorIDChain(entry.StreamSectorID)
                 globals.outputln("sector count: %d"%len(chain))
                 globals.outputln("total sector size: %d"%(len(chain)*secSize))
                 if self.params.showSectorChain:
+                    stats = satObj.getSectorIDChainStats(entry.StreamSectorID)
+                    globals.outputln("sector runs: %d (longest: %d); fragmentation: %.1f%%"%
+                        (stats.runs, stats.longestRun, stats.fragmentation*100))
                     self.__outputSectorChain(chain)
 
 
@@ -679,10 +788,7 @@ entire file stream.
         if bytes == None:
             return
 
-        output("%s: "%name)
-        for byte in bytes:
-            output("%2.2X "%ord(byte))
-        globals.outputln("")
+        globals.outputln("%s: %s"%(name, globals.formatHex(bytes)))
 
     def getDirectoryEntries (self):
         return self.entries
@@ -700,12 +806,10 @@ entire file stream.
             return
 
         # combine all sectors first.
-        bytes = ""
-        for secID in self.sectorIDs:
-            pos = globals.getSectorPos(secID, self.sectorSize)
-            bytes += self.bytes[pos:pos+self.sectorSize]
+        bytes = readSectors(self.bytes, self.sectorIDs, self.sectorSize)
 
         self.entries = []
+        self.entriesByName = {}
 
         # each directory entry is exactly 128 bytes.
         numEntries = int(len(bytes)/128)
@@ -713,7 +817,10 @@ entire file stream.
             return
         for i in xrange(0, numEntries):
             pos = i*128
-            self.entries.append(self.parseDirEntry(bytes[pos:pos+128]))
+            entry = self.parseDirEntry(bytes[pos:pos+128])
+            self.entries.append(entry)
+            if entry.Name not in self.entriesByName:
+                self.entriesByName[entry.Name] = entry
 
 
     def parseDirEntry (self, bytes):
@@ -747,6 +854,91 @@ entire file stream.
 
         return entry
 
+class OleStreamReader(object):
+    """Read-only file-like object over a stream stored in a sector chain.
+
+Stream positions are mapped to file positions through the resolved sector
+chain, so seeking is O(1) and only the sectors touched by a read are sliced
+out of the underlying buffer.  Besides read(), readinto(), seek() and
+tell(), the reader supports len(), indexing and slicing, so that it can
+stand in for the stream string in XLDirStream, PPTDirStream and
+BinaryStream.
+"""
+    def __init__ (self, bytes, chain, sectorSize, offset=None):
+        if offset == None:
+            offset = globals.getSectorPos(0, sectorSize)
+        self.bytes = bytes
+        self.chain = chain
+        self.sectorSize = sectorSize
+        self.offset = offset
+        self.pos = 0
+
+        self.size = len(chain)*sectorSize
+        if len(chain) > 0:
+            # the last sector may be cut short by the end of the buffer.
+            end = offset + (chain[-1]+1)*sectorSize
+            self.size -= min(sectorSize, max(0, end - len(bytes)))
+
+    def __len__ (self):
+        return self.size
+
+    def __getitem__ (self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self.__read(start, stop - start)[::step]
+            return self.__read(start, stop - start)
+
+        if key < 0:
+            key += self.size
+        if key < 0 or key >= self.size:
+            raise IndexError("stream index out of range")
+        i, secPos = divmod(key, self.sectorSize)
+        return self.bytes[self.offset + self.chain[i]*self.sectorSize + secPos]
+
+    def __read (self, pos, length):
+        end = min(pos + length, self.size)
+        pieces = []
+        while pos < end:
+            i, secPos = divmod(pos, self.sectorSize)
+            start = self.offset + self.chain[i]*self.sectorSize + secPos
+            n = min(self.sectorSize - secPos, end - pos)
+            # extend the read over adjacent sectors.
+            while pos + n < end and i + 1 < len(self.chain) and \
+                self.chain[i+1] == self.chain[i] + 1:
+                i += 1
+                n = min(n + self.sectorSize, end - pos)
+            pieces.append(self.bytes[start:start+n])
+            pos += n
+        if len(pieces) == 1:
+            return pieces[0]
+        return "".join(pieces)
+
+    def read (self, size=-1):
+        if size < 0:
+            size = self.size - self.pos
+        bytes = self.__read(self.pos, size)
+        self.pos += len(bytes)
+        return bytes
+
+    def readinto (self, buf):
+        bytes = self.read(len(buf))
+        buf[:len(bytes)] = bytes
+        return len(bytes)
+
+    def seek (self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError("negative seek position %d"%offset)
+        self.pos = offset
+
+    def tell (self):
+        return self.pos
+
+
 class DateTime:
     def __init__(self):
         self.day = 0
@@ -783,6 +975,7 @@ class OleContainer:
         self.filePath = filePath
         self.header = None
         self.rootNode = None
+        self.nodesByName = {}
         self.params = params
 
     def __getModifiedTime(self, entry):
@@ -799,14 +992,11 @@ class OleContainer:
 
     def __parseFile (self):
         if self.rootNode == None:
-            file = open(self.filePath, 'rb')
-            self.chars = file.read()
-            file.close()
+            self.chars = mapFile(self.filePath)
             self.header = Header(self.chars, self.params)
             self.header.parse()
             self.obj = self.header.getDirectory()
             self.obj.parseDirEntries()
-            count = 0
             self.rootNode = self.__buildTree( self.obj.entries )
 
     def __addSiblings( self, entries, parent, child ):
@@ -818,6 +1008,7 @@ class OleContainer:
             newEntry.HierachicalName = parent.HierachicalName + newEntry.Entry.Name
             if  newEntry.Entry.DirIDRoot > 0:
                 newEntry.HierachicalName = newEntry.HierachicalName + '/'
+            self.__addNode( newEntry )
 
             self.__addSiblings( entries, parent, newEntry )
             parent.Nodes.insert( 0, newEntry )
@@ -830,6 +1021,7 @@ class OleContainer:
             newEntry.HierachicalName = parent.HierachicalName + newEntry.Entry.Name
             if  newEntry.Entry.DirIDRoot > 0:
                 newEntry.HierachicalName = newEntry.HierachicalName + '/'
+            self.__addNode( newEntry )
             self.__addSiblings( entries, parent, newEntry )
             parent.Nodes.append( newEntry )
 
@@ -841,6 +1033,7 @@ class OleContainer:
             newEntry.HierachicalName = parent.HierachicalName +  newEntry.Entry.Name
             if ( newEntry.Entry.DirIDRoot > 0 ):
                 newEntry.HierachicalName =  newEntry.HierachicalName + '/'
+            self.__addNode( newEntry )
 
             self.__addSiblings( entries, parent, newEntry )
             parent.Nodes.append( newEntry )
@@ -851,19 +1044,26 @@ class OleContainer:
 
     def __buildTree(self, entries ):
         treeRoot = DirNode( entries[0], self )
+        self.__addNode( treeRoot )
         self.__buildTreeImpl( entries, treeRoot )
         return treeRoot
 
-    def __findEntryByHierachicalName( self, node, name ):
-        if node.HierachicalName == name:
+    def __addNode( self, node ):
+        # index nodes by hierarchical name as the tree gets built, so that
+        # lookups don't need to walk the tree.
+        if node.HierachicalName not in self.nodesByName:
+            self.nodesByName[ node.HierachicalName ] = node
+
+    def __findEntryByHierachicalName( self, name ):
+        node = self.getNodeByHierarchicalName( name )
+        if node != None:
             return node.Entry
-        else:
-            for child in node.Nodes:
-                result = self.__findEntryByHierachicalName( child, name )
-                if result != None:
-                    return result
         return None
 
+    def getNodeByHierarchicalName( self, name ):
+        self.__parseFile()
+        return self.nodesByName.get( name )
+
     def __printListReport( self, treeNode ):
 
         dateInfo = self.__getModifiedTime( treeNode.Entry )
@@ -876,7 +1076,7 @@ class OleContainer:
             self.__printListReport( node )
 
     def __printHeader(self):
-        globals.outputln("OLE: %s")%self.filePath
+        globals.outputln("OLE: %s"%self.filePath)
         globals.outputln(" Length     Date   Time    Name")
         globals.outputln("--------    ----   ----    ----")
 
@@ -900,20 +1100,103 @@ class OleContainer:
     def getStreamForName( self, name ):
         self.__parseFile()
         if  self.rootNode != None:
-            entry = self.__findEntryByHierachicalName( self.rootNode, name )
+            entry = self.__findEntryByHierachicalName( name )
             return self.getStreamForEntry( entry )
 
     def extract(self, name):
         self.__parseFile()
         if  self.rootNode != None:
-            entry = self.__findEntryByHierachicalName( self.rootNode, name )
+            entry = self.__findEntryByHierachicalName( name )
             bytes = self.getStreamForEntry( entry )
             file = open(entry.Name, 'wb')
             file.write( bytes )
-            file.close
+            file.close()
         else:
             globals.outputln("failed to initialise ole container")
 
+    def __getStreamNodes( self, treeNode ):
+        nodes = []
+        stack = [ treeNode ]
+        while len( stack ) > 0:
+            node = stack.pop()
+            if node.Entry.Type == Directory.Type.UserStream:
+                nodes.append( node )
+            stack.extend( reversed( node.Nodes ) )
+        return nodes
+
+    def __getFilePath( self, outputDir, name ):
+        # one directory level per storage; names are escaped so that they
+        # are usable as file names.
+        path = outputDir
+        for part in name.split( '/' ):
+            if len( part ) == 0:
+                continue
+            part = globals.encodeName( part )
+            if part in ( '.', '..' ):
+                part = part.replace( '.', '\\x2E' )
+            path = os.path.join( path, part )
+        return path
+
+    def extractAll( self, outputDir, patterns=None, jobs=4 ):
+        """Extract all streams (or those whose hierarchical name matches one
+of the glob patterns) into a directory tree below outputDir.  Streams are
+read one after another from the parsed container while a pool of threads
+writes them out.  Returns the hierarchical names of the extracted streams;
+streams that couldn't be written are reported through globals.error() and
+left out."""
+        self.__parseFile()
+        if self.rootNode == None:
+            globals.outputln("failed to initialise ole container")
+            return []
+
+        queue = Queue.Queue( jobs*2 )
+        errors = []
+        def writeFiles():
+            while True:
+                item = queue.get()
+                if item == None:
+                    break
+                name, path, bytes = item
+                try:
+                    dirPath = os.path.dirname( path )
+                    try:
+                        os.makedirs( dirPath )
+                    except OSError:
+                        if not os.path.isdir( dirPath ):
+                            raise
+                    file = open( path, 'wb' )
+                    file.write( bytes )
+                    file.close()
+                except EnvironmentError as e:
+                    errors.append( ( name, e ) )
+
+        threads = [ threading.Thread( target=writeFiles ) for i in xrange( 0, max( 1, jobs ) ) ]
+        for thread in threads:
+            thread.start()
+
+        names = []
+        try:
+            for node in self.__getStreamNodes( self.rootNode ):
+                name = node.HierachicalName
+                # patterns may match either the raw or the escaped name.
+                if patterns and not [ p for p in patterns if fnmatch.fnmatchcase( name, p ) or
+                                      fnmatch.fnmatchcase( globals.encodeName( name ), p ) ]:
+                    continue
+                path = self.__getFilePath( outputDir, name )
+                queue.put( ( name, path, self.getStreamForEntry( node.Entry ) ) )
+                names.append( name )
+        finally:
+            for thread in threads:
+                queue.put( None )
+            for thread in threads:
+                thread.join()
+
+        failed = set()
+        for name, e in errors:
+            globals.error( "%s: %s\n"%( globals.encodeName( name ), e ) )
+            failed.add( name )
+        return [ name for name in names if name not in failed ]
+
     def read(self):
         self.__parseFile()
 
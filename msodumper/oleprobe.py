@@ -0,0 +1,168 @@
+# -*- tab-width: 4; indent-tabs-mode: nil -*-
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import ole, globals
+from globals import getSignedInt, getUnsignedInt
+
+# Quick classification of compound documents.  Only the header, the sectors
+# of the directory stream and the SAT sectors needed to follow its chain are
+# read; the SAT as a whole is never built.
+
+Signature = "\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1"
+
+class ProbeError(Exception):
+    """The file is not a valid compound document, e.g. it's truncated."""
+    pass
+
+
+class AppType:
+    Unknown    = 'unknown'
+    Word       = 'word'
+    Excel      = 'excel'
+    PowerPoint = 'powerpoint'
+    Visio      = 'visio'
+
+# name of the main stream: application
+appStreams = {
+    "WordDocument":        AppType.Word,
+    "Workbook":            AppType.Excel,
+    "Book":                AppType.Excel,
+    "PowerPoint Document": AppType.PowerPoint,
+    "VisioDocument":       AppType.Visio,
+}
+
+# streams that only exist in encrypted documents
+encryptionStreams = ["EncryptionInfo", "EncryptedPackage", "EncryptedSummary"]
+
+
+class ProbeResult(object):
+    """Summary of one probed file."""
+    def __init__ (self, filePath):
+        self.filePath = filePath
+        self.isCompoundDocument = False
+        self.sectorSize = 0
+        self.app = AppType.Unknown
+        self.encrypted = False
+        self.streamNames = []
+        self.error = None
+
+
+class Prober(object):
+
+    def __init__ (self, chars, params):
+        self.chars = chars
+        self.params = params
+        self.header = None
+        self.directory = None
+        self.__SATEntries = {}
+
+    def __getSATEntry (self, secID):
+        # look a single SAT entry up through the MSAT, so only the SAT sector
+        # holding it is touched.
+        if secID in self.__SATEntries:
+            return self.__SATEntries[secID]
+        size = self.header.getSectorSize()
+        satIndex, offset = divmod(secID, size//4)
+        secIDs = self.header.getMSAT().secIDs
+        if satIndex >= len(secIDs):
+            return -1
+        pos = globals.getSectorPos(secIDs[satIndex], size) + offset*4
+        bytes = self.chars[pos:pos+4]
+        if len(bytes) < 4:
+            raise ProbeError("SAT sector %d is past the end of the file"%secIDs[satIndex])
+        nextID = getSignedInt(bytes)
+        self.__SATEntries[secID] = nextID
+        return nextID
+
+    def getSectorIDChain (self, initID, maxLength=None):
+        chain = []
+        visited = set()
+        secID = initID
+        while secID >= 0 and secID not in visited:
+            if maxLength != None and len(chain) >= maxLength:
+                break
+            visited.add(secID)
+            chain.append(secID)
+            secID = self.__getSATEntry(secID)
+        return chain
+
+    def parse (self):
+        if len(self.chars) < 512:
+            raise ProbeError("truncated header: the file has only %d bytes"%len(self.chars))
+        self.header = ole.Header(self.chars, self.params)
+        self.header.parse()
+        self.directory = ole.Directory(self.header, self.params)
+        size = self.header.getSectorSize()
+        chain = self.getSectorIDChain(self.header.getFirstSectorID(ole.BlockType.Directory))
+        if len(chain) == 0:
+            raise ProbeError("no directory sector")
+        for secID in chain:
+            if globals.getSectorPos(secID, size) + size > len(self.chars):
+                raise ProbeError("directory sector %d is past the end of the file"%secID)
+            self.directory.addSector(secID)
+        self.directory.parseDirEntries()
+
+    def readStreamHead (self, entry, size):
+        """Return up to the first size bytes of a stream."""
+        if entry.StreamLocation == ole.StreamLocation.SSAT:
+            # short streams live in the short stream container, which
+            # requires the full SAT; they are small files anyway.
+            return self.directory.getStreamReader(entry)[0:size]
+        secSize = self.header.getSectorSize()
+        chain = self.getSectorIDChain(entry.StreamSectorID, (size + secSize - 1)//secSize)
+        return ole.OleStreamReader(self.chars, chain, secSize)[0:size]
+
+    def isWordEncrypted (self, entry):
+        # FibBase.fEncrypted
+        bytes = self.readStreamHead(entry, 12)
+        return len(bytes) == 12 and (getUnsignedInt(bytes[10:12]) & 0x0100) != 0
+
+    def isExcelEncrypted (self, entry):
+        # FILEPASS has to immediately follow the BOF of the globals substream.
+        bytes = self.readStreamHead(entry, 4)
+        if len(bytes) < 4 or getUnsignedInt(bytes[0:2]) != 0x0809:
+            return False
+        size = getUnsignedInt(bytes[2:4])
+        bytes = self.readStreamHead(entry, 4 + size + 2)
+        return len(bytes) == 6 + size and getUnsignedInt(bytes[4+size:]) == 0x002F
+
+
+def probe (filePath, params):
+    """Classify a file without reading more of it than necessary."""
+    result = ProbeResult(filePath)
+    try:
+        chars = ole.mapFile(filePath)
+        if chars[0:8] != Signature:
+            return result
+
+        result.isCompoundDocument = True
+        prober = Prober(chars, params)
+        prober.parse()
+        result.sectorSize = prober.header.getSectorSize()
+        for entry in prober.directory.getDirectoryEntries():
+            if entry.Type == ole.Directory.Type.Empty:
+                continue
+            result.streamNames.append(entry.Name)
+            if entry.Name in encryptionStreams:
+                result.encrypted = True
+            if result.app == AppType.Unknown and entry.Name in appStreams:
+                result.app = appStreams[entry.Name]
+                if result.app == AppType.Word:
+                    result.encrypted |= prober.isWordEncrypted(entry)
+                elif result.app == AppType.Excel:
+                    result.encrypted |= prober.isExcelEncrypted(entry)
+    except (EnvironmentError, ProbeError) as e:
+        # unreadable and broken files are reported, whether exceptions are
+        # caught or not.
+        result.error = str(e)
+    except Exception as e:
+        if not params.catchExceptions:
+            raise
+        result.error = str(e)
+    return result
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
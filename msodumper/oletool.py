@@ -15,6 +15,12 @@ def main ():
     parser = optparse.OptionParser()
     parser.add_option("-l", "--list", action="store_true", dest="list", default=False, help="lists ole contents")
     parser.add_option("-x", "--extract", action="store_true", dest="extract", default=False, help="extract file")
+    parser.add_option("-a", "--extract-all", action="store_true", dest="extractAll", default=False,
+        help="extract all streams, or those matching the glob patterns given after the file, into a directory tree")
+    parser.add_option("-o", "--output-dir", dest="outputDir", default=".", metavar="DIR",
+        help="directory to extract all streams into (default: current directory)")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=4,
+        help="number of threads writing extracted streams (default: 4)")
 
 
     options, args = parser.parse_args()
@@ -23,6 +29,7 @@ def main ():
 
     params.list =  options.list
     params.extract =  options.extract
+    params.extractAll = options.extractAll
 
     if len(args) < 1:
         globals.error("takes at least one argument\n")
@@ -39,6 +46,9 @@ def main ():
 
        for file in files:
            container.extract( file )
+    if params.extractAll:
+        for name in container.extractAll( options.outputDir, args[ 1: ], options.jobs ):
+            globals.outputln( globals.encodeName( name ) )
 
 if __name__ == '__main__':
     main()
@@ -41,6 +41,9 @@ append a line to be displayed.
 
     def output (self):
         self.parseBytes()
+        if globals.params.noStructOutput:
+            # parseBytes() may have collected text to dump, that's all
+            return
         self.__print("%4.4Xh: %s"%(self.recordType, "-"*61))
         for line in self.lines:
             self.__print("%4.4Xh: %s"%(self.recordType, line))
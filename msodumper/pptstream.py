@@ -70,7 +70,9 @@ class PPTFile(object):
         obj = self.__getDirectoryObj()
         bytes = []
         if obj is not None:
-            bytes = obj.getRawStreamByName(name)
+            entry = obj.getEntryByName(name)
+            if entry is not None:
+                bytes = obj.getStreamReader(entry)
         strm = PPTDirStream(bytes, self.params)
         return strm
 
@@ -117,7 +119,7 @@ class PPTDirStream(object):
 
 
     def printRecordHeader (self, startPos, recordInstance, recordVersion, recordType, size):
-        if self.params.noStructOutput and self.params.dumpText:
+        if self.params.noStructOutput:
             return
         self.__printSep('=', recordType = recordType)
         if recordType in recData:
@@ -130,18 +132,17 @@ class PPTDirStream(object):
 
 
     def printRecordDump (self, bytes, recordType):
-        if self.params.noStructOutput and self.params.dumpText:
+        if self.params.noStructOutput:
             return
         size = len(bytes)
         self.__printSep('-', 61, "%4.4Xh: "%recordType, recordType = recordType)
-        for i in xrange(0, size):
-            if (i+1) % 16 == 1:
-                output(self.prefix + "%4.4Xh: "%recordType, recordType = recordType)
-            output("%2.2X "%ord(bytes[i]), recordType = recordType)
-            if (i+1) % 16 == 0 and i != size-1:
-                globals.outputln("", recordType = recordType)
+        prefix = self.prefix + "%4.4Xh: "%recordType
+        dumpSize = globals.getDumpSize(size)
+        lines = [prefix + hex + "\n" for pos, hex, text in globals.formatHexLines(bytes[0:dumpSize])]
+        if dumpSize < size:
+            lines.append(prefix + globals.getOmittedBytesText(size, dumpSize) + "\n")
+        output("".join(lines), recordType = recordType)
         if size > 0:
-            globals.outputln("", recordType = recordType)
             self.__printSep('-', 61, "%4.4Xh: "%recordType, recordType = recordType)
 
 
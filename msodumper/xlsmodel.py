@@ -5,6 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import array
 import globals, node, formula
 
 
@@ -29,16 +30,37 @@ class Workbook(ModelBase):
 
         # private members
         self.__sheets = []
+        self.__nextSheetIndex = 0
+
+    def getSheetCount (self):
+        return len(self.__sheets)
+
+    def detachSheets (self, start):
+        """Remove the sheets from position start on and return them."""
+        sheets = self.__sheets[start:]
+        del self.__sheets[start:]
+        return sheets
+
+    def attachSheets (self, sheets):
+        """Append sheets detached from the model of another process."""
+        self.__sheets.extend(sheets)
+
+    def appendSheet (self, sheetType, sheetIndex=None):
+        """Append a sheet for a BOF record.  sheetIndex is the position of the
+sheet's BOUNDSHEET record, if known; worksheet IDs are that position plus 1.
+Otherwise the sheet is assumed to follow the last one appended."""
+        if sheetType != 0x0005:
+            if sheetIndex == None:
+                sheetIndex = self.__nextSheetIndex
+            self.__nextSheetIndex = sheetIndex + 1
 
-
-    def appendSheet (self, sheetType):
         def raiseError(cause):
             def errorFunc():
                 raise Exception(cause)
 
         HANDLERS = { 0x0005: WorkbookGlobal,
                      0x0006: raiseError("Unsupported sheet type: Visual Basic module"),
-                     0x0010: lambda: Worksheet(len(self.__sheets)),
+                     0x0010: lambda: Worksheet(sheetIndex + 1),
                      0x0020: Chart,
                      0x0040: raiseError("Unsupported sheet type: Excel 4.0 macro sheet"),
                      0x0100: raiseError("Unsupported sheet type: Workspace file")
@@ -63,10 +85,14 @@ class Workbook(ModelBase):
 
         wbglobal = self.getWorkbookGlobal()
         nd.appendChild(wbglobal.createDOM(self))
-        for (i,sheet) in enumerate(sheets):
+        for sheet in sheets:
             sheetNode = sheet.createDOM(self)
             nd.appendChild(sheetNode)
-            data = wbglobal.getSheetData(i-1)
+            # sheet IDs count from 1, the globals substream being 0
+            i = sheet.getSheetID() - 1
+            if i >= wbglobal.getSheetDataCount():
+                continue
+            data = wbglobal.getSheetData(i)
             sheetNode.setAttr('name', data.name)
             sheetNode.setAttr('visible', data.visible)
 
@@ -200,11 +226,19 @@ class WorkbookGlobal(SheetBase):
             self.name = None
             self.visible = True
 
+    SharedTextBlockSize = 1024
+
     def __init__ (self):
         SheetBase.__init__(self, SheetBase.Type.WorkbookGlobal)
 
         self.__sheetData = []
-        self.__sharedStrings = []
+        # shared strings, joined in blocks of SharedTextBlockSize strings,
+        # with the end offset of each string in the whole text.  The strings
+        # of the last, incomplete block are kept as they are.
+        self.__sharedTextBlocks = []
+        self.__sharedTextPieces = []
+        self.__sharedTextEnds = array.array('I')
+        self.__phoneticBytes = {} # key: string ID, only for strings having any
         self.__supbooks = []
         self.__externSheets = []  # tuple (book ID, sheet begin ID, sheet end ID)
         self.__dbRanges = {}      # key: sheet ID (0-based), value: range tokens
@@ -225,13 +259,40 @@ class WorkbookGlobal(SheetBase):
     def getSheetData (self, i):
         return self.__sheetData[i]
 
+    def getSheetDataCount (self):
+        return len(self.__sheetData)
+
     def appendSharedString (self, sst):
-        self.__sharedStrings.append(sst)
+        """Append a shared string, given as globals.UnicodeRichExtText."""
+        ends = self.__sharedTextEnds
+        if len(sst.phoneticBytes) > 0:
+            self.__phoneticBytes[len(ends)] = sst.phoneticBytes
+        ends.append((len(ends) > 0 and ends[-1] or 0) + len(sst.baseText))
+        self.__sharedTextPieces.append(sst.baseText)
+        if len(self.__sharedTextPieces) == WorkbookGlobal.SharedTextBlockSize:
+            self.__sharedTextBlocks.append(u"".join(self.__sharedTextPieces))
+            self.__sharedTextPieces = []
+
+    def getSharedText (self, strID):
+        ends = self.__sharedTextEnds
+        if len(ends) <= strID:
+            return None
+        block, i = divmod(strID, WorkbookGlobal.SharedTextBlockSize)
+        if block == len(self.__sharedTextBlocks):
+            return self.__sharedTextPieces[i]
+        blockStart = strID - i
+        base = blockStart > 0 and ends[blockStart-1] or 0
+        start = strID > 0 and ends[strID-1] or 0
+        return self.__sharedTextBlocks[block][start-base:ends[strID]-base]
 
     def getSharedString (self, strID):
-        if len(self.__sharedStrings) <= strID:
+        text = self.getSharedText(strID)
+        if text == None:
             return None
-        return self.__sharedStrings[strID]
+        sst = globals.UnicodeRichExtText()
+        sst.baseText = text
+        sst.phoneticBytes = self.__phoneticBytes.get(strID, [])
+        return sst
 
     def appendSupbook (self, sb):
         self.__supbooks.append(sb)
@@ -274,46 +335,166 @@ class Shape(object):
         self.dx2 = dx2
         self.dy2 = dy2
 
-class Worksheet(SheetBase):
+class OrderedRangeList(object):
+    def __init__ (self):
+        self.__list = [] # list of ranges with value [start, end, value]
 
-    class OrderedRangeList(object):
-        def __init__ (self):
-            self.__list = [] # list of ranges with value [start, end, value]
+    def setValue (self, key, val):
+        if len(self.__list) == 0:
+            self.__list.append([key, key, val])
+            return
 
-        def setValue (self, key, val):
-            if len(self.__list) == 0:
-                self.__list.append([key, key, val])
-                return
+        if (key - self.__list[-1][1]) <= 1 and self.__list[-1][2] == val:
+            # expand the last range.
+            self.__list[-1][1] = key
+        else:
+            # start a new range.
+            self.__list.append([key, key, val])
 
-            if (key - self.__list[-1][1]) <= 1 and self.__list[-1][2] == val:
-                # expand the last range.
-                self.__list[-1][1] = key
-            else:
-                # start a new range.
-                self.__list.append([key, key, val])
+    def getAllRanges (self):
+        return self.__list
+
+    def getLength (self):
+        return len(self.__list)
+
+
+class CellObjects(list):
+    """The cell objects of a sheet, for the cells RowCells doesn't store as
+plain values.  Slots of cells that were overwritten by a plain value are
+released and handed out again by add()."""
+
+    def __init__ (self):
+        list.__init__(self)
+        self.freeSlots = []
+
+    def add (self, cell):
+        if len(self.freeSlots) > 0:
+            slot = self.freeSlots.pop()
+            self[slot] = cell
+            return slot
+        self.append(cell)
+        return len(self) - 1
+
+    def release (self, slot):
+        self[slot] = None
+        self.freeSlots.append(slot)
+
+
+class RowCells(object):
+    """Cells of a row, in the order their columns were first set.  For each
+cell there's the column, a type tag and a value: the number, the shared string
+ID, or the slot of the cell object in the sheet's CellObjects for the cells
+that aren't stored as plain values (formulas)."""
+
+    __slots__ = ('cols', 'tags', 'values', 'lastCol')
+
+    class Tag:
+        Label   = 0
+        Float   = 1
+        Integer = 2
+        Object  = 3
 
-        def getAllRanges (self):
-            return self.__list
+    def __init__ (self):
+        self.cols = array.array('i')
+        self.tags = array.array('B')
+        self.values = array.array('d')
+        self.lastCol = None # highest column
+
+    def setCell (self, col, cell, objects):
+        cols = self.cols
+        i = None
+        if self.lastCol != None and col <= self.lastCol:
+            # a BIFF8 row has at most 256 columns, a scan of the array is
+            # cheap.  Cells mostly come in column order and don't get here.
+            try:
+                i = cols.index(col)
+            except ValueError:
+                pass
+        objectSlot = None
+        if i != None and self.tags[i] == RowCells.Tag.Object:
+            objectSlot = int(self.values[i])
+
+        cellType = cell.modelType
+        if cellType == CellBase.Type.Label and type(cell.strID) == int:
+            tag, value = RowCells.Tag.Label, cell.strID
+        elif cellType == CellBase.Type.Number and type(cell.value) == float:
+            tag, value = RowCells.Tag.Float, cell.value
+        elif cellType == CellBase.Type.Number and type(cell.value) == int and abs(cell.value) < 2**53:
+            tag, value = RowCells.Tag.Integer, cell.value
+        elif objectSlot != None:
+            # reuse the slot of the overwritten cell object.
+            tag, value = RowCells.Tag.Object, objectSlot
+            objects[objectSlot] = cell
+            objectSlot = None
+        else:
+            tag, value = RowCells.Tag.Object, objects.add(cell)
+
+        if i != None:
+            # overwrite the cell in place.
+            if objectSlot != None:
+                # drop the overwritten cell object.
+                objects.release(objectSlot)
+            self.tags[i] = tag
+            self.values[i] = value
+            return
+        if self.lastCol == None or col > self.lastCol:
+            self.lastCol = col
+        cols.append(col)
+        self.tags.append(tag)
+        self.values.append(value)
+
+    def setNumbers (self, col, values, integers, objects):
+        """Set number cells at consecutive columns starting at col.  integers
+tells for each value whether it's an integer."""
+        n = len(values)
+        if self.lastCol != None and col <= self.lastCol:
+            # some of the cells may be overwritten.
+            for i in xrange(0, n):
+                value = values[i]
+                if integers[i]:
+                    value = int(value)
+                self.setCell(col + i, NumberCell(value), objects)
+            return
+        self.lastCol = col + n - 1
+        self.cols.extend(xrange(col, col + n))
+        self.tags.extend(array.array('B', [integer and RowCells.Tag.Integer or RowCells.Tag.Float for integer in integers]))
+        self.values.extend(values)
+
+    def getCell (self, i, objects):
+        """Return the i-th cell as a cell object."""
+        tag = self.tags[i]
+        if tag == RowCells.Tag.Label:
+            cell = LabelCell()
+            cell.strID = int(self.values[i])
+            return cell
+        if tag == RowCells.Tag.Float:
+            return NumberCell(self.values[i])
+        if tag == RowCells.Tag.Integer:
+            return NumberCell(int(self.values[i]))
+        return objects[int(self.values[i])]
 
-        def getLength (self):
-            return len(self.__list)
 
+class Worksheet(SheetBase):
 
     def __init__ (self, sheetID):
         SheetBase.__init__(self, SheetBase.Type.Worksheet)
-        self.__rows = {}
+        self.__rows = {} # key: row, value: RowCells
+        self.__cellObjects = CellObjects()
         self.__autoFilterArrows = []
         self.__sheetID = sheetID
         self.__firstDefinedCell = None
         self.__firstFreeCell = None
-        self.__hiddenRows = Worksheet.OrderedRangeList()
-        self.__rowHeights = Worksheet.OrderedRangeList()
+        self.__hiddenRows = OrderedRangeList()
+        self.__rowHeights = OrderedRangeList()
         self.__shapes = []
         self.__lastCell = None
         self.__condFormats = []
         self.__dataValidations = []
 
 
+    def getSheetID (self):
+        return self.__sheetID
+
     def addShape (self, obj):
         self.__shapes.append(obj)
 
@@ -335,12 +516,39 @@ class Worksheet(SheetBase):
         self.__autoFilterArrows[filterID] = obj
 
     def setCell (self, col, row, cell):
-        if not self.__rows.has_key(row):
-            self.__rows[row] = {}
+        cells = self.__rows.get(row)
+        if cells == None:
+            cells = self.__rows[row] = RowCells()
 
-        self.__rows[row][col] = cell
+        cells.setCell(col, cell, self.__cellObjects)
         self.__lastCell = cell
 
+    def setNumberCells (self, col, row, values, integers):
+        """Set number cells at consecutive columns of a row, starting at col,
+without creating a cell object for each.  integers tells for each value of the
+array of doubles whether it's an integer."""
+        if len(values) == 0:
+            return
+        cells = self.__rows.get(row)
+        if cells == None:
+            cells = self.__rows[row] = RowCells()
+
+        cells.setNumbers(col, values, integers, self.__cellObjects)
+        value = values[-1]
+        if integers[-1]:
+            value = int(value)
+        self.__lastCell = NumberCell(value)
+
+    def getCell (self, col, row):
+        cells = self.__rows.get(row)
+        if cells == None:
+            return None
+        try:
+            i = cells.cols.index(col)
+        except ValueError:
+            return None
+        return cells.getCell(i, self.__cellObjects)
+
     def getLastCell (self):
         return self.__lastCell
 
@@ -369,9 +577,14 @@ class Worksheet(SheetBase):
         for row in rows:
             rowNode = nd.appendElement('row')
             rowNode.setAttr('id', row)
-            cols = self.__rows[row].keys()
+            cells = self.__rows[row]
+            # the columns come in the order of a dictionary of them, as the
+            # cells used to be stored in one.
+            cols = {}
+            for i, col in enumerate(cells.cols):
+                cols[col] = i
             for col in cols:
-                cell = self.__rows[row][col]
+                cell = cells.getCell(cols[col], self.__cellObjects)
                 cellNode = cell.createDOM(wb)
                 rowNode.appendChild(cellNode)
                 cellNode.setAttr('col', col)
@@ -488,11 +701,15 @@ class CellBase(object):
         Formula = 2
         Unknown = 999
 
+    __slots__ = ('modelType',)
+
     def __init__ (self, modelType):
         self.modelType = modelType
 
 
 class LabelCell(CellBase):
+    __slots__ = ('strID',)
+
     def __init__ (self):
         CellBase.__init__(self, CellBase.Type.Label)
         self.strID = None
@@ -500,13 +717,15 @@ class LabelCell(CellBase):
     def createDOM (self, wb):
         nd = node.Element('label-cell')
         if self.strID != None:
-            sst = wb.getWorkbookGlobal().getSharedString(self.strID)
-            if sst != None:
-                nd.setAttr('value', sst.baseText)
+            text = wb.getWorkbookGlobal().getSharedText(self.strID)
+            if text != None:
+                nd.setAttr('value', text)
         return nd
 
 
 class NumberCell(CellBase):
+    __slots__ = ('value',)
+
     def __init__ (self, value):
         CellBase.__init__(self, CellBase.Type.Number)
         self.value = value
@@ -518,6 +737,8 @@ class NumberCell(CellBase):
 
 
 class FormulaCell(CellBase):
+    __slots__ = ('tokens', 'cachedResult')
+
     def __init__ (self):
         CellBase.__init__(self, CellBase.Type.Formula)
         self.tokens = None
@@ -13,9 +13,13 @@ class ParseException(Exception):
     pass
 
 class TokenStream(object):
-    def __init__(self, tokens):
+    def __init__(self, tokens, memoize=False):
         self.tokens = tokens
         self.currentIndex = 0
+        # packrat memo table, (parser, token index): (parsed, end index, exception)
+        self.memo = None
+        if memoize:
+            self.memo = {}
 
     def readToken(self):
         if self.currentIndex >= len(self.tokens):
@@ -24,6 +28,22 @@ class TokenStream(object):
         self.currentIndex += 1
         return token
 
+    def peekClass(self):
+        """Return the handler class of the next token, or None at the end of
+the stream or if the token has no handler."""
+        if self.currentIndex >= len(self.tokens):
+            return None
+        token = self.tokens[self.currentIndex]
+        if token is None:
+            return None
+        return token.handlerClass
+
+# What a parser does when the next token is none of those it can start with;
+# it then reads no token at all.
+NoMatch = 0 # returns None
+Empty   = 1 # returns an empty result
+Fail    = 2 # raises ParseException
+
 class BaseParser(object):
     def parse(self, stream):
         parser = getattr(self, 'PARSER', None)
@@ -32,6 +52,37 @@ class BaseParser(object):
         else:
             return parser.parse(stream)
 
+    def getFirst(self):
+        """Return (first, fallback).  first is the tuple of the token classes
+the parser can start with, or None if it may start with any token, and
+fallback is NoMatch, Empty or Fail, see above."""
+        first = self.__dict__.get('_first')
+        if first is None:
+            first = self._first = self.computeFirst()
+        return first
+
+    def computeFirst(self):
+        parser = getattr(self, 'PARSER', None)
+        if parser is None:
+            return ((), NoMatch)
+        return parser.getFirst()
+
+    def mayMatch(self, cls):
+        """Return False if the parser can only return None or fail when the
+next token is of class cls (None at the end of the stream)."""
+        starts = self.__dict__.get('_starts')
+        if starts is None:
+            starts = self._starts = {}
+        elif cls in starts:
+            return starts[cls]
+        first, fallback = self.getFirst()
+        if first is None or fallback == Empty:
+            match = True
+        else:
+            match = cls is not None and any(issubclass(cls, x) for x in first)
+        starts[cls] = match
+        return match
+
     def __str__(self):
         parser = getattr(self, 'PARSER', None)
         if parser is None:
@@ -49,16 +100,35 @@ class BaseParser(object):
 def safeParse(parser, stream):
     #print "TRACE:[%s,%s]" % (str(parser), str(stream.tokens[stream.currentIndex]))
 
+    curIndex = stream.currentIndex
+    memo = stream.memo
+    if memo is not None:
+        # key on the grammar node, the PARSER that all the instances of a rule
+        # class share.  The table holds on to the node, so unlike its id(), the
+        # key can't be taken over by a parser created later in the parse.
+        key = (getattr(parser, 'PARSER', parser), curIndex)
+        entry = memo.get(key)
+        if entry is not None:
+            parsed, stream.currentIndex, exc = entry
+            if exc is not None:
+                raise exc
+            return parsed
+
     parsed = None
     try:
-        curIndex = stream.currentIndex
         parsed = parser.parse(stream)
     except ParseException as exc:
         stream.currentIndex = curIndex
+        if memo is not None:
+            memo[key] = (None, curIndex, exc)
         raise
+    if memo is not None:
+        memo[key] = (parsed, stream.currentIndex, None)
     return parsed
 
 def getParsedOrNone(parser, stream):
+    if not parser.mayMatch(stream.peekClass()):
+        return None
     parsed = None
     try:
         parsed = safeParse(parser, stream)
@@ -73,12 +143,15 @@ class Term(BaseParser):
     def parse(self, stream):
         curIndex = stream.currentIndex
         token = stream.readToken()
-        if not token is None and isinstance(token, self.__tokenType):
+        if not token is None and issubclass(token.handlerClass, self.__tokenType):
             return token
         else:
             stream.currentIndex = curIndex
             return None
 
+    def computeFirst(self):
+        return ((self.__tokenType,), NoMatch)
+
     def __str__(self):
         return 'Term(%s)' % str(self.__tokenType)
 
@@ -89,6 +162,12 @@ class Opt(BaseParser):
     def parse(self, stream):
         return getParsedOrNone(self.__parser, stream)
 
+    def computeFirst(self):
+        first, fallback = self.__parser.getFirst()
+        if fallback == Fail:
+            fallback = NoMatch
+        return (first, fallback)
+
     def __str__(self):
         return 'Opt(%s)' % str(self.__parser)
 
@@ -106,6 +185,12 @@ class Req(BaseParser):
                                  (str(self.__parser), str(currentToken)))
         return parsed
 
+    def computeFirst(self):
+        first, fallback = self.__parser.getFirst()
+        if fallback == NoMatch:
+            fallback = Fail
+        return (first, fallback)
+
     def __str__(self):
         return 'Req(%s)' % str(self.__parser)
 
@@ -114,6 +199,8 @@ class AnyButThis(BaseParser):
         self.__parser = parser
 
     def parse(self, stream):
+        if stream.currentIndex >= len(stream.tokens):
+            return None
         curIndex = stream.currentIndex
         parsed = getParsedOrNone(self.__parser, stream)
         if parsed is None:
@@ -122,9 +209,57 @@ class AnyButThis(BaseParser):
             stream.currentIndex = curIndex
             return None
 
+    def computeFirst(self):
+        return (None, NoMatch)
+
     def __str__(self):
         return 'AnyButThis(%s)' % str(self.__parser)
 
+class TokenRange(object):
+    """Tokens of a stream from start to end.  They are looked up once more
+when dumped, one at a time, instead of being kept."""
+
+    def __init__(self, tokens, start, end):
+        self.tokens = tokens
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def dumpData(self):
+        for i in xrange(self.start, self.end):
+            token = self.tokens[i]
+            if token is None:
+                yield ('any', None)
+            else:
+                yield ('any', token.dumpData())
+
+class AnyUntil(BaseParser):
+    """Like Many(group, AnyButThis(parser)), but the tokens are returned as a
+TokenRange, so that skipping a long run of tokens costs no memory."""
+
+    def __init__(self, group, parser):
+        self.__group = group
+        self.__parser = parser
+
+    def parse(self, stream):
+        start = stream.currentIndex
+        while stream.currentIndex < len(stream.tokens):
+            curIndex = stream.currentIndex
+            parsed = getParsedOrNone(self.__parser, stream)
+            stream.currentIndex = curIndex
+            if not parsed is None:
+                break
+            stream.currentIndex += 1
+        return (self.__group, TokenRange(stream.tokens, start, stream.currentIndex))
+
+    def computeFirst(self):
+        return (None, Empty)
+
+    def __str__(self):
+        return 'AnyUntil(%s,%s)' % (self.__group, str(self.__parser))
+
 class Many(BaseParser):
     def __init__(self, group, parser, min=0, max=-1):
         self.__group = group
@@ -149,20 +284,51 @@ class Many(BaseParser):
             raise ParseException("%s should occur at least %s times" % (self.__parser,self.__min))
         return (self.__group, parsedList)
 
+    def computeFirst(self):
+        if self.__min == 0 and self.__max == 0:
+            return ((), NoMatch)
+        first, fallback = self.__parser.getFirst()
+        if fallback == Empty:
+            # the repetitions can't be told apart without reading
+            return (None, Empty)
+        if self.__min > 0:
+            return (first, Fail)
+        return (first, Empty)
+
     def __str__(self):
         return 'Many(%s,%s,min=%s,max=%s)' % (self.__group, str(self.__parser), self.__min, self.__max)
 
 class OneOf(BaseParser):
     def __init__(self, *args):
         self.__parsers = args
+        self.__dispatch = {} # token class: options that may match it
 
     def parse(self, stream):
-        for parser in self.__parsers:
+        cls = stream.peekClass()
+        parsers = self.__dispatch.get(cls)
+        if parsers is None:
+            parsers = self.__dispatch[cls] = [x for x in self.__parsers if x.mayMatch(cls)]
+        for parser in parsers:
             parsed = getParsedOrNone(parser, stream)
             if not parsed is None:
                 return parsed
         raise ParseException("No suitable options: [%s]" % ','.join(str(x) for x in self.__parsers))
 
+    def computeFirst(self):
+        first = []
+        fallback = Fail
+        for parser in self.__parsers:
+            parserFirst, parserFallback = parser.getFirst()
+            if parserFirst is None:
+                first = None
+            elif first is not None:
+                first.extend(parserFirst)
+            if parserFallback == Empty:
+                fallback = Empty
+        if first is not None:
+            first = tuple(first)
+        return (first, fallback)
+
     def __str__(self):
         return 'OneOf(%s)' % ','.join(str(x) for x in self.__parsers)
 
@@ -181,6 +347,23 @@ class Seq(BaseParser):
     def appendParser(self, parser):
         self.__parsers.append(parser)
 
+    def computeFirst(self):
+        # the parsers after the first one that fails are never reached
+        first = []
+        fallback = Empty
+        for parser in self.__parsers:
+            parserFirst, parserFallback = parser.getFirst()
+            if parserFirst is None:
+                first = None
+            elif first is not None:
+                first.extend(parserFirst)
+            if parserFallback == Fail:
+                fallback = Fail
+                break
+        if first is not None:
+            first = tuple(first)
+        return (first, fallback)
+
     def __str__(self):
         return 'Seq(%s)' % ','.join(str(x) for x in self.__parsers)
 
@@ -196,6 +379,9 @@ class Group(BaseParser):
         else:
             return None
 
+    def computeFirst(self):
+        return self.__parser.getFirst()
+
     def __str__(self):
         return 'Group(%s, %s)' % (self.__name, str(self.__parser))
 
@@ -676,8 +862,8 @@ class CHARTSHEETCONTENT(BaseParser):
               Many('custom-views', CUSTOMVIEW()) << CodeName() << CRTMLFRT() << Req(EOF()))
 
 class XlsParser(BaseParser):
-    def __init__(self, tokens):
-        self.__tokenStream = TokenStream(tokens)
+    def __init__(self, tokens, memoize=False):
+        self.__tokenStream = TokenStream(tokens, memoize)
 
     def parse(self, stream):
         PARSERS = {0x0005: None, # WorkbookGlobal
@@ -689,6 +875,7 @@ class XlsParser(BaseParser):
                    }
         parsedList = []
         bofParser = Req(BOF())
+        skipParser = AnyUntil('any-list', OneOf(EOF(), BOF())) << EOF()
 
         while True:
             bof = None
@@ -698,6 +885,7 @@ class XlsParser(BaseParser):
                 pass
             if bof is None: # we should break only in case stream is ended
                 break
+            bof = bof.getHandler()
             bof.dumpData() # we need to dump data to make it parse the record
             parser = PARSERS[bof.dataType]
 
@@ -706,8 +894,7 @@ class XlsParser(BaseParser):
                     parsed = (parser[0], parser[1]().parse(stream))
                     parsedList.append(parsed)
                 else:
-                    parser = Many('any-list', AnyButThis(OneOf(EOF(), BOF()))) << EOF()
-                    parsed = parser.parse(stream) # skipping the unknown stream
+                    parsed = skipParser.parse(stream) # skipping the unknown stream
                     parsedList.append(parsed)
             except ParseException:
                 print ("Parse failed, previous token is [%s], next tokens are [%s]" % (stream.tokens[stream.currentIndex-1],
@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import struct, sys
+import array, struct, sys
 import globals, formula, xlsmodel, msodraw
 
 from globals import debug
@@ -164,6 +164,28 @@ def decodeRK (rkval, auxData = None):
 
     return realVal
 
+def decodeRKs (rkvals):
+    """Decode a sequence of RK values in one pass.  Return an array of the
+values as doubles, and a list telling for each value whether decodeRK() would
+return it as an integer."""
+    n = len(rkvals)
+    # the upper 30 bits of a floating-point RK value are those of a double
+    # whose lower 32 bits are all zero.
+    values = array.array('d', struct.unpack("<%dd"%n,
+        struct.pack("<%dQ"%n, *[(rkval & 0xFFFFFFFC) << 32 for rkval in rkvals])))
+    integers = [False]*n
+    for i in [i for i in xrange(0, n) if rkvals[i] & 0x00000003]:
+        rkval = rkvals[i]
+        if rkval & 0x00000002:
+            realVal = (rkval & 0xFFFFFFFC)/4
+            integers[i] = (rkval & 0x00000001) == 0
+        else:
+            realVal = values[i]
+        if rkval & 0x00000001:
+            realVal /= 100.0
+        values[i] = realVal
+    return values, integers
+
 
 class LongRGB(object):
     def __init__ (self, r, g, b):
@@ -724,6 +746,10 @@ class EOF(BaseRecordHandler):
 
 class BOF(BaseRecordHandler):
 
+    # position of the sheet's BOUNDSHEET record, set by the stream for the BOF
+    # records it finds one for.
+    sheetIndex = None
+
     Type = {
         0x0005: "Workbook globals",
         0x0006: "Visual Basic module",
@@ -812,7 +838,7 @@ class BOF(BaseRecordHandler):
             return
         self.__parseBytes()
 
-        sheet = model.appendSheet(self.dataType)
+        sheet = model.appendSheet(self.dataType, self.sheetIndex)
         s = 'not BIFF8'
         if self.ver == 0x0600:
             s = 'BIFF8'
@@ -865,6 +891,11 @@ class BoundSheet(BaseRecordHandler):
         self.hiddenState = (flags & 0x0003)
         self.sheetType = (flags & 0xFF00)
 
+    def readSheetInfo (self):
+        """Parse the record without producing any output.  The result is in
+posBOF, name, hiddenState and sheetType."""
+        self.__parseBytes()
+
     def parseBytes (self):
         self.__parseBytes()
         self.appendLine("BOF position in this stream: %d"%self.posBOF)
@@ -1368,21 +1399,17 @@ class LabelSST(BaseRecordHandler):
 
 
 class MulRK(BaseRecordHandler):
-    class RKRec(object):
-        def __init__ (self):
-            self.xfIdx = None    # XF record index
-            self.number = None   # RK number
 
     def __parseBytes (self):
         self.row = self.readUnsignedInt(2)
         self.col1 = self.readUnsignedInt(2)
-        self.rkrecs = []
-        rkCount = (self.getSize() - self.getCurrentPos() - 2) / 6
-        for i in xrange(0, rkCount):
-            rec = MulRK.RKRec()
-            rec.xfIdx = self.readUnsignedInt(2)
-            rec.number = self.readUnsignedInt(4)
-            self.rkrecs.append(rec)
+        # (XF record index, RK number) pairs, unpacked and decoded all at once.
+        pos = self.getCurrentPos()
+        rkCount = max(0, (self.getSize() - pos - 2) / 6)
+        pairs = struct.unpack_from("<" + "HI"*rkCount, self.bytes, pos)
+        self.setCurrentPos(pos + rkCount*6)
+        self.xfIndices = array.array('H', pairs[0::2])
+        self.numbers, self.integers = decodeRKs(pairs[1::2])
 
         self.col2 = self.readUnsignedInt(2)
 
@@ -1390,19 +1417,14 @@ class MulRK(BaseRecordHandler):
         self.__parseBytes()
         self.appendLine("row: %d"%self.row)
         self.appendLine("columns: %d - %d"%(self.col1, self.col2))
-        for rkrec in self.rkrecs:
-            self.appendLine("XF record ID: %d"%rkrec.xfIdx)
-            self.appendLine("RK number: %g"%decodeRK(rkrec.number))
+        for i in xrange(0, len(self.numbers)):
+            self.appendLine("XF record ID: %d"%self.xfIndices[i])
+            self.appendLine("RK number: %g"%self.numbers[i])
 
     def fillModel (self, model):
         self.__parseBytes()
         sheet = model.getCurrentSheet()
-        n = len(self.rkrecs)
-        for i in xrange(0, n):
-            rkrec = self.rkrecs[i]
-            col = self.col1 + i
-            cell = xlsmodel.NumberCell(decodeRK(rkrec.number))
-            sheet.setCell(col, self.row, cell)
+        sheet.setNumberCells(self.col1, self.row, self.numbers, self.integers)
 
 class MulBlank(BaseRecordHandler):
 
@@ -1654,6 +1676,21 @@ class RK(BaseRecordHandler):
         cell = xlsmodel.NumberCell(self.realVal)
         sheet.setCell(self.col, self.row, cell)
 
+    @staticmethod
+    def fillModelRun (model, bytes, count):
+        """Fill model with a run of count RK records, headers included, that
+follow each other in bytes.  Their values are decoded in one pass, and cells
+in consecutive columns of a row are set together."""
+        fields = struct.unpack_from("<" + "4xhhhI"*count, bytes)
+        rows, cols = fields[0::4], fields[1::4]
+        numbers, integers = decodeRKs(fields[3::4])
+        sheet = model.getCurrentSheet()
+        start = 0
+        for i in xrange(1, count + 1):
+            if i == count or rows[i] != rows[start] or cols[i] != cols[i-1] + 1:
+                sheet.setNumberCells(cols[start], rows[start], numbers[start:i], integers[start:i])
+                start = i
+
 class Scl(BaseRecordHandler):
 
     def __parseBytes (self):
@@ -1741,11 +1778,9 @@ class SST(BaseRecordHandler):
     def __parseBytes (self):
         self.refCount = self.readSignedInt(4) # total number of references in workbook
         self.strCount = self.readSignedInt(4) # total number of unique strings.
-        self.sharedStrings = []
-        for i in xrange(0, self.strCount):
-            extText, bytesRead = globals.getUnicodeRichExtText(self.bytes, self.getCurrentPos(), self.roflist)
-            self.readBytes(bytesRead) # advance current position.
-            self.sharedStrings.append(extText)
+        # the strings are decoded as they are iterated over.
+        self.sharedStrings = globals.iterUnicodeRichExtText(
+            self.bytes, self.getCurrentPos(), max(self.strCount, 0), self.roflist)
 
     def parseBytes (self):
         self.__parseBytes()
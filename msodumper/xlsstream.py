@@ -5,12 +5,15 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys
+import sys, struct, array, bisect, itertools, multiprocessing
 import ole, globals, xlsrecord
 from globals import output
 
 class EndOfStream(Exception): pass
 
+# record type and payload size
+recordHeader = struct.Struct("<HH")
+
 unusedRecDesc = "[unused, must be ignored]"
 
 # opcode: [canonical name, description, handler (optional)]
@@ -324,6 +327,39 @@ recDataRev = {
 }
 
 
+def parseRecordFilter (text):
+    """Return the set of record types listed in text, separated by commas.
+Each one is a number, decimal or hexadecimal with a 0x prefix, or a canonical
+record name of recData or recDataRev, which matches all the record types of
+that name.  Raise ValueError on anything else."""
+    types = set()
+    for item in text.split(","):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        if item.isdigit():
+            # leading zeros don't make it octal.
+            types.add(int(item, 10))
+            continue
+        if item[:2].lower() == "0x" and len(item) > 2:
+            try:
+                types.add(int(item[2:], 16))
+                continue
+            except ValueError:
+                pass
+        if item[0].isdigit() or item[0] in "+-":
+            raise ValueError("invalid record type: %s (decimal, or hexadecimal with a 0x prefix)"%item)
+        found = False
+        for data in (recData, recDataRev):
+            for header, desc in data.items():
+                if desc[0].rstrip('*') == item.upper().rstrip('*'):
+                    types.add(header)
+                    found = True
+        if not found:
+            raise ValueError("unknown record name: %s"%item)
+    return types
+
+
 class StreamData(object):
     """run-time stream data."""
     def __init__ (self):
@@ -412,7 +448,7 @@ class XLStream(object):
         obj = self.__getDirectoryObj()
         bytes = []
         if obj != None:
-            bytes = obj.getRawStream(entry)
+            bytes = obj.getStreamReader(entry)
         strm = XLDirStream(bytes, self.params, self.strmData)
         return strm
 
@@ -423,6 +459,144 @@ class DirType:
     PivotTableCache = 2
 
 
+class RecordIndex(object):
+    """Offsets, types and sizes of all the records of a BIFF stream, found in a
+single pass over it.  CONTINUE records are folded into the record they
+continue: the size is that of all the payloads together, and the continue
+count tells how many CONTINUE records there are.
+
+The stream may be a string or an ole.OleStreamReader; it's read a block at a
+time, and only the record headers are looked at."""
+
+    BlockSize = 0x10000
+
+    def __init__ (self, bytes):
+        self.bytes = bytes
+        self.offsets = array.array('I')
+        self.types = array.array('H')
+        self.sizes = array.array('I')
+        self.continues = array.array('I')
+        self.__build()
+
+    def __build (self):
+        # The index ends at a header that doesn't fit, at a zero record type
+        # (padding), or at a record whose payload would run past the end of
+        # the stream.
+        bytes = self.bytes
+        streamSize = len(bytes)
+        unpack = recordHeader.unpack
+        block = ""
+        blockPos = 0 # stream position of block
+        pos = 0
+        while streamSize - pos >= 4:
+            if pos + 4 > blockPos + len(block):
+                block = bytes[pos:pos+self.BlockSize]
+                blockPos = pos
+            header, size = unpack(block[pos-blockPos:pos-blockPos+4])
+            if header == 0x0000 or pos + 4 + size > streamSize:
+                break
+            if header == 0x003C and len(self.offsets) > 0:
+                self.sizes[-1] += size
+                self.continues[-1] += 1
+            else:
+                self.offsets.append(pos)
+                self.types.append(header)
+                self.sizes.append(size)
+                self.continues.append(0)
+            pos += 4 + size
+
+    def __len__ (self):
+        return len(self.offsets)
+
+    def getRecord (self, i):
+        """Return (offset, type, size, payload, record boundaries) of the i-th
+record; the payload includes the CONTINUE records."""
+        offset = self.offsets[i]
+        size = self.sizes[i]
+        if self.continues[i] == 0:
+            return offset, self.types[i], size, self.bytes[offset+4:offset+4+size], [size]
+
+        # the boundary list is only useful if there are CONTINUE records.
+        pieces = []
+        roflist = []
+        pos = offset
+        for j in xrange(0, self.continues[i] + 1):
+            header, pieceSize = recordHeader.unpack(self.bytes[pos:pos+4])
+            pieces.append(self.bytes[pos+4:pos+4+pieceSize])
+            roflist.append(roflist and roflist[-1] + pieceSize or pieceSize)
+            pos += 4 + pieceSize
+        return offset, self.types[i], size, "".join(pieces), roflist
+
+    def getEndOffset (self, i):
+        """Return the offset right after the i-th record and its CONTINUE
+records."""
+        # the records follow each other, so that's where the next one starts.
+        if i + 1 < len(self.offsets):
+            return self.offsets[i+1]
+        return self.offsets[i] + 4*(self.continues[i] + 1) + self.sizes[i]
+
+    def find (self, header, start=0):
+        """Return the position of the first record of the given type at or
+after start, or -1."""
+        for i in xrange(start, len(self.types)):
+            if self.types[i] == header:
+                return i
+        return -1
+
+    def countTypes (self):
+        """Return a dictionary of record type: number of records."""
+        counts = {}
+        for header in self.types:
+            counts[header] = counts.get(header, 0) + 1
+        return counts
+
+
+class RecordToken(object):
+    """Record of the record index standing in for its handler, which is only
+created when its data is asked for.  xlsparser matches tokens by their handler
+class."""
+
+    __slots__ = ('strm', 'index', 'handlerClass')
+
+    def __init__ (self, strm, index, handlerClass):
+        self.strm = strm
+        self.index = index
+        self.handlerClass = handlerClass
+
+    def getHandler (self):
+        pos, header, size, bytes, roflist = self.strm.getRecordIndex().getRecord(self.index)
+        return self.handlerClass(header, size, bytes, self.strm.strmData, roflist)
+
+    def dumpData (self):
+        return self.getHandler().dumpData()
+
+    def __str__ (self):
+        return "%s record #%d"%(self.handlerClass.__name__, self.index)
+
+
+class RecordTokens(object):
+    """Sequence of the records read from a directory stream, as RecordToken
+objects, or None for records without a handler.  The tokens are created when
+they are looked up, so only those the parser keeps stay in memory."""
+
+    def __init__ (self, strm, records, handlerClasses):
+        self.strm = strm
+        self.records = records # positions in the record index
+        self.handlerClasses = handlerClasses # record type: handler class
+
+    def __len__ (self):
+        return len(self.records)
+
+    def __getitem__ (self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        index = self.records[i]
+        handlerClass = self.handlerClasses[self.strm.getRecordIndex().types[index]]
+        if handlerClass == None:
+            return None
+        return RecordToken(self.strm, index, handlerClass)
+
+
 class XLDirStream(object):
 
     def __init__ (self, bytes, params, strmData):
@@ -434,86 +608,155 @@ class XLDirStream(object):
         self.params = params
         self.strmData = strmData
 
+        self.recordIndex = None
+        self.curRecord = 0 # position in the record index
+        self.endRecord = None # where to stop reading, all records by default
+        self.nextRecords = [] # further (start, end) ranges of records to read
+        self.boundSheets = None
+        self.sheetIndices = None # BOF position: BOUNDSHEET position
 
-    def readRaw (self, size=1):
-        # assume little endian
-        bytes = 0
-        for i in xrange(0, size):
-            b = ord(self.bytes[self.pos])
-            if i == 0:
-                bytes = b
-            else:
-                bytes += b*(256**i)
-            self.pos += 1
-
-        return bytes
-
-    def readByteArray (self, size=1):
-        if self.pos + size >= self.size:
-            raise EndOfStream
-        curpos = self.pos
-        self.pos += size
-        return self.bytes[curpos:self.pos]
 
     def __printSep (self, c, w, prefix=''):
         print(prefix + c*w)
 
-    def __readRecordBytes (self):
-        if self.size - self.pos < 4:
-            raise EndOfStream
+    def getRecordIndex (self):
+        if self.recordIndex == None:
+            self.recordIndex = RecordIndex(self.bytes)
+        return self.recordIndex
 
-        pos = self.pos
-        header = self.readRaw(2)
-        if header == 0x0000:
-            raise EndOfStream
-        size = self.readRaw(2)
-        bytes = self.readByteArray(size)
-        return pos, header, size, bytes
+    def seekRecord (self, i):
+        """Continue reading at the i-th record of the record index."""
+        self.curRecord = i
+        if i < len(self.getRecordIndex()):
+            self.pos = self.recordIndex.offsets[i]
+        else:
+            self.pos = self.size
+
+    def __getNextRecord (self):
+        """Return the position of the next record to read in the index."""
+        index = self.getRecordIndex()
+        end = self.endRecord
+        if end == None:
+            end = len(index)
+        while self.curRecord >= end:
+            if len(self.nextRecords) == 0:
+                raise EndOfStream
+            start, self.endRecord = self.nextRecords.pop(0)
+            self.seekRecord(start)
+            end = self.endRecord
+        return self.curRecord
+
+    def getBoundSheets (self):
+        """Return the BOUNDSHEET records of the globals substream, parsed with
+readSheetInfo().  The read position is not affected."""
+        if self.boundSheets != None:
+            return self.boundSheets
+
+        self.boundSheets = []
+        index = self.getRecordIndex()
+        for i in xrange(0, len(index)):
+            header = index.types[i]
+            if header == 0x000A:
+                break
+            if header == 0x0085:
+                pos, header, size, bytes, roflist = index.getRecord(i)
+                sheet = xlsrecord.BoundSheet(header, size, bytes, self.strmData, roflist)
+                sheet.readSheetInfo()
+                self.boundSheets.append(sheet)
+        return self.boundSheets
+
+    def getSheetIndex (self, pos):
+        """Return the position of the BOUNDSHEET record that points to the BOF
+record at pos, or None if there is none, as for the globals substream and the
+charts embedded in a sheet."""
+        if self.sheetIndices == None:
+            self.sheetIndices = {}
+            for i, sheet in enumerate(self.getBoundSheets()):
+                self.sheetIndices.setdefault(sheet.posBOF, i)
+        return self.sheetIndices.get(pos)
+
+    def findSheet (self, key):
+        """Return the position of the sheet named key or, failing that, at
+position key (counted from 0) among the sheets.  Return None if there's no
+such sheet."""
+        sheets = self.getBoundSheets()
+        for i, sheet in enumerate(sheets):
+            name = sheet.name
+            if isinstance(name, unicode):
+                name = name.encode('UTF-8')
+            if name == key:
+                return i
+        if key.isdigit() and int(key) < len(sheets):
+            return int(key)
+        return None
+
+    def getGlobalsRange (self):
+        """Return the (start, end) range of the globals substream in the record
+index, or None if it has no EOF record."""
+        end = self.getRecordIndex().find(0x000A)
+        if end < 0:
+            globals.error("globals substream has no EOF record\n")
+            return None
+        return (0, end + 1)
+
+    def getSheetRange (self, i):
+        """Return the (start, end) range of the i-th sheet's substream in the
+record index.  It runs up to the BOF of the next sheet in the stream, so that
+charts embedded in the sheet are part of it.  Return None if there's no BOF
+record where the BOUNDSHEET record points to."""
+        index = self.getRecordIndex()
+        sheets = self.getBoundSheets()
+        posBOF = sheets[i].posBOF
+        start = bisect.bisect_left(index.offsets, posBOF)
+        if start == len(index) or index.offsets[start] != posBOF or index.types[start] != 0x0809:
+            globals.error("no BOF record at position %d of sheet %d\n"%(posBOF, i))
+            return None
+        nextBOFs = [sheet.posBOF for sheet in sheets if sheet.posBOF > posBOF]
+        if len(nextBOFs) == 0:
+            return (start, len(index))
+        return (start, bisect.bisect_left(index.offsets, min(nextBOFs)))
+
+    def selectSheet (self, i):
+        """Read only the globals substream and the substream of the i-th
+sheet, which is jumped to directly through its BOUNDSHEET record.  Return
+False if the sheet's substream can't be found."""
+        globalsRange = self.getGlobalsRange()
+        if globalsRange == None:
+            return False
+        sheetRange = self.getSheetRange(i)
+        if sheetRange == None:
+            return False
+        self.endRecord = globalsRange[1]
+        self.nextRecords = [sheetRange]
+        return True
 
     def __readRecAndContBytes(self):
         '''Read record itself and possible CONTINUE blocks.'''
 
-        pos, header, size, bytes = self.__readRecordBytes()
-
-        # Records boundaries/offset list (only useful if there are
-        # CONTINUE records)
-        roflist = [size]
-        
-        # Read possible CONTINUE records, and concatenate the data
-        while self.peekNext() == 0x3c:
-            cpos, cheader, csize, cbytes = self.__readRecordBytes()
-            bytes += cbytes
-            size += csize
-            roflist.append(size)
-
+        index = self.getRecordIndex()
+        self.__getNextRecord()
+        pos, header, size, bytes, roflist = index.getRecord(self.curRecord)
+        self.pos = index.getEndOffset(self.curRecord)
+        self.curRecord += 1
         return pos, header, size, bytes, roflist
 
     def peekNext (self):
         '''Check type of next record without changing stream state'''
-        
-        if self.size - self.pos < 4:
-            raise EndOfStream
-
-        pos = self.pos
-        header = self.readRaw(2)
-        if header == 0x0000:
-            raise EndOfStream
-        self.pos = pos
-        return header
-        
-    def __getRecordHandler (self, header, size, bytes, roflist):
-        # record handler that parses the raw bytes and displays more
-        # meaningful information.
-        handler = None
-        if recData.has_key(header) and len(recData[header]) >= 3:
-            handler = recData[header][2](header, size, bytes, self.strmData, roflist)
 
-        if handler != None and self.strmData.encrypted:
-            # record handler exists.  Parse the record and display more info
-            # unless the stream is encrypted.
-            handler = None
+        return self.getRecordIndex().types[self.__getNextRecord()]
 
-        return handler
+    def __getHandlerClass (self, header):
+        # record handler that parses the raw bytes and displays more
+        # meaningful information, unless the stream is encrypted.
+        if self.strmData.encrypted or not recData.has_key(header) or len(recData[header]) < 3:
+            return None
+        return recData[header][2]
+
+    def __getRecordHandler (self, header, size, bytes, roflist):
+        handlerClass = self.__getHandlerClass(header)
+        if handlerClass == None:
+            return None
+        return handlerClass(header, size, bytes, self.strmData, roflist)
 
     def __postReadRecord (self, header):
         if recData.has_key(header) and recData[header][0] == "FILEPASS":
@@ -521,10 +764,40 @@ class XLDirStream(object):
             # encrypted.
             self.strmData.encrypted = True
 
+    def __skipRecordRun (self, header, size):
+        """Skip the records right after the current one that are of the same
+type and size, and have no CONTINUE records.  Return how many there were."""
+        index = self.getRecordIndex()
+        end = self.endRecord
+        if end == None:
+            end = len(index)
+        start = i = self.curRecord
+        while i < end and index.types[i] == header and index.sizes[i] == size and index.continues[i] == 0:
+            i += 1
+        if i > start:
+            self.curRecord = i
+            self.pos = index.getEndOffset(i - 1)
+        return i - start
+
     def fillModel (self, model):
         pos, header, size, bytes, roflist = self.__readRecAndContBytes()
+        if header == 0x027E and size == 10 and len(roflist) == 1 and not self.strmData.encrypted:
+            # numbers of the cells that didn't fit in a MULRK record; decode
+            # the whole run of RK records at once.
+            count = 1 + self.__skipRecordRun(header, size)
+            try:
+                xlsrecord.RK.fillModelRun(model, self.bytes[pos:self.pos], count)
+            except Exception as e:
+                if not globals.params.catchExceptions:
+                    raise
+                globals.error("XLDirStream:fillModel: %s\n" % e)
+            return
+
         handler = self.__getRecordHandler(header, size, bytes, roflist)
         if handler != None:
+            if header == 0x0809:
+                # worksheets are numbered after their BOUNDSHEET record
+                handler.sheetIndex = self.getSheetIndex(pos)
             try:
                 handler.fillModel(model)
             except Exception as e:
@@ -533,12 +806,100 @@ class XLDirStream(object):
                 globals.error("XLDirStream:fillModel: %s\n" % e)
         self.__postReadRecord(header)
 
+    def fillModelRange (self, model, start, end):
+        """Fill model with the records of the (start, end) range of the record
+index."""
+        self.endRecord = end
+        self.nextRecords = []
+        self.seekRecord(start)
+        try:
+            while True:
+                self.fillModel(model)
+        except EndOfStream:
+            pass
+
+    def fillModelParallel (self, model, jobs):
+        """Fill model with the globals substream, then with the sheets, which
+are read by jobs worker processes and appended to model in the order of their
+BOUNDSHEET records."""
+        globalsRange = self.getGlobalsRange()
+        if globalsRange == None:
+            return
+        self.fillModelRange(model, globalsRange[0], globalsRange[1])
+
+        global workerState
+        workerState = (self, model)
+        sheetIDs = xrange(0, len(self.getBoundSheets()))
+        # the sheets are attached at the end, as the model has to stay that of
+        # the globals substream for the sheets filled in this process.
+        sheets = []
+        try:
+            if jobs <= 1:
+                for sheetModels in itertools.imap(fillSheetModel, sheetIDs):
+                    sheets.extend(sheetModels)
+            else:
+                # workers inherit the model of the globals substream when
+                # forked; anything still buffered would be written once more
+                # by each of them.
+                sys.stdout.flush()
+                pool = multiprocessing.Pool(jobs)
+                try:
+                    for sheetModels in pool.imap(fillSheetModel, sheetIDs):
+                        sheets.extend(sheetModels)
+                    pool.close()
+                except:
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+        finally:
+            workerState = None
+        model.attachSheets(sheets)
+
 
     def getNextRecordHandler (self):
         pos, header, size, bytes, roflist = self.__readRecAndContBytes()
         return self.__getRecordHandler(header, size, bytes, roflist)
 
+    def getRecordTokens (self):
+        """Read the remaining records like getNextRecordHandler() does, and
+return them as RecordTokens, without creating any handler."""
+        index = self.getRecordIndex()
+        records = array.array('I')
+        try:
+            while True:
+                records.append(self.__getNextRecord())
+                self.curRecord += 1
+        except EndOfStream:
+            pass
+        if len(records) > 0:
+            self.pos = index.getEndOffset(records[-1])
+
+        handlerClasses = {}
+        for header in index.countTypes():
+            handlerClasses[header] = self.__getHandlerClass(header)
+        return RecordTokens(self, records, handlerClasses)
+
+    def __skipRecord (self):
+        """Skip the next record if there's a record filter that it's not in.
+Return its type if skipped, or None."""
+        if not globals.params.dumpedIds:
+            return None
+        index = self.getRecordIndex()
+        i = self.__getNextRecord()
+        header = index.types[i]
+        if header in globals.params.dumpedIds:
+            return None
+        self.pos = index.getEndOffset(i)
+        self.curRecord = i + 1
+        self.__postReadRecord(header)
+        return header
+
     def readRecord (self):
+        header = self.__skipRecord()
+        if header != None:
+            return header
+
         pos, header, size, bytes, roflist = self.__readRecAndContBytes()
 
         # record handler that parses the raw bytes and displays more
@@ -568,25 +929,13 @@ class XLDirStream(object):
 
         # print the raw bytes, with 16 bytes per line.
         self.__printSep('-', globals.OutputWidth-len(headerStr), headerStr)
+        dumpSize = globals.getDumpSize(size)
         lines = []
-        for i in xrange(0, size):
-            if i % 16 == 0:
-                lines.append([])
-            lines[-1].append(bytes[i])
-
-        for line in lines:
-            output("%4.4Xh: "%header)
-            n = len(line)
-            for byte in line:
-                output("%2.2X "%ord(byte))
-            for i in xrange(n, 16):
-                output("   ")
-            output('  ')
-
-            for byte in line:
-                output(globals.toCharOrDot(byte))
-
-            print("")
+        for pos, hex, text in globals.formatHexLines(bytes[0:dumpSize]):
+            lines.append(headerStr + hex.ljust(48) + '  ' + text + "\n")
+        if dumpSize < size:
+            lines.append(headerStr + globals.getOmittedBytesText(size, dumpSize) + "\n")
+        output("".join(lines))
 
         if handler != None and not self.strmData.encrypted:
             # record handler exists.  Parse the record and display more info
@@ -596,4 +945,20 @@ class XLDirStream(object):
         self.__postReadRecord(header)
         return header
 
+
+# stream and model of XLDirStream.fillModelParallel(), inherited by the worker
+# processes.
+workerState = None
+
+def fillSheetModel (i):
+    """Fill the i-th sheet into the model of the globals substream and return
+the sheets appended to it, leaving the model as it was."""
+    strm, model = workerState
+    count = model.getSheetCount()
+    sheetRange = strm.getSheetRange(i)
+    if sheetRange == None:
+        return []
+    strm.fillModelRange(model, sheetRange[0], sheetRange[1])
+    return model.detachSheets(count)
+
 # vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
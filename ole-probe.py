@@ -0,0 +1,47 @@
+#!/usr/bin/env python2
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys, optparse
+
+from msodumper import globals, oleprobe
+
+def main ():
+    parser = optparse.OptionParser(usage="%prog [options] file...",
+        description="Print one tab-separated line per file: path, 'cfb' or 'none', sector size, application and encryption status.")
+    parser.add_option("--streams", action="store_true", dest="streams", default=False,
+        help="Append the names of all directory entries.")
+    parser.add_option("--catch", action="store_true", dest="catch_exceptions", default=False,
+        help="Catch exceptions and try to continue.")
+    options, args = parser.parse_args()
+    params = globals.params
+    params.catchExceptions = options.catch_exceptions
+
+    if len(args) < 1:
+        globals.error("takes at least one argument\n")
+        parser.print_help()
+        sys.exit(1)
+
+    for filePath in args:
+        result = oleprobe.probe(filePath, params)
+        fields = [filePath]
+        if not result.isCompoundDocument:
+            fields.append("none")
+        else:
+            fields.append("cfb")
+            fields.append(str(result.sectorSize))
+            fields.append(result.app)
+            fields.append(result.encrypted and "encrypted" or "plain")
+            if options.streams:
+                fields.append(",".join([globals.encodeName(name) for name in result.streamNames]))
+        if result.error != None:
+            fields.append("error: %s"%result.error)
+        print("\t".join(fields))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
@@ -19,6 +19,9 @@ Options:
   --dump-text   extract and print the textual content
   --no-raw-dumps suppress raw hex dumps of uninterpreted areas
   --id-select=id1[,id2 ...] limit output to selected record Ids
+  --max-dump-bytes=size hex dump at most size bytes of each record or stream
+  --output=file write the dump to file instead of standard output; it's
+                gzip compressed if file ends with '.gz'
 """ % exname
     print msg
 
@@ -37,9 +40,7 @@ class PPTDumper(object):
         globals.outputln("-"*68)
 
     def dump (self):
-        file = open(self.filepath, 'rb')
-        strm = pptstream.PPTFile(file.read(), self.params)
-        file.close()
+        strm = pptstream.PPTFile(ole.mapFile(self.filepath), self.params)
         strm.printStreamInfo()
         strm.printHeader()
         strm.printDirectory()
@@ -83,11 +84,13 @@ def main (args):
         usage(exname)
         return
 
+    outputPath = None
     try:
         opts, args = getopt.getopt(args, "h",
                                    ["help", "debug", "show-sector-chain",
                                     "no-struct-output", "dump-text",
-                                    "id-select=", "no-raw-dumps"])
+                                    "id-select=", "no-raw-dumps",
+                                    "max-dump-bytes=", "output="])
         for opt, arg in opts:
             if opt in ['-h', '--help']:
                 usage(exname)
@@ -101,7 +104,11 @@ def main (args):
             elif opt in ['--dump-text']:
                 globals.params.dumpText = True
             elif opt in ['--no-raw-dumps']:
-                globals.params.noRawDumps = True
+                globals.params.noRawDump = True
+            elif opt in ['--output']:
+                outputPath = arg
+            elif opt in ['--max-dump-bytes']:
+                globals.params.maxDumpBytes = int(arg)
             elif opt in ['--id-select']:
                 globals.params.dumpedIds = arg.split(",")
                 globals.params.dumpedIds = \
@@ -115,11 +122,17 @@ def main (args):
         usage(exname)
         return
 
-    dumper = PPTDumper(args[0], globals.params)
-    if not dumper.dump():
-        error("FAILURE\n")
-    if globals.params.dumpText:
-        print(globals.textdump.replace("\r", "\n"))
+    if globals.params.noStructOutput and not globals.params.dumpText:
+        # the records skip formatting with noStructOutput; discard the rest
+        sink = globals.NullSink()
+    else:
+        sink = globals.createOutputSink(outputPath)
+    with globals.outputTo(sink):
+        dumper = PPTDumper(args[0], globals.params)
+        if not dumper.dump():
+            error("FAILURE\n")
+        if globals.params.dumpText:
+            print(globals.textdump.replace("\r", "\n"))
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python2
+# -*- tab-width: 4; indent-tabs-mode: nil -*-
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys
+sys.path.append(sys.path[0]+"/../..")
+sys.path.append(sys.path[0]+"/../../misc")
+from msodumper import globals, ole, oleprobe
+import docbuilder
+import unittest
+import os
+import struct
+import tempfile
+import shutil
+import StringIO
+
+class Test(unittest.TestCase):
+
+    def setUp (self):
+        self.paths = []
+
+    def tearDown (self):
+        for path in self.paths:
+            os.unlink(path)
+
+    def writeFile (self, chars):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, chars)
+        os.close(fd)
+        self.paths.append(path)
+        return path
+
+    def probe (self, chars):
+        return oleprobe.probe(self.writeFile(chars), globals.params)
+
+    def test_probe (self):
+        # FibBase with fEncrypted set or not
+        for flags, encrypted in ((0x0000, False), (0x0100, True)):
+            fib = struct.pack("<HHHHHH", 0xA5EC, 0x00C1, 0, 0, 0, flags)
+            result = self.probe(docbuilder.buildCompoundFile(fib + "\x00"*4096, name=u"WordDocument"))
+            self.assertEqual((True, 512, oleprobe.AppType.Word, encrypted, None),
+                             (result.isCompoundDocument, result.sectorSize, result.app, result.encrypted, result.error))
+            self.assertEqual([u"Root Entry", u"WordDocument"], result.streamNames)
+
+        # globals substream with or without FILEPASS right after its BOF
+        bof = docbuilder.bof(0x0005)
+        filePass = docbuilder.record(0x002F, "\x00"*6)
+        for records, encrypted in ((bof + docbuilder.eof(), False), (bof + filePass + docbuilder.eof(), True)):
+            result = self.probe(docbuilder.buildCompoundFile(records + "\x00"*4096, secShift=12))
+            self.assertEqual((True, 4096, oleprobe.AppType.Excel, encrypted, None),
+                             (result.isCompoundDocument, result.sectorSize, result.app, result.encrypted, result.error))
+
+        result = self.probe("just some text\n")
+        self.assertEqual((False, oleprobe.AppType.Unknown, None), (result.isCompoundDocument, result.app, result.error))
+
+    def test_probe_errors (self):
+        chars = docbuilder.buildCompoundFile("\x00"*4096)
+        for size, error in ((100, "truncated header: the file has only 100 bytes"),
+                            (512, "SAT sector 0 is past the end of the file"),
+                            (1000, "directory sector 1 is past the end of the file")):
+            result = self.probe(chars[:size])
+            self.assertTrue(result.isCompoundDocument)
+            self.assertEqual(error, result.error)
+
+        # a file that can't be read is reported, and doesn't stop the caller.
+        path = self.writeFile("")
+        os.unlink(path)
+        self.paths.remove(path)
+        result = oleprobe.probe(path, globals.params)
+        self.assertFalse(result.isCompoundDocument)
+        self.assertTrue(result.error.startswith("[Errno 2]"))
+
+    def parse (self, chars):
+        header = ole.Header(chars, globals.params)
+        header.parse()
+        return header
+
+    def catchErrors (self, func, *args):
+        saved = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            result = func(*args)
+            return result, sys.stderr.getvalue()
+        finally:
+            sys.stderr = saved
+
+    def test_sector_chain_cycle (self):
+        # the stream is stored in sectors 2 to 17; make it loop back.
+        chars = docbuilder.buildCompoundFile("\x00"*8192)
+        for last, next in ((9, 5), (2, 2)):
+            pos = 512 + 4*last
+            looped = chars[:pos] + struct.pack("<l", next) + chars[pos+4:]
+            sat = self.parse(looped).getSAT()
+            chain, errors = self.catchErrors(sat.getSectorIDChain, 2)
+            self.assertEqual(range(2, last + 1), list(chain))
+            self.assertEqual("Error: SAT: sector chain starting at 2 loops back to sector %d\n"%next, errors)
+
+            # the resolved chain is cached, callers get their own copy.
+            chain.append(100)
+            self.assertEqual(range(2, last + 1), list(sat.getSectorIDChain(2)))
+
+    def test_stream_reader (self):
+        data = "".join(chr(i % 251) for i in xrange(8000))
+        for fragmented in (False, True):
+            directory = self.parse(docbuilder.buildCompoundFile(data, fragmented=fragmented)).getDirectory()
+            entry = directory.getEntryByName("Workbook")
+            expected = directory.getRawStream(entry)
+            self.assertEqual(data, expected[:len(data)])
+
+            reader = directory.getStreamReader(entry)
+            self.assertEqual(len(expected), len(reader))
+            for start, stop in ((0, 1), (511, 513), (500, 1600), (1023, 1024),
+                                (1024, 2048), (100, 8000), (7900, 9000), (-10, -1)):
+                self.assertEqual(expected[start:stop], reader[start:stop])
+            self.assertEqual(expected[1535], reader[1535])
+            reader.seek(1000)
+            self.assertEqual(expected[1000:3000], reader.read(2000))
+            self.assertEqual(expected[3000:], reader.read())
+
+    def test_extract_all (self):
+        data = "".join(chr(i % 251) for i in xrange(5000))
+        path = self.writeFile(docbuilder.buildCompoundFile(data))
+        outputDir = tempfile.mkdtemp()
+        try:
+            container = ole.OleContainer(path, globals.params)
+            self.assertEqual(["Workbook"], container.extractAll(outputDir))
+            self.assertEqual(data, open(os.path.join(outputDir, "Workbook"), "rb").read())
+
+            # streams that can't be written aren't returned.
+            blocked = os.path.join(outputDir, "blocked")
+            open(blocked, "wb").close()
+            names, errors = self.catchErrors(container.extractAll, os.path.join(blocked, "dir"))
+            self.assertEqual([], names)
+            self.assertTrue(errors.startswith("Error: Workbook: "))
+        finally:
+            shutil.rmtree(outputDir)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set filetype=python shiftwidth=4 softtabstop=4 expandtab:
@@ -8,15 +8,480 @@
 
 import sys
 sys.path.append(sys.path[0]+"/../..")
+sys.path.append(sys.path[0]+"/../../misc")
 xls_dumper = __import__('xls-dump')
+from msodumper import xlsstream, xlsrecord, xlsmodel, xlsparser, globals, formula, ole, node
+import docbuilder
 import unittest
 import os
+import struct
+import tempfile
+import StringIO
+import gzip
 
 class Test(unittest.TestCase):
 
     def test_foo (self):
         self.assertEqual(1+1, 2)
 
+    def record (self, header, data):
+        return struct.pack("<HH", header, len(data)) + data
+
+    def test_record_index (self):
+        bytes = self.record(0x0809, "\x00"*16) + \
+            self.record(0x00FC, "abc") + self.record(0x003C, "defg") + self.record(0x003C, "h") + \
+            self.record(0x00FD, "\x01"*10) + self.record(0x000A, "") + \
+            "\x00"*8
+        index = xlsstream.RecordIndex(bytes)
+        # the padding after the EOF record ends the stream.
+        self.assertEqual(4, len(index))
+        self.assertEqual([0x0809, 0x00FC, 0x00FD, 0x000A], list(index.types))
+        self.assertEqual([0, 2, 0, 0], list(index.continues))
+        pos, header, size, data, roflist = index.getRecord(1)
+        self.assertEqual((20, 0x00FC, 8, "abcdefgh"), (pos, header, size, data))
+        self.assertEqual([3, 7, 8], roflist)
+        self.assertEqual([20, 40, 54, 58], [index.getEndOffset(i) for i in xrange(0, 4)])
+        self.assertEqual(2, index.find(0x00FD))
+        self.assertEqual(-1, index.find(0x00FD, 3))
+        self.assertEqual({0x0809: 1, 0x00FC: 1, 0x00FD: 1, 0x000A: 1}, index.countTypes())
+
+        # the last record is kept when it ends the stream, but not when its
+        # payload is cut short.
+        self.assertEqual(4, len(xlsstream.RecordIndex(bytes[:58])))
+        self.assertEqual(3, len(xlsstream.RecordIndex(bytes[:57] + "\x01")))
+
+        # the same stream read through an OLE stream reader, with its sectors
+        # in reverse order, a few bytes at a time.
+        class SmallBlockIndex(xlsstream.RecordIndex):
+            BlockSize = 5
+        padded = bytes + "\x00"*(-len(bytes) % 16)
+        sectors = [padded[i:i+16] for i in xrange(0, len(padded), 16)]
+        reader = ole.OleStreamReader("".join(reversed(sectors)), range(len(sectors)-1, -1, -1), 16, 0)
+        readerIndex = SmallBlockIndex(reader)
+        for name in ('offsets', 'types', 'sizes', 'continues'):
+            self.assertEqual(getattr(index, name), getattr(readerIndex, name))
+        self.assertEqual(index.getRecord(1), readerIndex.getRecord(1))
+
+        # more CONTINUE records than fit in 16 bits
+        bytes = self.record(0x00EB, "a") + self.record(0x003C, "b")*70000 + self.record(0x000A, "") + "\x00"*4
+        index = xlsstream.RecordIndex(bytes)
+        self.assertEqual([70000, 0], list(index.continues))
+        self.assertEqual(70001, index.sizes[0])
+        self.assertEqual(5*70001, index.getEndOffset(0))
+
+    def workbookStream (self, names, charts=()):
+        """Return a Workbook stream with an empty sheet for each name, and the
+bytes of such a sheet.  The sheets at the positions in charts hold an
+embedded chart substream."""
+        bof = self.record(0x0809, struct.pack("<HH", 0x0600, 0x0010) + "\x00"*12)
+        eof = self.record(0x000A, "")
+        sheet = bof + self.record(0x0200, "\x00"*14) + eof
+        chart = self.record(0x0809, struct.pack("<HH", 0x0600, 0x0020) + "\x00"*12) + eof
+        sheets = [i in charts and sheet[:-len(eof)] + chart + eof or sheet for i in xrange(0, len(names))]
+        # globals substream: BOF, a BOUNDSHEET record of 12 bytes plus the
+        # name for each sheet, EOF
+        pos = len(bof) + sum([12 + len(name) for name in names]) + len(eof)
+        boundSheets = ""
+        for i, name in enumerate(names):
+            boundSheets += self.record(0x0085, struct.pack("<LHBB", pos, 0, len(name), 0) + name)
+            pos += len(sheets[i])
+        bof = self.record(0x0809, struct.pack("<HH", 0x0600, 0x0005) + "\x00"*12)
+        bytes = bof + boundSheets + eof + "".join(sheets) + "\x00"*4
+        return bytes, sheet
+
+    def test_shared_strings (self):
+        # "abcdef" split by a CONTINUE record after "abc", which switches to
+        # UTF-16LE, then a rich string with 1 run and a phonetic block of 2
+        # bytes.
+        bytes = struct.pack("<HB", 6, 0) + "abc"
+        roflist = [len(bytes)]
+        bytes += "\x01" + "def".encode('UTF-16LE')
+        bytes += struct.pack("<HBHI", 2, 0x0C, 1, 2) + "gh" + "\x00"*4 + "\x11\x22"
+        roflist.append(len(bytes))
+        strings = list(globals.iterUnicodeRichExtText(bytes, 0, 2, roflist))
+        self.assertEqual([u"abcdef", u"gh"], [s.baseText for s in strings])
+        self.assertEqual("\x11\x22", strings[1].phoneticBytes)
+        self.assertRaises(globals.ByteStreamError, list,
+                          globals.iterUnicodeRichExtText(bytes[:-1], 0, 2, [roflist[0], len(bytes)-1]))
+
+    def test_sst_lines (self):
+        # the strings decoded before a broken one are kept.
+        bytes = struct.pack("<ll", 3, 3) + struct.pack("<HB", 2, 0) + "ab" + \
+            struct.pack("<HB", 2, 0) + "cd" + struct.pack("<HB", 5, 0) + "e"
+        handler = xlsrecord.SST(0x00FC, len(bytes), bytes, xlsstream.StreamData(), [])
+        saved = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.assertRaises(globals.ByteStreamError, handler.parseBytes)
+        finally:
+            sys.stderr = saved
+        self.assertEqual(["total number of references: 3", "total number of unique strings: 3",
+                          "s0: ab", "s1: cd"], handler.lines)
+
+    def test_shared_string_store (self):
+        wbg = xlsmodel.WorkbookGlobal()
+        count = xlsmodel.WorkbookGlobal.SharedTextBlockSize*2 + 10
+        for i in xrange(0, count):
+            sst = globals.UnicodeRichExtText()
+            sst.baseText = u"s%d"%i
+            if i == 1500:
+                sst.phoneticBytes = "\x01\x02"
+            wbg.appendSharedString(sst)
+        for i in (0, 1, 1023, 1024, 1500, count-1):
+            self.assertEqual(u"s%d"%i, wbg.getSharedText(i))
+        self.assertEqual("\x01\x02", wbg.getSharedString(1500).phoneticBytes)
+        self.assertEqual([], wbg.getSharedString(1501).phoneticBytes)
+        self.assertEqual(None, wbg.getSharedString(count))
+
+    def test_cell_store (self):
+        sheet = xlsmodel.Worksheet(1)
+        label = xlsmodel.LabelCell()
+        label.strID = 7
+        sheet.setCell(3, 0, label)
+        sheet.setCell(1, 0, xlsmodel.NumberCell(2.5))
+        sheet.setCell(3, 0, xlsmodel.NumberCell(4))
+        formula = xlsmodel.FormulaCell()
+        sheet.setCell(0, 1, formula)
+        self.assertTrue(sheet.getLastCell() is formula)
+        self.assertEqual(2.5, sheet.getCell(1, 0).value)
+        # the label was overwritten, and integers stay integers.
+        cell = sheet.getCell(3, 0)
+        self.assertEqual((xlsmodel.CellBase.Type.Number, 4, int), (cell.modelType, cell.value, type(cell.value)))
+        self.assertTrue(sheet.getCell(0, 1) is formula)
+        self.assertEqual(None, sheet.getCell(2, 0))
+
+        # overwritten cell objects give their slot to the new cell.
+        cells = xlsmodel.RowCells()
+        objects = xlsmodel.CellObjects()
+        for i in xrange(0, 5):
+            cells.setCell(2, xlsmodel.FormulaCell(), objects)
+        cells.setCell(4, xlsmodel.FormulaCell(), objects)
+        last = xlsmodel.FormulaCell()
+        cells.setCell(2, last, objects)
+        self.assertEqual(2, len(objects))
+        self.assertTrue(cells.getCell(0, objects) is last)
+        # and slots released by plain values are used again.
+        for i in xrange(0, 5):
+            cells.setCell(2, xlsmodel.NumberCell(1.5), objects)
+            self.assertEqual(None, objects[0])
+            cells.setCell(2, last, objects)
+        cells.setCell(3, xlsmodel.NumberCell(2), objects)
+        self.assertEqual(2, len(objects))
+        self.assertEqual([2, 4, 3], list(cells.cols))
+        self.assertTrue(cells.getCell(0, objects) is last)
+
+    def test_byte_stream (self):
+        strm = globals.ByteStream("\x01\x00\x02\x00\x03\x00\x04\x00\x00\x00")
+        self.assertEqual(1, strm.readuInt16())
+        self.assertEqual((2, 3), strm.readuInt16Array(2))
+        self.assertEqual(4, strm.readuInt32())
+        # a short buffer raises ByteStreamError and leaves the position alone
+        saved = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            for read in (strm.readuInt8, strm.readDouble, lambda: strm.readuInt32Array(1)):
+                self.assertRaises(globals.ByteStreamError, read)
+                self.assertEqual(10, strm.getCurrentPos())
+        finally:
+            sys.stderr = saved
+
+    def test_rk_numbers (self):
+        # integer, integer / 100, float, float / 100
+        rkvals = [(7 << 2) | 0x2, (250 << 2) | 0x3, 0x3FF80000, 0x405EC000 | 0x1]
+        numbers, integers = xlsrecord.decodeRKs(rkvals)
+        self.assertEqual([xlsrecord.decodeRK(rkval) for rkval in rkvals], list(numbers))
+        self.assertEqual([True, False, False, False], integers)
+
+        # a MULRK record for B1:C1, then RK records for C1 (overwritten), D1
+        # and A2.
+        sheet = self.record(0x00BD, struct.pack("<HHHLHLH", 0, 1, 15, rkvals[0], 15, rkvals[2], 2))
+        for row, col, rkval in ((0, 2, rkvals[1]), (0, 3, rkvals[3]), (1, 0, rkvals[0])):
+            sheet += self.record(0x027E, struct.pack("<HHHL", row, col, 15, rkval))
+        strm = xlsstream.XLDirStream(sheet + self.record(0x000A, ""), globals.params, xlsstream.StreamData())
+        model = xlsmodel.Workbook()
+        model.appendSheet(0x0010)
+        try:
+            while True:
+                strm.fillModel(model)
+        except xlsstream.EndOfStream:
+            pass
+        cells = model.getCurrentSheet()
+        self.assertEqual([(7, int), (2.5, float), (1.23, float), (7, int)],
+                         [(cell.value, type(cell.value)) for cell in
+                          [cells.getCell(1, 0), cells.getCell(2, 0), cells.getCell(3, 0), cells.getCell(0, 1)]])
+
+    def test_formula_cache (self):
+        cache = formula.formulaCache
+        cache.clear()
+        # =A1+1, parsed thrice as a cell formula and once as a shared one
+        bytes = struct.pack("<BHH", 0x24, 0, 0xC000) + "\x1e\x01\x00\x03"
+        texts = []
+        for parseType in (formula.ParsedFormulaType.Cell,)*3 + (formula.ParsedFormulaType.Shared,):
+            parser = formula.FormulaParser(None, bytes)
+            parser.parse(parseType)
+            texts.append(parser.getText())
+            self.assertEqual(3, len(parser.getTokens()))
+        self.assertEqual(["(ref: row=0,col=0,rowRelative=1,colRelative=1)(int: 1)(add)"]*4, texts)
+        # the formula is cached the second time it's parsed.
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+        self.assertTrue(cache.getStatsText().startswith("formula cache: 4 lookups, 1 hits"))
+        cache.clear()
+
+    def test_formula_tokens (self):
+        # =IF(CHOOSE(1,A1,"x"&"y"),SIN(B2)-TRUE), using the reference, value
+        # and array variants of the classified tokens.
+        bytes = "\x1e\x01\x00" + struct.pack("<BBHHHH", 0x19, 0x04, 2, 4, 9, 14) + \
+            struct.pack("<BHH", 0x44, 0, 0xC000) + "\x19\x08\x00\x00" + \
+            "\x17\x01\x00x\x17\x01\x00y\x08" + "\x19\x08\x00\x00" + struct.pack("<BBH", 0x62, 3, 100) + \
+            struct.pack("<BHH", 0x64, 1, 0xC001) + struct.pack("<BH", 0x41, 15) + "\x1d\x01\x04" + \
+            struct.pack("<BBH", 0x22, 2, 1) + struct.pack("<BHhhhh", 0x7B, 2, 0, 9, 0, 3)
+        parser = formula.FormulaParser(None, bytes)
+        parser.parse()
+        self.assertEqual("(int: 1)(att: choose)(ref: row=0,col=0,rowRelative=1,colRelative=1)(att: goto)"
+                         "(str: 'x')(str: 'y')(concat)(att: goto)(func: CHOOSE; arg: 3)"
+                         "(ref: row=1,col=1,rowRelative=1,colRelative=1)(func: SIN)(bool: TRUE)(sub)"
+                         "(func: IF; arg: 2)(xti=2,$A$1:$D$10)", parser.getText())
+        tokens = parser.getTokens()
+        self.assertEqual(formula.TokenType.Area3d, tokens[-1].tokenType)
+        self.assertEqual("$A$1:$D$10", tokens[-1].cellRange.getName())
+
+        parser = formula.FormulaParser(None, "\x1e\x01\x00\x80")
+        self.assertRaises(formula.FormulaParserError, parser.parse)
+
+    def test_select_sheet (self):
+        bytes, sheet = self.workbookStream(["First", "Last!"])
+        strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+        self.assertEqual(["First", "Last!"], [s.name for s in strm.getBoundSheets()])
+        self.assertEqual(1, strm.findSheet("Last!"))
+        self.assertEqual(0, strm.findSheet("0"))
+        self.assertEqual(None, strm.findSheet("2"))
+        self.assertTrue(strm.selectSheet(1))
+        headers = []
+        try:
+            while True:
+                headers.append((strm.peekNext(), strm.pos))
+                strm.getNextRecordHandler()
+        except xlsstream.EndOfStream:
+            pass
+        # globals substream, then the second sheet
+        self.assertEqual([(0x0809, 0), (0x0085, 20), (0x0085, 37), (0x000A, 54),
+                          (0x0809, 58 + len(sheet)), (0x0200, 78 + len(sheet)),
+                          (0x000A, 96 + len(sheet))], headers)
+
+    def test_record_tokens (self):
+        bytes, sheet = self.workbookStream(["Only"])
+        strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+        tokens = strm.getRecordTokens()
+        self.assertEqual(6, len(tokens))
+        self.assertEqual([xlsrecord.BOF, xlsrecord.BoundSheet, xlsrecord.EOF, xlsrecord.BOF,
+                          xlsrecord.Dimensions, xlsrecord.EOF],
+                         [token.handlerClass for token in tokens])
+        handler = tokens[4].getHandler()
+        self.assertTrue(isinstance(handler, xlsrecord.Dimensions))
+        self.assertEqual(14, handler.size)
+
+    def test_record_filter (self):
+        self.assertEqual(set([0x00FC, 0x000A, 0x0085]),
+                         xlsstream.parseRecordFilter("0x00FC, 10,boundsheet"))
+        self.assertRaises(ValueError, xlsstream.parseRecordFilter, "SST,NOSUCHRECORD")
+        # decimal even with leading zeros, hexadecimal only with 0x.
+        self.assertEqual(set([10, 0x10]), xlsstream.parseRecordFilter("010,0X10"))
+        for text in ("0o12", "0b1", "0xZZ", "0x", "1e3", "-1", "10L"):
+            self.assertRaises(ValueError, xlsstream.parseRecordFilter, text)
+
+    def test_fill_model_parallel (self):
+        bytes, sheet = self.workbookStream(["One", "Two", "Six"])
+        for jobs in (1, 2):
+            strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+            model = xlsmodel.Workbook()
+            strm.fillModelParallel(model, jobs)
+            sheets = model.detachSheets(1)
+            self.assertEqual([1, 2, 3], [s.getSheetID() for s in sheets])
+            self.assertEqual(["One", "Two", "Six"],
+                             [model.getWorkbookGlobal().getSheetData(s.getSheetID()-1).name for s in sheets])
+
+    def test_parser_lookahead (self):
+        classes = [xlsrecord.Frame, xlsrecord.Begin, xlsrecord.LineFormat, xlsrecord.AreaFormat, xlsrecord.End]
+        tokens = [xlsstream.RecordToken(None, i, cls) for i, cls in enumerate(classes)]
+        frame = xlsparser.FRAME()
+        self.assertEqual(((xlsrecord.Frame,), xlsparser.Fail), frame.getFirst())
+        self.assertFalse(frame.mayMatch(xlsrecord.Begin))
+        for memoize in (False, True):
+            stream = xlsparser.TokenStream(tokens, memoize)
+            self.assertEqual(None, xlsparser.getParsedOrNone(frame, xlsparser.TokenStream(tokens[1:], memoize)))
+            parsed = xlsparser.safeParse(frame, stream)
+            self.assertEqual('frame', parsed[0])
+            self.assertEqual(tokens, parsed[1])
+            self.assertEqual(5, stream.currentIndex)
+
+            # a failure is remembered like a match
+            stream = xlsparser.TokenStream(tokens[:-1], memoize)
+            for i in (0, 1):
+                self.assertRaises(xlsparser.ParseException, xlsparser.safeParse, frame, stream)
+                self.assertEqual(0, stream.currentIndex)
+
+            # parsers that are gone don't leave results for new ones
+            stream = xlsparser.TokenStream(tokens, memoize)
+            for cls in reversed(classes):
+                term = xlsparser.Term(cls)
+                expected = None
+                if cls is xlsrecord.Frame:
+                    expected = tokens[0]
+                self.assertTrue(xlsparser.safeParse(term, stream) is expected)
+                stream.currentIndex = 0
+                del term
+
+        # skipping an unknown substream stops at the end of the stream
+        parser = xlsparser.Many('any-list', xlsparser.AnyButThis(xlsparser.OneOf(xlsparser.EOF(), xlsparser.BOF())))
+        stream = xlsparser.TokenStream(tokens[:2] + [None])
+        self.assertEqual(3, len(parser.parse(stream)[1]))
+
+    def test_embedded_chart (self):
+        # sheet IDs follow the BOUNDSHEET records, not counting the chart
+        # substream embedded in the first sheet.
+        bytes, sheet = self.workbookStream(["One", "Two"], charts=[0])
+        for jobs in (None, 1):
+            strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+            model = xlsmodel.Workbook()
+            if jobs == None:
+                try:
+                    while True:
+                        strm.fillModel(model)
+                except xlsstream.EndOfStream:
+                    pass
+            else:
+                strm.fillModelParallel(model, jobs)
+            sheets = model.detachSheets(1)
+            self.assertEqual([xlsmodel.Worksheet, xlsmodel.Chart, xlsmodel.Worksheet], map(type, sheets))
+            self.assertEqual([1, 2], [s.getSheetID() for s in sheets if isinstance(s, xlsmodel.Worksheet)])
+            model.attachSheets(sheets)
+            nodes = model.createDOM().getChildByName('worksheet')
+            self.assertEqual(["One", "Two"], [nd.getAttr('name') for nd in nodes])
+
+    def appendXML (self, data, root):
+        # how the xml dump mode used to build its output
+        if isinstance(data, tuple):
+            newRoot = root.appendElement(data[0])
+            if isinstance(data[1], dict):
+                for key, val in data[1].iteritems():
+                    newRoot.setAttr(key, val)
+                if len(data) > 2:
+                    self.appendXML(data[2], newRoot)
+            else:
+                self.appendXML(data[1], newRoot)
+        elif not isinstance(data, dict) and hasattr(data, '__iter__'):
+            for x in data:
+                self.appendXML(x, root)
+
+    def test_xml_dump (self):
+        # the xml dump is printed as the records are dumped; it's the same as
+        # when printed from the tree of all the dumped records.
+        bytes = docbuilder.buildWorkbook(10, 4, numCols=3, numSheets=2)
+        bytes += "\x00"*4096
+        fd, path = tempfile.mkstemp(suffix=".xls")
+        try:
+            os.write(fd, docbuilder.buildCompoundFile(bytes))
+            os.close(fd)
+            texts = []
+            for memoize in (False, True):
+                sink = globals.MemorySink()
+                with globals.outputTo(sink):
+                    xls_dumper.XLDumper(path, globals.params, memoize=memoize).dumpXML()
+                texts.append(sink.getvalue())
+            text = texts[0]
+            self.assertEqual(text, texts[1])
+        finally:
+            os.unlink(path)
+
+        strm = xlsstream.XLDirStream(bytes, globals.params, xlsstream.StreamData())
+        docroot = node.Root()
+        self.appendXML(xlsparser.XlsParser(strm.getRecordTokens()).dumpData(), docroot.appendElement('xls-dump'))
+        expected = StringIO.StringIO()
+        node.prettyPrint(expected, docroot)
+        self.assertEqual(expected.getvalue(), text)
+        self.assertEqual(3, text.count("<any-list>"))
+        self.assertEqual(2, text.count("<dimensions "))
+
+    def test_missing_sheet (self):
+        # every dump mode tells whether the sheet given with --sheet exists.
+        bytes = docbuilder.buildWorkbook(10, 4, numCols=3, numSheets=2) + "\x00"*4096
+        fd, path = tempfile.mkstemp(suffix=".xls")
+        try:
+            os.write(fd, docbuilder.buildCompoundFile(bytes))
+            os.close(fd)
+            saved = sys.stderr
+            sys.stderr = StringIO.StringIO()
+            try:
+                for sheet, success in (("Sheet2", True), ("2", False), ("NoSheet", False)):
+                    dumper = xls_dumper.XLDumper(path, globals.params, sheet)
+                    for dump in (dumper.dump, dumper.dumpXML, dumper.dumpCanonicalXML):
+                        with globals.outputTo(globals.NullSink()):
+                            self.assertEqual(success, dump())
+            finally:
+                sys.stderr = saved
+        finally:
+            os.unlink(path)
+
+    def test_output_sinks (self):
+        # every sink gets the same output as a plain sys.stdout, and
+        # sys.stdout is put back once the dump is done or has failed.
+        bytes = docbuilder.buildWorkbook(10, 4, numCols=3) + "\x00"*4096
+        tempDir = tempfile.mkdtemp()
+        xlsPath = os.path.join(tempDir, "test.xls")
+        outPath = os.path.join(tempDir, "out.txt")
+        gzipPath = os.path.join(tempDir, "out.txt.gz")
+        try:
+            file = open(xlsPath, "wb")
+            file.write(docbuilder.buildCompoundFile(bytes))
+            file.close()
+            dumper = xls_dumper.XLDumper(xlsPath, globals.params)
+            saved = sys.stdout
+            sys.stdout = StringIO.StringIO()
+            try:
+                dumper.dump()
+                expected = sys.stdout.getvalue()
+            finally:
+                sys.stdout = saved
+            self.assertTrue("EOF" in expected)
+
+            sink = globals.MemorySink()
+            with globals.outputTo(sink):
+                dumper.dump()
+            self.assertTrue(sys.stdout is saved)
+            self.assertEqual(expected, sink.getvalue())
+
+            with globals.outputTo(globals.GzipSink(gzipPath, bufferSize=100)):
+                dumper.dump()
+            self.assertEqual(expected, gzip.open(gzipPath, "rb").read())
+
+            with globals.outputTo(globals.FileSink(open(outPath, "wb"), closeFile=True)):
+                dumper.dump()
+            self.assertEqual(expected, open(outPath, "rb").read())
+
+            with globals.outputTo(globals.createOutputSink(outPath)):
+                dumper.dump()
+            self.assertEqual(expected, open(outPath, "rb").read())
+
+            sink = globals.NullSink()
+            with globals.outputTo(sink):
+                dumper.dump()
+            self.assertTrue(sys.stdout is saved)
+            self.assertTrue(sink.stream is sink)
+
+            sink = globals.MemorySink()
+            try:
+                with globals.outputTo(sink):
+                    print "partial"
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertTrue(sys.stdout is saved)
+            self.assertEqual("partial\n", sink.getvalue())
+        finally:
+            for name in os.listdir(tempDir):
+                os.unlink(os.path.join(tempDir, name))
+            os.rmdir(tempDir)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -445,14 +445,11 @@ class VBAContainer:
         self.vbaRoot = None
 
     def __findNodeByHierarchicalName( self, node, name ):
-        if ( node.getHierarchicalName() == name ):
-            return node
-        else:
-            for child in node.getChildren():
-                result = self.__findNodeByHierarchicalName( child, name )
-                if result != None:
-                    return result
-        return None
+        # hierarchical names are unique within the container, so use its
+        # index rather than walking the tree below node.
+        if not name.startswith( node.getHierarchicalName() ):
+            return None
+        return node.OleContainer.getNodeByHierarchicalName( name )
 
     def __findNodeContainingLeafName( self, parentNode, name ):
         for child in parentNode.getChildren():
@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-from msodumper import globals, vsdstream
+from msodumper import globals, vsdstream, ole
 import sys
 sys = reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -17,9 +17,7 @@ class VSDDumper:
         self.params = params
 
     def dump(self):
-        file = open(self.filepath, 'rb')
-        strm = vsdstream.createVSDFile(file.read(), self.params)
-        file.close()
+        strm = vsdstream.createVSDFile(ole.mapFile(self.filepath), self.params)
         dirnames = strm.getDirectoryNames()
         print '<?xml version="1.0"?>\n<streams ole-type="%s">' % strm.getName()
         if strm.error:
@@ -5,9 +5,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys, os.path, optparse
+import sys, os.path, optparse, types
 
-from msodumper import ole, xlsstream, globals, node, xlsmodel, olestream
+from msodumper import ole, xlsstream, globals, node, xlsmodel, olestream, formula
 from msodumper import xlsparser, msocrypto
 
 from msodumper.globals import error
@@ -36,9 +36,12 @@ def isCompObjStream (dirname):
 
 class XLDumper(object):
 
-    def __init__ (self, filepath, params):
+    def __init__ (self, filepath, params, sheet=None, jobs=None, memoize=False):
         self.filepath = filepath
         self.params = params
+        self.sheet = sheet # name or position of the only sheet to dump
+        self.jobs = jobs # number of processes building the workbook model
+        self.memoize = memoize # packrat memo table for the xml dump parser
         self.strm = None
         self.strmData = None
 
@@ -54,16 +57,34 @@ class XLDumper(object):
         print("-"*globals.OutputWidth)
 
     def __parseFile (self):
-        file = open(self.filepath, 'rb')
         self.strmData = xlsstream.StreamData()
-        self.strm = xlsstream.XLStream(file.read(), self.params, self.strmData)
-        file.close()
+        self.strm = xlsstream.XLStream(ole.mapFile(self.filepath), self.params, self.strmData)
+
+    def __selectSheet (self, dirstrm):
+        """Limit the Workbook stream to the globals substream and the sheet
+selected with --sheet, if any.  Return the position of the sheet (0 when
+reading all of them), or None if there's no such sheet."""
+        if self.sheet == None:
+            return 0
+        i = dirstrm.findSheet(self.sheet)
+        if i == None:
+            error("no sheet named or numbered '%s'\n"%self.sheet)
+            return None
+        if not dirstrm.selectSheet(i):
+            return None
+        return i
 
     def dumpXML (self):
+        """Dump the Workbook stream as xml.  Return False if the sheet
+selected with --sheet isn't there, True otherwise; the same holds for the
+other dump modes."""
         self.__parseFile()
+        success = True
         dirs = self.strm.getDirectoryEntries()
-        docroot = node.Root()
-        root = docroot.appendElement('xls-dump')
+        # the records are dumped as they are printed, so that they needn't
+        # all be held in memory.
+        printer = node.StreamPrinter(sys.stdout, utf8 = self.params.utf8)
+        printer.startElement('xls-dump')
 
         for d in dirs:
             if d.Name != "Workbook":
@@ -71,12 +92,17 @@ class XLDumper(object):
                 continue
 
             dirstrm = self.strm.getDirectoryStream(d)
+            if self.__selectSheet(dirstrm) == None:
+                success = False
+                continue
             data = self.__readSubStreamXML(dirstrm)
-            self.__dumpDataAsXML(data, root)
-        node.prettyPrint(sys.stdout, docroot, utf8 = self.params.utf8)
+            self.__printDataAsXML(data, printer)
+        printer.endElement()
+        return success
 
     def dumpCanonicalXML (self):
         self.__parseFile()
+        success = True
         docroot = node.Root()
         root = docroot.appendElement('xls-dump')
 
@@ -88,14 +114,20 @@ class XLDumper(object):
                 continue
 
             dirstrm = self.strm.getDirectoryStream(entry)
+            sheet = self.__selectSheet(dirstrm)
+            if sheet == None:
+                success = False
+                continue
             wbmodel = self.__buildWorkbookModel(dirstrm)
             wbmodel.encrypted = self.strmData.encrypted
             root.appendChild(wbmodel.createDOM())
 
         node.prettyPrint(sys.stdout, docroot, utf8 = self.params.utf8)
+        return success
 
     def dump (self):
         self.__parseFile()
+        success = True
         self.strm.printStreamInfo()
         self.strm.printHeader()
         self.strm.printMSAT()
@@ -114,9 +146,11 @@ class XLDumper(object):
                 continue
 
             elif dirname == "Workbook":
-                success = True
-                while success:
-                    success = self.__readSubStream(dirstrm)
+                if self.__selectSheet(dirstrm) == None:
+                    success = False
+                    continue
+                while self.__readSubStream(dirstrm):
+                    pass
 
             elif dirname == "Revision Log":
                 dirstrm.type = xlsstream.DirType.RevisionLog
@@ -138,6 +172,7 @@ class XLDumper(object):
                 self.__readCompObjStream(dirstrm)
             else:
                 globals.dumpBytes(dirstrm.bytes, 512)
+        return success
 
     def __readSubStream (self, strm):
         try:
@@ -160,35 +195,32 @@ class XLDumper(object):
         except olestream.CompObjStreamError:
             globals.error("failed to parse CompObj stream.\n")
 
-    def __dumpDataAsXML(self, data, root):
+    def __printDataAsXML(self, data, printer):
         if isinstance(data, tuple):
-            newRoot = root.appendElement(data[0])
             if isinstance(data[1], dict): # attrs
-                for key,val in data[1].iteritems():
-                    newRoot.setAttr(key, val)
+                printer.startElement(data[0], dict(data[1]))
                 if len(data) > 2: # data has a list of children
-                    self.__dumpDataAsXML(data[2], newRoot)
+                    self.__printDataAsXML(data[2], printer)
             else:
-                self.__dumpDataAsXML(data[1], newRoot)
-        elif isinstance(data, list):
+                printer.startElement(data[0])
+                self.__printDataAsXML(data[1], printer)
+            printer.endElement()
+        elif isinstance(data, list) or isinstance(data, types.GeneratorType):
             for x in data:
-                self.__dumpDataAsXML(x, root)
+                self.__printDataAsXML(x, printer)
         else:
             pass # we're skipping all unknown elems
 
     def __readSubStreamXML (self, strm):
-        handlers = []
-        try:
-            while True:
-                handler = strm.getNextRecordHandler()
-                handlers.append(handler)
-        except xlsstream.EndOfStream:
-            pass
-        parser = xlsparser.XlsParser(handlers)
+        parser = xlsparser.XlsParser(strm.getRecordTokens(), self.memoize)
         return parser.dumpData()
 
     def __buildWorkbookModel (self, strm):
         model = xlsmodel.Workbook()
+        if self.jobs != None and self.sheet == None:
+            strm.fillModelParallel(model, self.jobs)
+            return model
+
         try:
             while True:
                 strm.fillModel(model)
@@ -211,6 +243,20 @@ def main ():
         help="Catch exceptions and try to continue.")
     parser.add_option("--utf-8", action="store_true", dest="utf8", default=False,
         help="Output strings as UTF-8.")
+    parser.add_option("--max-dump-bytes", dest="max_dump_bytes", type="int", default=None, metavar="SIZE",
+        help="Hex dump at most SIZE bytes of each record or stream.")
+    parser.add_option("-o", "--output", dest="output", default=None, metavar="FILE",
+        help="Write the dump to FILE instead of standard output; it's gzip compressed if FILE ends with '.gz'.")
+    parser.add_option("--sheet", dest="sheet", default=None, metavar="SHEET",
+        help="Only dump the globals substream and the sheet named SHEET, or at position SHEET (counting from 0) if there's no sheet with that name.")
+    parser.add_option("--record-filter", dest="record_filter", default=None, metavar="RECORDS",
+        help="Only dump the records listed in RECORDS, separated by commas, by type, decimal or hexadecimal with a 0x prefix (e.g. 252 or 0x00FC), or by name (e.g. SST).  Only for the 'flat' dump mode.")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None, metavar="N",
+        help="Build the workbook model of the canonical-xml dump mode with N processes, each reading whole sheets.")
+    parser.add_option("--memoize", action="store_true", dest="memoize", default=False,
+        help="Remember the result of each grammar rule at each record in the 'xml' dump mode, so that no rule parses the same records twice.  Slower on typical files, but keeps the parse time linear in the record count.")
+    parser.add_option("--stats", action="store_true", dest="stats", default=False,
+        help="Print the lookup, hit and miss counts of the formula cache to standard error when done.  With --jobs, formulas parsed by the other processes aren't counted.")
     options, args = parser.parse_args()
     params = globals.params
     params.debug = options.debug
@@ -218,24 +264,39 @@ def main ():
     params.showStreamPos = options.show_stream_pos
     params.catchExceptions = options.catch_exceptions
     params.utf8 = options.utf8
+    params.maxDumpBytes = options.max_dump_bytes
+    if options.record_filter != None:
+        try:
+            params.dumpedIds = xlsstream.parseRecordFilter(options.record_filter)
+        except ValueError as e:
+            error("%s\n"%e)
+            parser.print_help()
+            sys.exit(1)
     
     if len(args) < 1:
         globals.error("takes at least one argument\n")
         parser.print_help()
         sys.exit(1)
 
-    dumper = XLDumper(args[0], params)
+    dumper = XLDumper(args[0], params, options.sheet, options.jobs, options.memoize)
     if options.dump_mode == 'flat':
-        dumper.dump()
+        dump = dumper.dump
     elif options.dump_mode == 'xml':
-        dumper.dumpXML()
+        dump = dumper.dumpXML
     elif options.dump_mode == 'canonical-xml' or options.dump_mode == 'cxml':
-        dumper.dumpCanonicalXML()
+        dump = dumper.dumpCanonicalXML
     else:
         error("unknown dump mode: '%s'\n"%options.dump_mode)
         parser.print_help()
         sys.exit(1)
 
+    with globals.outputTo(globals.createOutputSink(options.output)):
+        success = dump()
+    if options.stats:
+        sys.stderr.write(formula.formulaCache.getStatsText() + "\n")
+    if not success:
+        sys.exit(1)
+
 if __name__ == '__main__':
     main()
 